@@ -0,0 +1,453 @@
+# Streaming extraction of external (pulp and candlepin) task times from
+# dynflow_actions.
+#
+# dynflow_actions records can contain megabytes (or even hundreds of MBs) of
+# JSON in a single field, while we need just a few timestamps from the action
+# output. So the file is read in blocks: records of other dynflow plans are
+# skipped by just counting quotes till the end of the record, and for the
+# other records only the output field is decoded. Small outputs are parsed by
+# json module, big ones by a simple streaming scanner that keeps just the
+# values it needs.
+
+import codecs
+from dynflow_records import ExternalTask, \
+    convert_candlepin_datetime_to_seconds, convert_pulp_datetime_to_seconds
+import json
+from math import nan
+import re
+from run_stats import counters
+
+# columns of dynflow_actions we care about
+PLAN_COLUMN = 0
+ACTION_COLUMN = 1
+OUTPUT_COLUMN = 10
+
+# outputs up to this size are parsed by json module as a whole
+SMALL_OUTPUT = 1 << 20
+
+BLOCK_SIZE = 1 << 20
+
+# keys of pulp and candlepin tasks with created/started/finished times
+PULP_KEYS = ('pulp_created', 'started_at', 'finished_at')
+CANDLEPIN_KEYS = ('created', 'startTime', 'endTime')
+
+REGEXP_FIELD_END = re.compile(rb'[,\n]')
+REGEXP_JSON_SPECIAL = re.compile(r'["{}\[\]:,]')
+REGEXP_STRING_SPECIAL = re.compile(r'["\\]')
+
+# longest JSON string (key or value) the scanner keeps
+MAX_CAPTURE = 64
+
+# href of a pulp task, like
+# /pulp/api/v3/tasks/01926b28-cf33-7a80-afdc-3d0413d900f6/ (also with a pulp
+# domain, like /pulp/default/api/v3/tasks/..)
+REGEXP_PULP_TASK_HREF = re.compile(
+    rb'/api/v3/tasks/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-'
+    rb'[0-9a-f]{12})/')
+
+# longer than any match of REGEXP_PULP_TASK_HREF
+MAX_HREF = 64
+
+
+def _has_times(task, keys, unfinished):
+    """
+    Return True if the task (dict) has string times of all keys or, with
+    unfinished, at least of the first one (created) and no other value than
+    null of the others.
+    """
+    if unfinished:
+        return isinstance(task.get(keys[0]), str) and \
+            all(task.get(key) is None or isinstance(task.get(key), str)
+                for key in keys[1:])
+    return all(isinstance(task.get(key), str) for key in keys)
+
+
+class _CsvStream:
+    """
+    Reader of CSV records and fields from a binary file, holding at most a
+    block or two of the file in memory.
+    """
+
+    def __init__(self, _file):
+        self.file = _file
+        self.buf = b''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, need=1):
+        """
+        Make at least `need` bytes available from pos, if not at the end of
+        file. Return True if available.
+        """
+        while len(self.buf) - self.pos < need and not self.eof:
+            data = self.file.read(BLOCK_SIZE)
+            if not data:
+                self.eof = True
+                break
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        return len(self.buf) - self.pos >= need
+
+    def at_eof(self):
+        return not self._fill()
+
+    def peek(self, size):
+        self._fill(size)
+        return self.buf[self.pos:self.pos+size]
+
+    def skip_record(self):
+        """
+        Skip the rest of the record from a field boundary, i.e. till the first
+        newline outside a quoted field.
+        """
+        quoted = False
+        while self._fill():
+            newline = self.buf.find(b'\n', self.pos)
+            end = newline if newline >= 0 else len(self.buf)
+            if self.buf.count(b'"', self.pos, end) % 2:
+                quoted = not quoted
+            self.pos = end + 1 if newline >= 0 else end
+            if newline >= 0 and not quoted:
+                return
+
+    def stream_field(self):
+        """
+        Yield chunks of (unescaped) content of the field from pos. Then
+        self.delimiter is the field separator, newline or empty at the end of
+        file.
+        """
+        if self.peek(1) == b'"':
+            self.pos += 1
+            while self._fill():
+                quote = self.buf.find(b'"', self.pos)
+                if quote < 0:
+                    chunk = self.buf[self.pos:]
+                    self.pos = len(self.buf)
+                    yield chunk
+                    continue
+                chunk = self.buf[self.pos:quote]
+                self.pos = quote + 1
+                if chunk:
+                    yield chunk
+                # doubled quote is an escaped quote
+                if self.peek(1) == b'"':
+                    self.pos += 1
+                    yield b'"'
+                    continue
+                break
+        # (rest of) unquoted field
+        while self._fill():
+            match = REGEXP_FIELD_END.search(self.buf, self.pos)
+            if not match:
+                chunk = self.buf[self.pos:]
+                self.pos = len(self.buf)
+                yield chunk
+                continue
+            chunk = self.buf[self.pos:match.start()]
+            self.pos = match.end()
+            self.delimiter = match.group()
+            if chunk:
+                yield chunk.rstrip(b'\r') if self.delimiter == b'\n' \
+                    else chunk
+            return
+        self.delimiter = b''
+
+    def read_field(self):
+        return b''.join(self.stream_field()).decode('utf-8',
+                                                    errors='replace')
+
+    def skip_field(self):
+        for chunk in self.stream_field():
+            pass
+
+
+class _ExternalTasksScanner:
+    """
+    Streaming scanner of JSON text of an action output, collecting times of
+    pulp tasks (in 'pulp_tasks' and 'task_groups'/'tasks') and of candlepin
+    task ('task'). Only keys and values of interest are kept in memory. With
+    unfinished, also tasks not started or not finished yet are collected,
+    with None times.
+    """
+
+    def __init__(self, unfinished=False):
+        self.unfinished = unfinished
+        self.tasks = []
+        # stack of [container type, role, current key, collected values,
+        #           expecting a key]
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        # captured string (None when not capturing), is it a key?
+        self.capture = None
+        self.capture_key = False
+
+    def _child_role(self, container):
+        if len(self.stack) == 0:
+            return 'root' if container == '{' else None
+        parent_container, role, key = self.stack[-1][0:3]
+        if parent_container == '[':
+            return {('pulp_list', '{'): 'pulp_task',
+                    ('groups', '{'): 'group'}.get((role, container))
+        return {('root', 'pulp_tasks', '['): 'pulp_list',
+                ('root', 'task_groups', '['): 'groups',
+                ('root', 'task', '{'): 'candle_task',
+                ('group', 'tasks', '['): 'pulp_list'}.get(
+                    (role, key, container))
+
+    def _wanted_keys(self, role):
+        return {'pulp_task': PULP_KEYS,
+                'candle_task': CANDLEPIN_KEYS}.get(role, ())
+
+    def _start_string(self):
+        self.in_string = True
+        if len(self.stack) == 0 or self.stack[-1][0] != '{':
+            return
+        container, role, key, values, expect_key = self.stack[-1]
+        if expect_key and role is not None:
+            self.capture = ''
+            self.capture_key = True
+        elif not expect_key and key in self._wanted_keys(role):
+            self.capture = ''
+            self.capture_key = False
+
+    def _end_string(self):
+        self.in_string = False
+        if self.capture is None:
+            return
+        frame = self.stack[-1]
+        if self.capture_key:
+            frame[2] = self.capture
+        else:
+            frame[3][frame[2]] = self.capture
+        self.capture = None
+
+    def feed(self, text):
+        pos = 0
+        while pos < len(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if self.capture is not None:
+                        self.capture += text[pos]
+                    pos += 1
+                    continue
+                match = REGEXP_STRING_SPECIAL.search(text, pos)
+                end = match.start() if match else len(text)
+                if self.capture is not None:
+                    self.capture += text[pos:end]
+                    if len(self.capture) > MAX_CAPTURE:
+                        # neither a key nor a timestamp of our interest
+                        if self.capture_key:
+                            self.stack[-1][2] = None
+                        self.capture = None
+                if not match:
+                    return
+                pos = end + 1
+                if match.group() == '"':
+                    self._end_string()
+                else:
+                    self.escape = True
+                    if self.capture is not None:
+                        self.capture += '\\'
+                continue
+            match = REGEXP_JSON_SPECIAL.search(text, pos)
+            if not match:
+                return
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._start_string()
+            elif char in '{[':
+                role = self._child_role(char)
+                self.stack.append([char, role, None, {}, char == '{'])
+            elif char in '}]':
+                if len(self.stack) == 0:
+                    continue
+                container, role, key, values, expect_key = self.stack.pop()
+                keys = self._wanted_keys(role)
+                if keys and _has_times(values, keys, self.unfinished):
+                    who = 'pulp' if role == 'pulp_task' else 'candle'
+                    self.tasks.append((who,) + tuple(values.get(key)
+                                                     for key in keys))
+            elif char == ':':
+                if len(self.stack) > 0:
+                    frame = self.stack[-1]
+                    frame[4] = False
+                    # any other value than a string is not a timestamp
+                    if frame[2] in self._wanted_keys(frame[1]):
+                        frame[3][frame[2]] = None
+            elif char == ',':
+                if len(self.stack) > 0 and self.stack[-1][0] == '{':
+                    self.stack[-1][2] = None
+                    self.stack[-1][4] = True
+
+
+def _external_tasks_from_data(data, unfinished=False):
+    """
+    Return list of (who, created, started, finished) of pulp and candlepin
+    tasks from parsed action output. With unfinished, also of tasks not
+    started or not finished yet, with None times.
+    """
+    tasks = []
+
+    def add(who, task, keys):
+        if isinstance(task, dict) and _has_times(task, keys, unfinished):
+            tasks.append((who,) + tuple(task.get(key) for key in keys))
+
+    if not isinstance(data, dict):
+        return tasks
+    # pulp tasks
+    if isinstance(data.get('pulp_tasks'), list):
+        for task in data['pulp_tasks']:
+            add('pulp', task, PULP_KEYS)
+    # pulp task groups
+    if isinstance(data.get('task_groups'), list):
+        for group in data['task_groups']:
+            if isinstance(group, dict) and isinstance(group.get('tasks'),
+                                                      list):
+                for task in group['tasks']:
+                    add('pulp', task, PULP_KEYS)
+    # candlepin tasks
+    if 'task' in data:
+        add('candle', data['task'], CANDLEPIN_KEYS)
+    return tasks
+
+
+def _external_tasks_from_field(stream, unfinished=False):
+    """
+    Return list of (who, created, started, finished) of external tasks from
+    the output field at the current position of the stream, see
+    _external_tasks_from_data.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    chunks = []
+    size = 0
+    scanner = None
+    for chunk in stream.stream_field():
+        if scanner is None:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size <= SMALL_OUTPUT:
+                continue
+            # too big output, switch to the streaming scanner
+            scanner = _ExternalTasksScanner(unfinished)
+            chunk = b''.join(chunks)
+            chunks = None
+        scanner.feed(decoder.decode(chunk))
+    if scanner is not None:
+        scanner.feed(decoder.decode(b'', final=True))
+        counters['dynflow_actions: big outputs scanned'] += 1
+        return scanner.tasks
+    counters['dynflow_actions: outputs decoded'] += 1
+    try:
+        data = json.loads(b''.join(chunks).decode('utf-8', errors='replace'))
+    except json.decoder.JSONDecodeError:
+        counters['dynflow_actions: skipped bad JSON output'] += 1
+        return []
+    return _external_tasks_from_data(data, unfinished)
+
+
+def _iter_action_outputs(fname, dynflow_uuids=None):
+    """
+    Yield (dynflow_uuid, action_id, stream) of dynflow_actions records of
+    given dynflow plans (or of all plans if dynflow_uuids is None), with the
+    _CsvStream positioned at the output field. The caller consumes the field,
+    the rest of the record is then skipped.
+    """
+    read = other = 0
+    with open(fname, 'rb') as _file:
+        stream = _CsvStream(_file)
+        while not stream.at_eof():
+            read += 1
+            # check dynflow UUID in the first field, without reading a long
+            # first field of some broken record
+            head = stream.peek(64)
+            comma = head.find(b',')
+            if comma < 0 or b'"' in head[:comma] or b'\n' in head[:comma]:
+                counters['dynflow_actions: skipped broken record'] += 1
+                stream.skip_record()
+                continue
+            dynflow_uuid = head[:comma].decode('utf-8', errors='replace')
+            if dynflow_uuids is not None and dynflow_uuid not in dynflow_uuids:
+                other += 1
+                stream.skip_record()
+                continue
+            stream.pos += comma + 1
+            action_id = stream.read_field()
+            column = ACTION_COLUMN + 1
+            while column < OUTPUT_COLUMN and stream.delimiter == b',':
+                stream.skip_field()
+                column += 1
+            # ignore incomplete records
+            if stream.delimiter != b',':
+                counters['dynflow_actions: skipped incomplete record'] += 1
+                continue
+            yield dynflow_uuid, action_id, stream
+            if stream.delimiter == b',':
+                stream.skip_record()
+    counters['dynflow_actions: records read'] += read
+    counters['dynflow_actions: skipped other task'] += other
+
+
+def iter_external_tasks(fname, dynflow_uuids=None, unfinished=False):
+    """
+    Yield ExternalTask of all pulp and candlepin tasks found in outputs of
+    dynflow_actions of given dynflow plans (or of all plans if
+    dynflow_uuids is None). Tasks with unparsable times are skipped. With
+    unfinished, also tasks not started or not finished yet are yielded, with
+    NaN started and/or finished time.
+    """
+    for dynflow_uuid, action_id, stream in _iter_action_outputs(
+            fname, dynflow_uuids):
+        tasks = _external_tasks_from_field(stream, unfinished)
+        for who, created, started, finished in tasks:
+            convert = convert_pulp_datetime_to_seconds if who == 'pulp' \
+                else convert_candlepin_datetime_to_seconds
+            try:
+                times = tuple(convert(ts) if ts is not None else nan
+                              for ts in (created, started, finished))
+            except ValueError:
+                counters['dynflow_actions: skipped external task with bad '
+                         'timestamp'] += 1
+                continue
+            counters['dynflow_actions: external tasks found'] += 1
+            yield ExternalTask(dynflow_uuid, action_id, who, *times)
+
+
+def _pulp_task_uuids_from_field(stream):
+    """
+    Return set of UUIDs of pulp tasks referenced by their href in the output
+    field at the current position of the stream. The field is just searched
+    for the hrefs in blocks of up to SMALL_OUTPUT size, without decoding its
+    JSON.
+    """
+    uuids = set()
+    chunks = []
+    size = 0
+    for chunk in stream.stream_field():
+        chunks.append(chunk)
+        size += len(chunk)
+        if size <= SMALL_OUTPUT:
+            continue
+        data = b''.join(chunks)
+        uuids.update(REGEXP_PULP_TASK_HREF.findall(data))
+        # an href can be split between the blocks
+        chunks = [data[-MAX_HREF:]]
+        size = len(chunks[0])
+    uuids.update(REGEXP_PULP_TASK_HREF.findall(b''.join(chunks)))
+    return set(uuid.decode() for uuid in uuids)
+
+
+def iter_pulp_task_uuids(fname):
+    """
+    Yield (dynflow_uuid, action_id, pulp task UUID) of all pulp tasks
+    referenced (like in 'pulp_tasks' or 'task_groups') by outputs of
+    dynflow_actions.
+    """
+    found = 0
+    for dynflow_uuid, action_id, stream in _iter_action_outputs(fname):
+        for uuid in _pulp_task_uuids_from_field(stream):
+            found += 1
+            yield dynflow_uuid, action_id, uuid
+    counters['dynflow_actions: pulp task hrefs found'] += found
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+#
+# Load a sosreport once and answer many queries about it: blame of tasks,
+# sidekiq load and the busiest dynflow step labels within time windows, and
+# delayed pollings of pulp tasks. Queries are typed in an interactive shell,
+# or sent as HTTP GET requests to a local JSON endpoint with --serve.
+
+import argparse
+from bisect import bisect_left, bisect_right
+import cmd
+import json
+import shlex
+from datetime import *
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os.path import isdir, isfile, join
+from time import perf_counter
+from urllib.parse import parse_qs, urlparse
+from actions_reader import iter_external_tasks
+from dynflow_records import Step, convert_cmdline_time_to_seconds
+from polling_log import PollingChecker, read_polling_multiplier, \
+    rotated_logfiles, sosreport_logfiles
+from sidekiq_load import LoadWindows, load_steps
+from task_blame import TaskBlame, iter_tasks, now, print_header, \
+    print_metric
+
+FOREMAN_DIR = 'sos_commands/foreman'
+
+# queries: their parameters, first the positional ones of the shell commands
+QUERIES = {'blame': ('uuid',),
+           'heat': ('from', 'to'),
+           'labels': ('from', 'to', 'limit', 'by'),
+           'polling': ('from', 'to'),
+           }
+
+
+class QueryError(Exception):
+    pass
+
+
+def format_ts(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(' ', 'seconds')
+
+
+class Session:
+    """
+    Data of a sosreport loaded into memory and indexed once: foreman tasks
+    per UUID, dynflow steps (with their rows per dynflow plan and their load
+    over time, see LoadWindows), external tasks per dynflow plan and delayed
+    pollings ordered by time, so queries of time windows are answered by
+    binary searches. Results of queries are also kept in LRU caches keyed by
+    the query parameters.
+    """
+
+    def __init__(self, sosreport_dir, jobs=1, cache=False, multiplier=None,
+                 rounding_error=2, evict_after=86400, cache_size=256):
+        fdir = join(sosreport_dir, FOREMAN_DIR)
+        # (foreman_uuid, dynflow_uuid, label, state, duration) of tasks keyed
+        # by both their foreman and dynflow UUIDs
+        self.tasks = {}
+        fname = join(fdir, 'foreman_tasks_tasks')
+        if isfile(fname):
+            print(f"Loading {fname}..")
+            for duration, foreman_uuid, dynflow_uuid, label, state in \
+                    iter_tasks(fname, [], [], 0, float('inf')):
+                task = (foreman_uuid, dynflow_uuid, label, state, duration)
+                self.tasks[foreman_uuid] = task
+                self.tasks[dynflow_uuid] = task
+
+        self.steps = None
+        self.load_windows = None
+        # rows of self.steps per dynflow plan UUID
+        self.plan_rows = {}
+        # the default query window, all the steps if known
+        self.first = 0
+        self.last = now
+        fname = join(fdir, 'dynflow_steps')
+        if isfile(fname):
+            print(f"Loading {fname}..")
+            self.steps = load_steps(fname, 0, float('inf'), jobs, cache)
+            rows = {}
+            for row, plan_id in enumerate(self.steps.plan):
+                rows.setdefault(plan_id, []).append(row)
+            self.plan_rows = {self.steps.plans[plan_id]: plan_rows
+                              for plan_id, plan_rows in rows.items()}
+            print("Indexing dynflow_steps..")
+            self.load_windows = LoadWindows(self.steps)
+            self.first = min(self.steps.start, default=0)
+            self.last = max((finish for finish in self.steps.finish
+                             if finish == finish), default=now)
+
+        # ExternalTask records per dynflow plan UUID
+        self.external_tasks = {}
+        fname = join(fdir, 'dynflow_actions')
+        if isfile(fname):
+            print(f"Loading {fname}..")
+            for task in iter_external_tasks(fname):
+                self.external_tasks.setdefault(task.plan, []).append(task)
+
+        # (time of the delayed poll due, task_id, previous poll, poll,
+        # delay) of delayed pollings, ordered by time
+        self.maxdelay = 16 * (multiplier or
+                              read_polling_multiplier(sosreport_dir) or 1) + \
+            rounding_error
+        self.delays = []
+        for _file in sosreport_logfiles(sosreport_dir):
+            checker = PollingChecker(self.maxdelay, evict_after)
+            for logfile in rotated_logfiles(_file):
+                print(f"Loading {logfile}..")
+                for task_id, prev, poll, delay in \
+                        checker.check_logfile(logfile):
+                    due = prev.timestamp() + self.maxdelay
+                    self.delays.append((due, task_id, prev, poll, delay))
+        self.delays.sort(key=lambda x: x[0])
+        self.delays_due = [delay[0] for delay in self.delays]
+
+        self.cached = {name: lru_cache(maxsize=cache_size)(
+                           getattr(self, f'_{name}'))
+                       for name in QUERIES.keys()}
+
+    def query(self, name, params):
+        """
+        Return JSON serializable result of the query with params dict of
+        strings (like from the command line or URL). Raise QueryError for
+        invalid queries.
+        """
+        if name not in QUERIES.keys():
+            raise QueryError(f"unknown query '{name}', use one of: "
+                             f"{', '.join(QUERIES.keys())}")
+        unknown = set(params.keys()) - set(QUERIES[name])
+        if unknown:
+            raise QueryError(f"unknown parameter(s) of {name}: "
+                             f"{', '.join(sorted(unknown))}")
+        if name == 'blame':
+            if 'uuid' not in params:
+                raise QueryError("blame requires uuid")
+            return self.cached['blame'](params['uuid'])
+        if self.steps is None and name in ('heat', 'labels'):
+            raise QueryError("no dynflow_steps in the sosreport")
+        try:
+            from_ts = convert_cmdline_time_to_seconds(params['from']) \
+                if 'from' in params else self.first
+            to_ts = convert_cmdline_time_to_seconds(params['to']) \
+                if 'to' in params else self.last
+        except ValueError as err:
+            raise QueryError(f"invalid time: {err}")
+        if to_ts <= from_ts:
+            raise QueryError("'to' must be after 'from'")
+        if name == 'labels':
+            try:
+                limit = int(params.get('limit', 10))
+            except ValueError:
+                raise QueryError("limit must be a number")
+            by = params.get('by', 'exectime')
+            if by not in ('exectime', 'count'):
+                raise QueryError("by must be 'exectime' or 'count'")
+            return self.cached['labels'](from_ts, to_ts, limit, by)
+        return self.cached[name](from_ts, to_ts)
+
+    def cache_info(self):
+        return {name: cached.cache_info()._asdict()
+                for name, cached in self.cached.items()}
+
+    def _blame(self, uuid):
+        if uuid not in self.tasks:
+            raise QueryError(f"no foreman or dynflow task with id {uuid}")
+        foreman_uuid, dynflow_uuid, label, state, duration = self.tasks[uuid]
+        task = TaskBlame(foreman_uuid, dynflow_uuid)
+        steps = self.steps
+        for row in self.plan_rows.get(dynflow_uuid, ()):
+            finish = steps.finish[row]
+            realtime = steps.realtime[row]
+            # ignore incomplete data (NaN)
+            if realtime != realtime or finish != finish:
+                continue
+            task.add_step(Step(dynflow_uuid, str(steps.action[row]),
+                               steps.start[row], finish, realtime,
+                               steps.exectime[row],
+                               steps.labels[steps.label[row]]))
+        for external_task in self.external_tasks.get(dynflow_uuid, ()):
+            task.add_external_task(external_task)
+        result = {'foreman_uuid': foreman_uuid,
+                  'dynflow_uuid': dynflow_uuid,
+                  'label': label,
+                  'state': state,
+                  'duration': duration}
+        if len(task.timestamps) > 0:
+            absolute_blame_intervals, relative_blame_intervals = \
+                task.blame()
+            result.update({'absolute': task.absolute_times,
+                           'absolute-blame': absolute_blame_intervals,
+                           'relative-blame': relative_blame_intervals})
+        return result
+
+    def _heat(self, from_ts, to_ts):
+        load_windows = self.load_windows
+        result = {'from': from_ts, 'to': to_ts,
+                  'steps': load_windows.steps(from_ts, to_ts)}
+        if result['steps'] == 0:
+            return result
+        max_steps, max_load, max_load_at = load_windows.peak(from_ts, to_ts)
+        exectime = load_windows.exectime(from_ts, to_ts)
+        result.update({'exectime': exectime,
+                       'avg_load': exectime / (to_ts-from_ts),
+                       'max_concurrent_steps': int(max_steps),
+                       'max_load': max_load,
+                       'max_load_at': max_load_at})
+        return result
+
+    def _labels(self, from_ts, to_ts, limit, by):
+        labels = self.load_windows.label_summaries(from_ts, to_ts)
+        top = sorted(labels.items(), key=lambda x: x[1][by],
+                     reverse=True)[0:limit]
+        return [{'label': label, 'count': stats['count'],
+                 'exectime': stats['exectime']} for label, stats in top]
+
+    def _polling(self, from_ts, to_ts):
+        first = bisect_left(self.delays_due, from_ts)
+        last = bisect_right(self.delays_due, to_ts)
+        return [{'task': task_id,
+                 'polled_at': prev.isoformat(),
+                 'next_poll_at': poll.isoformat(),
+                 'delay': delay}
+                for due, task_id, prev, poll, delay in
+                self.delays[first:last]]
+
+
+def print_result(name, result):
+    if name == 'blame':
+        print_header(result['foreman_uuid'])
+        if 'absolute' not in result:
+            print("No dynflow step found, nothing to blame.")
+            return
+        print_metric("absolute times", result['absolute'])
+        print_metric("abs.blame times", result['absolute-blame'])
+        print_metric("relative blame times", result['relative-blame'])
+    elif name == 'heat':
+        print(f"from {format_ts(result['from'])} to {format_ts(result['to'])}"
+              f": {result['steps']} steps")
+        if result['steps'] > 0:
+            print(f"exec.time {result['exectime']:,.2f}s, average sidekiq "
+                  f"load {result['avg_load']:.2f}, max. concurrent steps "
+                  f"{result['max_concurrent_steps']}, max. sidekiq load "
+                  f"{result['max_load']:.2f} at "
+                  f"{format_ts(result['max_load_at'])}")
+    elif name == 'labels':
+        print(f"{'steps':<8}{'exec.time':<10}label")
+        for label in result:
+            print(f"{label['count']:<8}{label['exectime']:<10,.2f}"
+                  f"{label['label']}")
+    elif name == 'polling':
+        for delay in result:
+            print(f"Task '{delay['task']}' polled at '{delay['polled_at']}' "
+                  f"and then at '{delay['next_poll_at']}', delay "
+                  f"{delay['delay']}s")
+        print(f"{len(result)} delayed pollings")
+
+
+class SessionShell(cmd.Cmd):
+    intro = "Type help or ? to list commands."
+    prompt = "(session) "
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def _run(self, name, params):
+        """
+        Run the query, print its result and time.
+        """
+        start = perf_counter()
+        try:
+            result = self.session.query(name, params)
+        except QueryError as err:
+            print(f"Error: {err}")
+            return
+        print_result(name, result)
+        print(f"({(perf_counter()-start)*1000:.1f} ms)")
+
+    def _query(self, name, arg):
+        """
+        Run the query with positional (and key=value) parameters from the
+        command line.
+        """
+        try:
+            tokens = shlex.split(arg)
+        except ValueError as err:
+            print(f"Error: {err}")
+            return
+        params = {}
+        positional = list(QUERIES[name])
+        for token in tokens:
+            key, sep, value = token.partition('=')
+            if sep and key in QUERIES[name]:
+                params[key] = value
+            elif positional:
+                params[positional.pop(0)] = token
+            else:
+                print(f"Error: too many arguments of {name}")
+                return
+        self._run(name, params)
+
+    def do_blame(self, arg):
+        """blame UUID..: blame duration of foreman or dynflow task(s)"""
+        for uuid in arg.split():
+            self._run('blame', {'uuid': uuid})
+
+    def do_heat(self, arg):
+        """heat [FROM [TO]]: sidekiq load within the time window, times as
+        seconds since Epoch or quoted '%Y-%m-%d[ %H:%M:%S]'"""
+        self._query('heat', arg)
+
+    def do_labels(self, arg):
+        """labels [FROM [TO [LIMIT [exectime|count]]]]: the busiest dynflow
+        step labels within the time window, also as limit=N or by=count"""
+        self._query('labels', arg)
+
+    def do_polling(self, arg):
+        """polling [FROM [TO]]: delayed pollings of pulp tasks due within the
+        time window"""
+        self._query('polling', arg)
+
+    def do_cache(self, arg):
+        """cache: statistics of the query results cache"""
+        for name, info in self.session.cache_info().items():
+            print(f"{name:<10}{info['hits']:>8} hits{info['misses']:>8} "
+                  f"misses{info['currsize']:>8} cached")
+
+    def do_quit(self, arg):
+        """quit: end the session"""
+        return True
+
+    def do_EOF(self, arg):
+        print()
+        return True
+
+    def emptyline(self):
+        # do not repeat the last query
+        pass
+
+
+def serve(session, port):
+    """
+    Serve queries as GET /<query>?<param>=<value>&.. on localhost, with
+    JSON responses.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = url.path.strip('/')
+            params = {key: values[-1]
+                      for key, values in parse_qs(url.query).items()}
+            status = 200
+            try:
+                if name == 'cache':
+                    result = session.cache_info()
+                else:
+                    result = session.query(name, params)
+            except QueryError as err:
+                status = 400
+                result = {'error': str(err)}
+            body = json.dumps(result).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    print(f"Serving queries on http://127.0.0.1:{port}/ "
+          f"({', '.join(list(QUERIES.keys()) + ['cache'])})..")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+
+
+parser = argparse.ArgumentParser(description="Load a sosreport once and "
+                                             "answer many blame, sidekiq "
+                                             "load and polling queries")
+parser.add_argument("sosreport_dir",
+                    help="sosreport directory")
+parser.add_argument("--serve",
+                    type=int,
+                    metavar="PORT",
+                    help="Instead of the interactive shell, serve queries "
+                         "as HTTP GET requests with JSON responses on this "
+                         "port of localhost")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing dynflow_steps in "
+                         "parallel")
+parser.add_argument("--cache",
+                    action="store_true",
+                    help="Use parsed dynflow_steps cached in "
+                         "dynflow_steps.cache, create or refresh the cache if "
+                         "needed")
+parser.add_argument("--poll-multiplier", "--multiplier", "-m",
+                    type=int,
+                    dest="multiplier",
+                    help="Set or override foreman_tasks_polling_multiplier")
+parser.add_argument("--add-rounding-error", "-a",
+                    type=int,
+                    default=2,
+                    help="Allow small delay in polling frequency caused by "
+                         "rounding errors, like check_dynflow_polling.py")
+parser.add_argument("--results-cache",
+                    type=int,
+                    default=256,
+                    help="Number of results of each query type kept in the "
+                         "LRU cache")
+
+args = parser.parse_args()
+if not isdir(args.sosreport_dir):
+    parser.error(f"{args.sosreport_dir} is not a directory")
+
+start = perf_counter()
+session = Session(args.sosreport_dir, args.jobs, args.cache, args.multiplier,
+                  args.add_rounding_error, cache_size=args.results_cache)
+print(f"Loaded in {perf_counter()-start:.1f}s.")
+print()
+if args.serve is not None:
+    serve(session, args.serve)
+else:
+    SessionShell(session).cmdloop()
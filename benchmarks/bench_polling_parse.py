@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Benchmark of parsing access logs for polling of pulp tasks: lines per second
+# of the original "regexp and strptime on every line" approach versus the
+# current one from polling_log module.
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from polling_log import parse_pulptask_poll, parse_timestamp  # noqa: E402
+
+# the original approach, kept here as the baseline
+LEGACY_REGEXP_GET_PULPTASK = re.compile(
+        r".*\[(.*)\] \"GET /pulp/api/v3/tasks/(.*)/ .*")
+LEGACY_TS_FORMAT = '%d/%b/%Y:%H:%M:%S'
+
+OTHER_REQUESTS = [
+    'GET /rhsm/consumers/{}/certificates/serials HTTP/1.1" 200 1234 "-" '
+    '"RHSM/1.0 (cmd=rhsmcertd-worker)"',
+    'PUT /rhsm/consumers/{}/profiles HTTP/1.1" 200 10 "-" '
+    '"RHSM/1.0 (cmd=rhsmcertd-worker)"',
+    'GET /pulp/api/v3/content/rpm/packages/?repository_version={} HTTP/1.1" '
+    '200 4213 "-" "OpenAPI-Generator/3.39.2/ruby"',
+    'POST /api/v2/hosts/{}/facts HTTP/1.1" 201 512 "-" "Ruby"',
+]
+
+
+def generate_access_log(fname, lines, pulp_ratio, seed):
+    random.seed(seed)
+    ts = datetime(2024, 10, 8, 10, 0, 0)
+    tasks = [str(uuid.UUID(int=random.getrandbits(128))) for i in range(200)]
+    with open(fname, 'w') as _file:
+        for i in range(lines):
+            # ~ 100 requests per second
+            if random.random() < 0.01:
+                ts += timedelta(seconds=1)
+            ts_str = ts.strftime(LEGACY_TS_FORMAT)
+            if random.random() < pulp_ratio:
+                request = f'GET /pulp/api/v3/tasks/{random.choice(tasks)}/ ' \
+                          f'HTTP/1.1" 200 559 "-" ' \
+                          f'"OpenAPI-Generator/3.39.2/ruby"'
+            else:
+                request = random.choice(OTHER_REQUESTS).format(
+                    uuid.UUID(int=random.getrandbits(128)))
+            _file.write(f'192.168.{i % 256}.{i % 199} - - [{ts_str} +0200] '
+                        f'"{request}\n')
+
+
+def legacy_scan(fname):
+    polls = 0
+    with open(fname, encoding="utf-8", errors="replace") as _file:
+        for line in _file:
+            match = LEGACY_REGEXP_GET_PULPTASK.match(line)
+            if match:
+                datetime.strptime(match.group(1)[:20], LEGACY_TS_FORMAT)
+                polls += 1
+    return polls
+
+
+def current_scan(fname):
+    polls = 0
+    with open(fname, encoding="utf-8", errors="replace") as _file:
+        for line in _file:
+            if parse_pulptask_poll(line) is not None:
+                polls += 1
+    return polls
+
+
+parser = argparse.ArgumentParser(description="Benchmark of access log parsing "
+                                             "for polling of pulp tasks")
+parser.add_argument("--lines",
+                    type=int,
+                    default=2000000,
+                    help="Number of lines of the synthetic access log")
+parser.add_argument("--pulp-ratio",
+                    type=float,
+                    default=0.01,
+                    help="Ratio of lines with polling of pulp tasks")
+parser.add_argument("--seed",
+                    type=int,
+                    default=1,
+                    help="Seed of the random generator")
+parser.add_argument("--log",
+                    type=str,
+                    help="Use (or generate if missing) this access log "
+                         "instead of a temporary one")
+
+args = parser.parse_args()
+
+fname = args.log
+if fname is None:
+    fd, fname = tempfile.mkstemp(prefix='bench_access_log_')
+    os.close(fd)
+    os.unlink(fname)
+if not os.path.isfile(fname):
+    print(f"Generating {args.lines:,} lines of synthetic access log {fname}..")
+    generate_access_log(fname, args.lines, args.pulp_ratio, args.seed)
+with open(fname, 'rb') as _file:
+    lines = sum(1 for line in _file)
+
+results = []
+for name, scan in (("before", legacy_scan), ("after", current_scan)):
+    parse_timestamp.cache_clear()
+    start = time.perf_counter()
+    polls = scan(fname)
+    duration = time.perf_counter() - start
+    results.append(duration)
+    print(f"{name:<8}{lines/duration:>14,.0f} lines/s  {duration:>8.2f}s  "
+          f"{polls:,} polls found")
+print(f"speedup {results[0]/results[1]:>13.2f}x")
+
+if args.log is None:
+    os.unlink(fname)
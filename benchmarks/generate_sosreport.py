@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+#
+# Generator of a synthetic sosreport for benchmarks: foreman_tasks_tasks,
+# dynflow_steps and dynflow_actions (with pulp 'pulp_tasks'/'task_groups' and
+# candlepin 'task' outputs) like exported by sosreport, plus the httpd access
+# log with polling of the pulp tasks and foreman settings.
+#
+# Tasks arrive at the rate giving the requested average concurrency (per
+# Little's law: rate = concurrency / mean task duration), and durations of
+# their steps follow the chosen distribution. Everything is written
+# streamingly, so even sosreports with tens of millions of rows can be
+# generated in a constant memory.
+
+import argparse
+import heapq
+import json
+import os
+import random
+import uuid
+from datetime import date, timedelta
+from functools import lru_cache
+from math import log
+
+# 2024-09-04 00:00:00 UTC
+BASE_TS = 1725408000
+
+FOREMAN_DIR = 'sos_commands/foreman'
+ACCESS_LOG = 'var/log/httpd/foreman-ssl_access_ssl.log'
+SETTINGS_FILE = f'{FOREMAN_DIR}/foreman_settings_table'
+
+TASKS_HEADER = 'id,type,label,started_at,ended_at,state,result,external_id,' \
+               'parent_task_id,start_at,start_before,action,user_id,' \
+               'state_updated_at\n'
+STEPS_HEADER = 'execution_plan_uuid,id,action_id,state,started_at,ended_at,' \
+               'real_time,execution_time,progress_done,progress_weight,' \
+               'class,action_class,execution_plan_uuid,children,error,' \
+               'queue\n'
+ACTIONS_HEADER = 'execution_plan_uuid,id,data,caller_execution_plan_id,' \
+                 'caller_action_id,class,plan_step_id,run_step_id,' \
+                 'finalize_step_id,label,output,input\n'
+
+# task label, relative frequency, and its steps as (action class, external
+# task kind, duration relative to --mean-step-duration, ratio of execution
+# time to real time); kind is 'pulp', 'pulp_groups', 'candle' or None
+TASK_TYPES = [
+    ('Actions::Katello::Host::UploadPackageProfile', 40,
+     [('Actions::Katello::Host::UploadPackageProfile', None, 0.5, 0.9)]),
+    ('Actions::RemoteExecution::RunHostJob', 20,
+     [('Actions::RemoteExecution::RunHostJob', None, 0.5, 0.3)]),
+    ('Actions::Katello::Repository::Sync', 10,
+     [('Actions::Pulp3::Repository::Sync', 'pulp', 4, 0.05),
+      ('Actions::Pulp3::Repository::SaveVersion', None, 0.2, 0.9),
+      ('Actions::Pulp3::Orchestration::Repository::GenerateMetadata', 'pulp',
+       1, 0.05),
+      ('Actions::Katello::Repository::IndexContent', None, 2, 0.95)]),
+    ('Actions::Katello::CapsuleContent::Sync', 5,
+     [('Actions::Pulp3::CapsuleContent::Sync', 'pulp', 5, 0.05),
+      ('Actions::Pulp3::CapsuleContent::GenerateMetadata', 'pulp', 1, 0.05),
+      ('Actions::Katello::CapsuleContent::UpdateContentCounts', None, 1,
+       0.95)]),
+    ('Actions::Katello::ContentView::Publish', 3,
+     [('Actions::Katello::ContentView::Publish', None, 0.2, 0.9),
+      ('Actions::Pulp3::Repository::MultiCopyAllUnits', 'pulp_groups', 3,
+       0.05),
+      ('Actions::Pulp3::Orchestration::Repository::GenerateMetadata', 'pulp',
+       1, 0.05),
+      ('Actions::Katello::Repository::IndexContent', None, 1.5, 0.95),
+      ('Actions::Katello::ContentView::Finalize', None, 0.2, 0.9)]),
+    ('Actions::Katello::Organization::ManifestRefresh', 1,
+     [('Actions::Candlepin::Owner::UpstreamExport', 'candle', 2, 0.2),
+      ('Actions::Candlepin::Owner::Import', 'candle', 3, 0.2),
+      ('Actions::Katello::Organization::ManifestRefresh', None, 1, 0.9)]),
+]
+
+# dynflow polls external tasks after these intervals (times the polling
+# multiplier), then repeatedly after the last one
+POLL_INTERVALS = [0.5, 1, 2, 4, 8, 16]
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+          'Oct', 'Nov', 'Dec']
+
+OTHER_REQUESTS = [
+    'GET /rhsm/consumers/{}/certificates/serials HTTP/1.1" 200 1234 "-" '
+    '"RHSM/1.0 (cmd=rhsmcertd-worker)"',
+    'PUT /rhsm/consumers/{}/profiles HTTP/1.1" 200 10 "-" '
+    '"RHSM/1.0 (cmd=rhsmcertd-worker)"',
+    'GET /pulp/api/v3/content/rpm/packages/?repository_version={} HTTP/1.1" '
+    '200 4213 "-" "OpenAPI-Generator/3.39.2/ruby"',
+    'POST /api/v2/hosts/{}/facts HTTP/1.1" 201 512 "-" "Ruby"',
+]
+
+DISTRIBUTIONS = ('exponential', 'lognormal', 'pareto', 'uniform')
+
+
+@lru_cache(maxsize=1024)
+def _day(days):
+    return date(1970, 1, 1) + timedelta(days=days)
+
+
+def _split_ts(ts):
+    days, seconds = divmod(ts, 86400)
+    micro = int(seconds * 1000000)
+    seconds, micro = divmod(micro, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return _day(int(days)), hours, minutes, seconds, micro
+
+
+def format_ts(ts):
+    # like '2024-09-04 07:45:00.123456'
+    day, hours, minutes, seconds, micro = _split_ts(ts)
+    return f'{day} {hours:02d}:{minutes:02d}:{seconds:02d}.{micro:06d}'
+
+
+def format_pulp_ts(ts):
+    # like '2024-09-04T07:45:00.123456Z'
+    day, hours, minutes, seconds, micro = _split_ts(ts)
+    return f'{day}T{hours:02d}:{minutes:02d}:{seconds:02d}.{micro:06d}Z'
+
+
+def format_candlepin_ts(ts):
+    # like '2024-09-04T07:45:00+0000'
+    day, hours, minutes, seconds, micro = _split_ts(ts)
+    return f'{day}T{hours:02d}:{minutes:02d}:{seconds:02d}+0000'
+
+
+def format_access_log_ts(ts):
+    # like '04/Sep/2024:07:45:00 +0000'
+    day, hours, minutes, seconds, micro = _split_ts(ts)
+    return f'{day.day:02d}/{MONTHS[day.month-1]}/{day.year}:' \
+           f'{hours:02d}:{minutes:02d}:{seconds:02d} +0000'
+
+
+def csv_quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+class _Generator:
+
+    def __init__(self, destdir, steps, concurrency, distribution,
+                 mean_step_duration, multiplier, missed_polls, noise,
+                 input_size, seed):
+        self.destdir = destdir
+        self.steps = steps
+        self.distribution = distribution
+        self.mean_step_duration = mean_step_duration
+        self.multiplier = multiplier
+        self.missed_polls = missed_polls
+        self.noise = noise
+        self.input_size = input_size
+        self.random = random.Random(seed)
+        self.weights = [weight for label, weight, actions in TASK_TYPES]
+        # mean task duration (without waiting between steps) gives the rate
+        # of new tasks for the requested concurrency
+        mean_task = sum(weight * sum(scale for action, kind, scale, ratio
+                                     in actions)
+                        for label, weight, actions in TASK_TYPES) / \
+            sum(self.weights) * mean_step_duration
+        self.mean_gap = mean_task / concurrency
+        # pending polls as (timestamp, request) ordered by time
+        self.polls = []
+        self.counts = {'foreman_tasks_tasks': 0, 'dynflow_steps': 0,
+                       'dynflow_actions': 0, 'access_log': 0}
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def duration(self, mean):
+        rnd = self.random
+        if self.distribution == 'exponential':
+            return rnd.expovariate(1 / mean)
+        if self.distribution == 'lognormal':
+            sigma = 1.0
+            return rnd.lognormvariate(log(mean) - sigma**2 / 2, sigma)
+        if self.distribution == 'pareto':
+            alpha = 2.5
+            return mean * (alpha-1) / alpha * rnd.paretovariate(alpha)
+        return rnd.uniform(0, 2 * mean)
+
+    def schedule_polls(self, path, start, end):
+        """
+        Schedule polls of the pulp resource at path from start till end,
+        some of them missed (delayed) per --missed-polls.
+        """
+        rnd = self.random
+        ts = start
+        i = 0
+        while True:
+            interval = POLL_INTERVALS[min(i, len(POLL_INTERVALS)-1)] * \
+                self.multiplier
+            i += 1
+            ts += interval
+            if rnd.random() < self.missed_polls:
+                ts += interval * rnd.uniform(1, 5)
+            if ts >= end:
+                break
+            heapq.heappush(self.polls, (ts, path))
+        # the last poll finds the task finished
+        heapq.heappush(self.polls, (end, path))
+
+    def flush_polls(self, till, access_log):
+        """
+        Write the access log lines of polls (and other requests around them)
+        scheduled up to till.
+        """
+        rnd = self.random
+        lines = []
+        while self.polls and self.polls[0][0] <= till:
+            ts, path = heapq.heappop(self.polls)
+            ts_str = format_access_log_ts(ts)
+            lines.append(f'192.168.0.1 - - [{ts_str}] "GET {path} HTTP/1.1" '
+                         f'200 559 "-" "OpenAPI-Generator/3.39.2/ruby"\n')
+            for i in range(self.noise):
+                request = rnd.choice(OTHER_REQUESTS).format(
+                    rnd.getrandbits(32))
+                lines.append(f'10.{i % 256}.{rnd.getrandbits(8)}.'
+                             f'{rnd.getrandbits(8)} - - [{ts_str}] '
+                             f'"{request}\n')
+        self.counts['access_log'] += len(lines)
+        access_log.writelines(lines)
+
+    def action_output(self, kind, start, realtime):
+        """
+        Return JSON output of an action with external task(s) of the kind
+        running within the step, and schedule their polling.
+        """
+        rnd = self.random
+        created = start + realtime * 0.02
+        started = created + realtime * 0.1 * rnd.random()
+        finished = start + realtime * 0.95
+        if kind == 'candle':
+            return {'task': {'id': self.uuid().replace('-', ''),
+                             'state': 'FINISHED',
+                             'created': format_candlepin_ts(created),
+                             'startTime': format_candlepin_ts(started),
+                             'endTime': format_candlepin_ts(finished)}}
+
+        def pulp_task():
+            task_uuid = self.uuid()
+            return {'pulp_href': f'/pulp/api/v3/tasks/{task_uuid}/',
+                    'pulp_created': format_pulp_ts(created),
+                    'state': 'completed',
+                    'name': 'pulpcore.app.tasks.base.general_update',
+                    'started_at': format_pulp_ts(started),
+                    'finished_at': format_pulp_ts(finished)}
+
+        if kind == 'pulp':
+            task = pulp_task()
+            self.schedule_polls(task['pulp_href'], created, finished)
+            return {'pulp_tasks': [task]}
+        group_href = f'/pulp/api/v3/task-groups/{self.uuid()}/'
+        self.schedule_polls(group_href, created, finished)
+        return {'task_groups': [{'pulp_href': group_href,
+                                 'all_tasks_dispatched': True,
+                                 'tasks': [pulp_task() for i in
+                                           range(rnd.randint(2, 4))]}]}
+
+    def action_input(self):
+        # some padding, so records are of realistic sizes
+        size = int(self.random.expovariate(1 / self.input_size)) \
+            if self.input_size > 0 else 0
+        return {'organization': {'id': 1, 'name': 'Default Organization'},
+                'services_checked': ['pulp3', 'candlepin'],
+                'description': 'x' * size}
+
+    def add_task(self, label, actions, task_start, files):
+        tasks_file, steps_file, actions_file, access_log = files
+        rnd = self.random
+        foreman_uuid = self.uuid()
+        plan = self.uuid()
+        steps = []
+        outputs = []
+        ts = task_start
+        for action_id, (action_class, kind, scale, ratio) in \
+                enumerate(actions, start=1):
+            # waiting for a free sidekiq worker
+            ts += rnd.expovariate(10)
+            realtime = self.duration(scale * self.mean_step_duration)
+            exectime = realtime * ratio
+            steps.append(f'{plan},{action_id},{action_id},success,'
+                         f'{format_ts(ts)},{format_ts(ts+realtime)},'
+                         f'{realtime},{exectime},1,1,Dynflow::Step,'
+                         f'{action_class},{plan},,,default\n')
+            output = self.action_output(kind, ts, realtime) if kind else {}
+            outputs.append(
+                f'{plan},{action_id},,,,{action_class},,{action_id},,,'
+                f'{csv_quote(json.dumps(output))},'
+                f'{csv_quote(json.dumps(self.action_input()))}\n')
+            ts += realtime
+        result = rnd.choices(['success', 'warning', 'error'],
+                             [97, 2, 1])[0]
+        tasks_file.write(f'{foreman_uuid},ForemanTasks::Task::DynflowTask,'
+                         f'{label},{format_ts(task_start)},{format_ts(ts)},'
+                         f'stopped,{result},{plan},,,,,1,{format_ts(ts)}\n')
+        steps_file.writelines(steps)
+        actions_file.writelines(outputs)
+        self.counts['foreman_tasks_tasks'] += 1
+        self.counts['dynflow_steps'] += len(steps)
+        self.counts['dynflow_actions'] += len(outputs)
+
+    def run(self):
+        foreman_dir = os.path.join(self.destdir, FOREMAN_DIR)
+        os.makedirs(foreman_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.join(self.destdir, ACCESS_LOG)),
+                    exist_ok=True)
+        with open(os.path.join(self.destdir, 'hostname'), 'w') as _file:
+            _file.write('satellite.example.com\n')
+        with open(os.path.join(self.destdir, SETTINGS_FILE), 'w') as _file:
+            _file.write(' id |               name               | value\n')
+            _file.write(f' 18 | foreman_tasks_polling_multiplier | --- '
+                        f'{self.multiplier}\n')
+        with open(os.path.join(foreman_dir, 'foreman_tasks_tasks'), 'w') \
+                as tasks_file, \
+                open(os.path.join(foreman_dir, 'dynflow_steps'), 'w') \
+                as steps_file, \
+                open(os.path.join(foreman_dir, 'dynflow_actions'), 'w') \
+                as actions_file, \
+                open(os.path.join(self.destdir, ACCESS_LOG), 'w') \
+                as access_log:
+            tasks_file.write(TASKS_HEADER)
+            steps_file.write(STEPS_HEADER)
+            actions_file.write(ACTIONS_HEADER)
+            files = (tasks_file, steps_file, actions_file, access_log)
+            ts = BASE_TS
+            while self.counts['dynflow_steps'] < self.steps:
+                ts += self.random.expovariate(1 / self.mean_gap)
+                # all polls of the tasks started so far are in the heap, and
+                # the following tasks poll only after ts
+                self.flush_polls(ts, access_log)
+                label, weight, actions = self.random.choices(
+                    TASK_TYPES, self.weights)[0]
+                self.add_task(label, actions, ts, files)
+            self.flush_polls(float('inf'), access_log)
+        return self.counts
+
+
+def generate_sosreport(destdir, steps, concurrency=20,
+                       distribution='lognormal', mean_step_duration=10,
+                       multiplier=1, missed_polls=0.001, noise=5,
+                       input_size=200, seed=1):
+    """
+    Generate synthetic sosreport to destdir with (about) the given number of
+    dynflow_steps rows. Return dict with numbers of rows per generated file.
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"unknown distribution '{distribution}'")
+    return _Generator(destdir, steps, concurrency, distribution,
+                      mean_step_duration, multiplier, missed_polls, noise,
+                      input_size, seed).run()
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--concurrency",
+                        type=float,
+                        default=20,
+                        help="Average number of concurrently running tasks")
+    parser.add_argument("--distribution",
+                        choices=DISTRIBUTIONS,
+                        default='lognormal',
+                        help="Distribution of dynflow step durations")
+    parser.add_argument("--mean-step-duration",
+                        type=float,
+                        default=10,
+                        help="Mean duration of a dynflow step in seconds "
+                             "(scaled per step type)")
+    parser.add_argument("--multiplier",
+                        type=int,
+                        default=1,
+                        help="foreman_tasks_polling_multiplier of polling "
+                             "pulp tasks")
+    parser.add_argument("--missed-polls",
+                        type=float,
+                        default=0.001,
+                        help="Ratio of polls of pulp tasks that are delayed")
+    parser.add_argument("--noise",
+                        type=int,
+                        default=5,
+                        help="Number of other requests in the access log per "
+                             "one poll of a pulp task")
+    parser.add_argument("--input-size",
+                        type=int,
+                        default=200,
+                        help="Mean size of padding of dynflow_actions input "
+                             "in bytes")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=1,
+                        help="Seed of the random generator")
+
+
+def generator_kwargs(args):
+    return {'concurrency': args.concurrency,
+            'distribution': args.distribution,
+            'mean_step_duration': args.mean_step_duration,
+            'multiplier': args.multiplier,
+            'missed_polls': args.missed_polls,
+            'noise': args.noise,
+            'input_size': args.input_size,
+            'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic "
+                                                 "sosreport for benchmarks")
+    parser.add_argument("sosreport_directory",
+                        help="Directory to generate the sosreport to")
+    parser.add_argument("--steps",
+                        type=int,
+                        default=100000,
+                        help="Number of dynflow_steps rows to generate")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    counts = generate_sosreport(args.sosreport_directory, args.steps,
+                                **generator_kwargs(args))
+    for fname, rows in counts.items():
+        print(f"{fname:<24}{rows:>14,} rows")
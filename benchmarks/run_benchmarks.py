@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#
+# Benchmark of the scripts over synthetic sosreports of given sizes: wall
+# time, rows per second and peak RSS of each phase (a script run with some
+# options) are printed and stored in a JSON baseline file, and optionally
+# compared with a baseline of a previous version to spot regressions.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from generate_sosreport import ACCESS_LOG, FOREMAN_DIR, \
+    add_generator_arguments, generator_kwargs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# parameters of a generated sosreport, to reuse it only if they match
+PARAMS_FILE = 'benchmark_params.json'
+
+
+def count_lines(fname):
+    lines = 0
+    with open(fname, 'rb') as _file:
+        for block in iter(lambda: _file.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return lines
+
+
+def run_phase(command):
+    """
+    Run the command with output discarded. Return (wall time, peak RSS in
+    kB), or raise RuntimeError if it fails.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE)
+    # read stderr first to not block the process on a full pipe
+    stderr = process.stderr.read()
+    pid, status, rusage = os.wait4(process.pid, 0)
+    duration = time.perf_counter() - start
+    exitcode = os.waitstatus_to_exitcode(status)
+    if exitcode != 0:
+        raise RuntimeError(f"'{' '.join(command)}' failed with exit code "
+                           f"{exitcode}:\n"
+                           f"{stderr.decode('utf-8', errors='replace')}")
+    # ru_maxrss is in kB on Linux (and also includes reaped subprocesses)
+    return duration, rusage.ru_maxrss
+
+
+def prepare_sosreport(data_dir, steps, args):
+    """
+    Return directory of a generated sosreport with the given number of
+    dynflow_steps rows, and its generation phase (None if reused).
+    """
+    params = dict(generator_kwargs(args), steps=steps)
+    sosreport_dir = os.path.join(data_dir, f'sosreport-bench-{steps}-'
+                                           f'{args.seed}')
+    params_file = os.path.join(sosreport_dir, PARAMS_FILE)
+    if os.path.isfile(params_file):
+        with open(params_file) as _file:
+            if json.load(_file) == params:
+                return sosreport_dir, None
+        shutil.rmtree(sosreport_dir)
+    command = [sys.executable,
+               os.path.join(BENCH_DIR, 'generate_sosreport.py'),
+               sosreport_dir, '--steps', str(steps)]
+    for key, value in generator_kwargs(args).items():
+        command += [f"--{key.replace('_', '-')}", str(value)]
+    print(f"Generating sosreport with {steps:,} dynflow steps..")
+    duration, rss = run_phase(command)
+    # written at the end, so an interrupted generation is not reused
+    with open(params_file, 'w') as _file:
+        json.dump(params, _file)
+    return sosreport_dir, (duration, rss)
+
+
+def phases(sosreport_dir, jobs):
+    """
+    Return list of (phase name, command, input files) of the benchmark over
+    the sosreport. The phases run in the order, so e.g. a cold cache is
+    created before the warm one is used. The first phase is the generation of
+    the sosreport, with no command.
+    """
+    foreman_dir = os.path.join(sosreport_dir, FOREMAN_DIR)
+    steps = os.path.join(foreman_dir, 'dynflow_steps')
+    actions = os.path.join(foreman_dir, 'dynflow_actions')
+    tasks = os.path.join(foreman_dir, 'foreman_tasks_tasks')
+    access_log = os.path.join(sosreport_dir, ACCESS_LOG)
+    heat = [sys.executable,
+            os.path.join(REPO_DIR, 'heat_stats_sidekiq_workers.py'), steps,
+            '--show-graph', '', '--jobs', str(jobs)]
+    blame = [sys.executable,
+             os.path.join(REPO_DIR, 'blame_foreman-task_execution.py'),
+             foreman_dir, '--jobs', str(jobs)]
+    capacity = [sys.executable,
+                os.path.join(REPO_DIR, 'simulate_sidekiq_capacity.py'), steps,
+                '--jobs', str(jobs)]
+    backlog = [sys.executable,
+               os.path.join(REPO_DIR, 'external_tasks_backlog.py'), actions,
+               '--show-graph', '']
+    polling = [sys.executable,
+               os.path.join(REPO_DIR, 'check_dynflow_polling.py'),
+               sosreport_dir]
+    return [('generate', None, [tasks, steps, actions, access_log]),
+            ('heat', heat, [steps]),
+            ('heat-cache-cold', heat + ['--cache'], [steps]),
+            ('heat-cache-warm', heat + ['--cache'], [steps]),
+            ('heat-index-cold', heat + ['--index'], [steps]),
+            ('blame-top', blame + ['--top', '10'], [tasks, steps, actions]),
+            ('blame-aggregate', blame + ['--aggregate'],
+             [tasks, steps, actions]),
+            ('polling', polling, [access_log]),
+            ('polling-correlate', polling + ['--correlate-load', '--jobs',
+                                             str(jobs)],
+             [access_log, steps]),
+            ('polling-owners', polling + ['--owners'],
+             [access_log, actions, tasks]),
+            ('capacity', capacity, [steps]),
+            ('backlog', backlog, [actions]),
+            ]
+
+
+def remove_derived_files(sosreport_dir):
+    # caches, indexes and outputs from previous runs, so cold phases are
+    # cold
+    foreman_dir = os.path.join(sosreport_dir, FOREMAN_DIR)
+    for fname in os.listdir(foreman_dir):
+        if fname.startswith(('dynflow_steps.', 'dynflow_actions.')):
+            os.unlink(os.path.join(foreman_dir, fname))
+
+
+def compare(results, baseline, threshold):
+    """
+    Print comparison of results with the baseline ones. Return number of
+    regressions: phases slower or with bigger peak RSS by more than the
+    threshold ratio.
+    """
+    previous = {(result['steps'], result['phase']): result
+                for result in baseline['results']}
+    s = "Comparison with the baseline"
+    print(s)
+    print("-"*len(s))
+    print(f"{'steps':>12}  {'phase':<20}{'time':>10}{'change':>9}"
+          f"{'peak RSS':>12}{'change':>9}")
+    regressions = 0
+    for result in results:
+        base = previous.get((result['steps'], result['phase']))
+        if base is None:
+            continue
+        time_change = result['seconds'] / base['seconds'] - 1
+        rss_change = result['peak_rss_kb'] / base['peak_rss_kb'] - 1
+        regressed = time_change > threshold or rss_change > threshold
+        regressions += regressed
+        print(f"{result['steps']:>12,}  {result['phase']:<20}"
+              f"{result['seconds']:>9.2f}s{time_change:>+8.1%}"
+              f"{result['peak_rss_kb']/1024:>9.1f} MB{rss_change:>+8.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    print()
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+parser = argparse.ArgumentParser(description="Benchmark the scripts over "
+                                             "synthetic sosreports")
+parser.add_argument("--steps",
+                    type=int,
+                    action="append",
+                    help="Number of dynflow_steps rows of the generated "
+                         "sosreport (10000 to 50000000 are reasonable). Can "
+                         "be used multiple times to see the scaling. "
+                         "Default 100000")
+parser.add_argument("--phase",
+                    type=str,
+                    action="append",
+                    help="Run just this phase (like 'heat' or "
+                         "'blame-top'). Can be used multiple times")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing the inputs in "
+                         "parallel, passed to the scripts")
+parser.add_argument("--data-dir",
+                    type=str,
+                    help="Keep generated sosreports in this directory and "
+                         "reuse them in next runs, instead of a temporary "
+                         "directory")
+parser.add_argument("--baseline",
+                    type=str,
+                    default="benchmark_baseline.json",
+                    help="Store the results to this JSON file")
+parser.add_argument("--compare",
+                    type=str,
+                    help="Compare the results with this baseline file of a "
+                         "previous run, exit with status 1 on a regression")
+parser.add_argument("--threshold",
+                    type=float,
+                    default=0.1,
+                    help="With --compare, relative increase of time or peak "
+                         "RSS considered a regression")
+add_generator_arguments(parser)
+
+args = parser.parse_args()
+sizes = args.steps or [100000]
+data_dir = args.data_dir or tempfile.mkdtemp(prefix='bench_sosreport_')
+os.makedirs(data_dir, exist_ok=True)
+
+results = []
+try:
+    for steps in sizes:
+        sosreport_dir, generation = prepare_sosreport(data_dir, steps, args)
+        remove_derived_files(sosreport_dir)
+        rows_of = {}
+        s = f"Benchmark over {steps:,} dynflow steps"
+        print(s)
+        print("-"*len(s))
+        print(f"{'phase':<20}{'time':>10}{'rows':>14}{'rows/s':>14}"
+              f"{'peak RSS':>12}")
+        for phase, command, inputs in phases(sosreport_dir, args.jobs):
+            if args.phase and phase not in args.phase:
+                continue
+            if command is not None:
+                duration, rss = run_phase(command)
+            elif generation is not None:
+                duration, rss = generation
+            else:
+                # reused sosreport
+                continue
+            for fname in inputs:
+                if fname not in rows_of:
+                    rows_of[fname] = count_lines(fname)
+            rows = sum(rows_of[fname] for fname in inputs)
+            results.append({'steps': steps,
+                            'phase': phase,
+                            'seconds': duration,
+                            'rows': rows,
+                            'rows_per_s': rows / duration,
+                            'peak_rss_kb': rss})
+            print(f"{phase:<20}{duration:>9.2f}s{rows:>14,}"
+                  f"{rows/duration:>14,.0f}{rss/1024:>9.1f} MB")
+        print()
+finally:
+    if args.data_dir is None:
+        shutil.rmtree(data_dir)
+
+baseline = {'created': datetime.now(timezone.utc).isoformat('T', 'seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'jobs': args.jobs,
+            'generator': generator_kwargs(args),
+            'results': results}
+with open(args.baseline, 'w') as _file:
+    json.dump(baseline, _file, indent=2)
+print(f"Results stored in {args.baseline}")
+print()
+
+if args.compare:
+    with open(args.compare) as _file:
+        regressions = compare(results, json.load(_file), args.threshold)
+    if regressions > 0:
+        print(f"{regressions} regression(s) found.")
+        sys.exit(1)
@@ -1,61 +1,15 @@
 #!/usr/bin/env python
 
-from copy import deepcopy
 import argparse
-import json
-import csv
-import sys
 import os
-from datetime import *
-from dateutil.tz import tzutc
-
-# increase a csv buffer size to prevent "field larger than field limit" error
-# when processing too long fields
-maxInt = sys.maxsize
-while True:
-    # decrease the maxInt value by factor 10
-    # as long as the OverflowError occurs.
-    try:
-        csv.field_size_limit(maxInt)
-        break
-    except OverflowError:
-        maxInt = int(maxInt/10)
-
-utctz = tzutc()
-now = datetime.now().replace(tzinfo=utctz).timestamp()
-
-
-def _convert_datetime_to_seconds(ts):
-    try:
-        ret = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f") \
-                      .replace(tzinfo=utctz).timestamp()
-    except ValueError:
-        ret = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S") \
-                      .replace(tzinfo=utctz).timestamp()
-    return ret
-
-
-def _convert_pulp_datetime_to_seconds(ts):
-    return _convert_datetime_to_seconds(ts.replace('T', ' '))
-
-
-# for an external task, add times from "task created/started/finished" to
-# internal structures
-def process_external_task(step_id, who, created, started, finished):
-    try:
-        created = _convert_pulp_datetime_to_seconds(created)
-        started = _convert_pulp_datetime_to_seconds(started)
-        finished = _convert_pulp_datetime_to_seconds(finished)
-    except (KeyError, TypeError):
-        return
-    timestamps.add(created)
-    timestamps.add(started)
-    timestamps.add(finished)
-    action_intervals[step_id].append((created, started-created, f'{who}wait'))
-    action_intervals[step_id].append((started, finished-started, f'{who}exec'))
-    absolute_times['sidewait'] -= finished-created
-    absolute_times[f'{who}wait'] += started-created
-    absolute_times[f'{who}exec'] += finished-started
+from actions_reader import iter_external_tasks
+from dynflow_records import convert_cmdline_time_to_seconds
+from file_chunks import map_chunks
+import run_stats
+from steps_cache import open_steps_cache
+from task_blame import LabelBlame, TaskBlame, iter_tasks, now, \
+    parse_steps_chunk, print_critical_path, print_header, print_label_blame, \
+    print_metric, select_slowest_tasks, steps_from_cache
 
 
 parser = argparse.ArgumentParser(description="Blame task duration among "
@@ -70,8 +24,92 @@ parser.add_argument("foreman_directory",
                          "and dynflow_actions")
 parser.add_argument("--uuid",
                     type=str,
-                    required=True,
-                    help="Foreman or dynflow task UUID")
+                    action="append",
+                    default=[],
+                    help="Foreman or dynflow task UUID. Can be used multiple "
+                         "times to blame more tasks in one pass")
+parser.add_argument("--uuid-file",
+                    type=str,
+                    help="File with foreman or dynflow task UUIDs to blame, "
+                         "one per line")
+parser.add_argument("--top",
+                    type=int,
+                    help="Instead of given UUIDs, blame this number of the "
+                         "slowest tasks from foreman_tasks_tasks")
+parser.add_argument("--aggregate",
+                    action="store_true",
+                    help="Instead of blaming individual tasks, summarize "
+                         "relative blame times of all tasks from "
+                         "foreman_tasks_tasks per task label: totals and "
+                         "p50/p95/p99 of the per task values")
+parser.add_argument("--label",
+                    type=str,
+                    action="append",
+                    default=[],
+                    help="With --top or --aggregate, consider only tasks "
+                         "with this label. Can be used multiple times")
+parser.add_argument("--state",
+                    type=str,
+                    action="append",
+                    default=[],
+                    help="With --top or --aggregate, consider only tasks "
+                         "in this state (e.g. stopped, paused, running). Can "
+                         "be used multiple times")
+parser.add_argument("--from", "--since",
+                    dest='from_ts',
+                    type=str,
+                    default="0",
+                    help="With --top or --aggregate, consider tasks "
+                         "running since this timestamp (seconds since Epoch "
+                         "or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--to", "--till",
+                    type=str,
+                    default=str(now),
+                    help="With --top or --aggregate, consider tasks "
+                         "running till this timestamp (seconds since Epoch "
+                         "or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing dynflow_steps in "
+                         "parallel")
+parser.add_argument("--cache",
+                    action="store_true",
+                    help="Use parsed dynflow_steps cached in "
+                         "dynflow_steps.cache, create or refresh the cache if "
+                         "needed. Speeds up repeated runs over the same "
+                         "sosreport")
+parser.add_argument("--batch-size",
+                    type=int,
+                    default=20000,
+                    help="With --aggregate, blame the tasks in batches of "
+                         "this number of tasks, reading dynflow_steps and "
+                         "dynflow_actions once per batch. Bounds the memory "
+                         "by the steps of one batch")
+parser.add_argument("--critical-path",
+                    action="store_true",
+                    help="Also print the critical path of each task: the "
+                         "chain of dynflow steps (and their pulp/candlepin "
+                         "tasks) that determined the task's finish time, and "
+                         "blame of that path only")
+parser.add_argument("--path-steps",
+                    type=int,
+                    default=20,
+                    help="With --critical-path, number of the longest steps "
+                         "of the path to list")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="At the end, print statistics of the run to "
+                         "stderr: wall and CPU time per phase, rows read and "
+                         "skipped per reason, and peak memory. As text "
+                         "(default) or JSON")
+parser.add_argument("--profile",
+                    type=str,
+                    help="Write cProfile dump of the run (including --jobs "
+                         "worker processes) to this file, see it e.g. by "
+                         "'python -m pstats FILE'")
 parser.add_argument("--metric",
                     type=str,
                     choices=['absolute', 'absolute-blame', 'relative-blame',
@@ -92,234 +130,191 @@ parser.add_argument("--metric",
                          "'all': Show all three metrics.")
 
 args = parser.parse_args()
+run_stats.start(args.stats, args.profile)
+
+uuids = list(args.uuid)
+if args.uuid_file:
+    for line in open(args.uuid_file, 'r'):
+        line = line.strip()
+        if len(line) > 0 and not line.startswith('#'):
+            uuids.append(line)
+if (args.top is not None) + args.aggregate + (len(uuids) > 0) > 1:
+    parser.error("--top, --aggregate and --uuid or --uuid-file can not be "
+                 "combined")
+if args.aggregate and args.critical_path:
+    parser.error("--critical-path can not be used with --aggregate")
+if args.top is None and not args.aggregate and len(uuids) == 0:
+    parser.error("at least one --uuid, --uuid-file, --top or --aggregate is "
+                 "required")
+if args.batch_size <= 0:
+    parser.error("--batch-size must be positive")
+
+
+def add_steps_and_actions(tasks, steps_cache):
+    """
+    Add dynflow steps (from dynflow_steps or its cache, if not None) and pulp
+    and candlepin tasks (from dynflow_actions) to the TaskBlame tasks keyed by
+    dynflow_uuid.
+    """
+    run_stats.phase("parse dynflow_steps")
+    if steps_cache is not None:
+        steps_chunks = [steps_from_cache(steps_cache, set(tasks.keys()))]
+    else:
+        steps_chunks = map_chunks(parse_steps_chunk, dynflow_steps_fname,
+                                  args.jobs, set(tasks.keys()))
+    for chunk_steps in steps_chunks:
+        for dynflow_uuid, steps in chunk_steps.items():
+            for step in steps:
+                tasks[dynflow_uuid].add_step(step)
+
+    run_stats.phase("parse dynflow_actions")
+    for external_task in iter_external_tasks(dynflow_actions_fname,
+                                             set(tasks.keys())):
+        tasks[external_task.plan].add_external_task(external_task)
 
-# absolute / cumulative times, not respecting concurrency
-zero_blame_times = {
-    'sidewait': 0.0,
-    'sideexec': 0.0,
-    'pulpwait': 0.0,
-    'pulpexec': 0.0,
-    'candlewait': 0.0,
-    'candleexec': 0.0
-}
-absolute_times = deepcopy(zero_blame_times)
-# track all timestamps in a set
-timestamps = set()
-# for each dynflow step, keep start and finish timestamps and sidekiq's
-# execution time - index them per action_id which is a sufficient common id for
-# both action and step (for us)
-steps_times = {}
-# for each dynflow action, keep list of intervals "we started to wait on
-# (pulp|candlepin) task at .. for time .."
-action_intervals = {}
-# even once we have action_intervals complete, we can distribute sidekiq
-# execution time evenly to these "not sidekiq responsibility" intervals and to
-# the remaining "sidekiq responsibility" intervals & store within blame_periods
-blame_periods = set()  # of start_time, duration, who-to-blame, weight
-# cumul_blame_intervals are cumulative blame_periods grouped into individual
-# intervals from `timestamps`
-# format: key=start_time, value={duration, zero_blame_times, concurrency) where
-# concurrency is the number of concurrent steps (to split the blame evenly)
-cumul_blame_intervals = {}
-relative_blame_intervals = deepcopy(zero_blame_times)
-absolute_blame_intervals = deepcopy(zero_blame_times)
 
-foreman_uuid = None
-dynflow_uuid = None
+# tasks to blame, keyed by dynflow_uuid
+tasks = {}
+# foreman_uuid and label of the tasks for --aggregate, keyed by dynflow_uuid
+task_labels = {}
 fdir = args.foreman_directory
 foreman_tasks_fname = os.path.join(fdir, "foreman_tasks_tasks")
 dynflow_steps_fname = os.path.join(fdir, "dynflow_steps")
 dynflow_actions_fname = os.path.join(fdir, "dynflow_actions")
 
-# identify foreman_uuid and dynflow_uuid by traversing foreman_tasks_fname
-for line in open(foreman_tasks_fname, 'r'):
-    cols = line.split(',')
-    # ignore incomplete lines
-    if len(cols) < 14:
-        continue
-    if cols[0] == args.uuid or cols[7] == args.uuid:
-        foreman_uuid = cols[0]
-        dynflow_uuid = cols[7]
-        break
-
-if not foreman_uuid:
-    print(f"Could not find a foreman or dynflow task with id {args.uuid} in"
-          f" file {foreman_tasks_fname}")
-    exit()
-
-for line in open(dynflow_steps_fname, 'r'):
-    cols = line.split(',')
-    # ignore incomplete lines
-    if len(cols) < 16:
-        continue
-    # ignore steps from other tasks
-    if cols[0] != dynflow_uuid:
-        continue
-    step_id = cols[2]  # in fact it is action_id, not step_id
-    started_at = cols[4]
-    ended_at = cols[5]
-    realtime = cols[6]
-    exectime = cols[7]
-    # ignore incomplete data - neither length can be zero
-    if 0 in (len(started_at), len(ended_at), len(realtime), len(exectime)):
-        continue
-    try:
-        realtime = float(realtime)
-        exectime = float(exectime)
-    except Exception:
-        continue
-    try:
-        started_at = _convert_datetime_to_seconds(started_at)
-        ended_at = _convert_datetime_to_seconds(ended_at)
-    except ValueError:
-        continue
+from_ts = convert_cmdline_time_to_seconds(args.from_ts)
+to_ts = convert_cmdline_time_to_seconds(args.to)
+run_stats.phase("select tasks")
+if args.aggregate:
+    for duration, foreman_uuid, dynflow_uuid, label, state in \
+            iter_tasks(foreman_tasks_fname, args.label, args.state, from_ts,
+                       to_ts):
+        task_labels[dynflow_uuid] = (foreman_uuid, label)
+    if len(task_labels) == 0:
+        print(f"No task matching the filters found in file "
+              f"{foreman_tasks_fname}")
+        exit()
 
-    timestamps.add(started_at)
-    timestamps.add(ended_at)
-    if step_id not in steps_times.keys():
-        steps_times[step_id] = []
-        action_intervals[step_id] = []
-    steps_times[step_id].append((started_at, ended_at, realtime, exectime))
-    absolute_times['sidewait'] += realtime-exectime
-    absolute_times['sideexec'] += exectime
+if args.top is not None:
+    slowest = select_slowest_tasks(foreman_tasks_fname, args.top, args.label,
+                                   args.state, from_ts, to_ts)
+    if len(slowest) == 0:
+        print(f"No task matching the filters found in file "
+              f"{foreman_tasks_fname}")
+        exit()
+    s = f"Top {args.top} slowest tasks:"
+    print(s)
+    print("-"*len(s))
+    print(f"{'rank':<6}{'duration':>12}  {'state':<10}{'foreman task':<38}"
+          f"label")
+    for rank, (duration, foreman_uuid, dynflow_uuid, label, state) in \
+            enumerate(slowest, start=1):
+        print(f"{rank:<6}{duration:>12,.2f}  {state:<10}{foreman_uuid:<38}"
+              f"{label}")
+        tasks[dynflow_uuid] = TaskBlame(foreman_uuid, dynflow_uuid)
+    print()
 
-with open(dynflow_actions_fname, newline='') as _file:
-    for row in csv.reader(_file, delimiter=',', quotechar='"'):
-        # ignore incomplete records
-        if len(row) < 11:
+if len(uuids) > 0:
+    # identify foreman_uuid and dynflow_uuid by traversing
+    # foreman_tasks_fname
+    not_found = set(uuids)
+    for line in open(foreman_tasks_fname, 'r'):
+        cols = line.split(',')
+        # ignore incomplete lines
+        if len(cols) < 14:
             continue
-        # ignore records for other dynflow UUID
-        if row[0] != dynflow_uuid:
-            continue
-        try:
-            data = json.loads(row[10])
-        except json.decoder.JSONDecodeError:
-            continue
-        step_id = row[1]
-        # if dynflow_steps are truncated, we might not know the [real/exec]time
-        # then skip further calculation
-        if step_id not in steps_times.keys():
-            continue
-        # pulp tasks
-        if 'pulp_tasks' in data:
-            for task in data['pulp_tasks']:
-                process_external_task(step_id, 'pulp',
-                                      task['pulp_created'][:23],
-                                      task['started_at'][:23],
-                                      task['finished_at'][:23])
-        # pulp task groups
-        if 'task_groups' in data and data['task_groups']:
-            for group in data['task_groups']:
-                for task in group["tasks"]:
-                    process_external_task(step_id, 'pulp',
-                                          task['pulp_created'][:23],
-                                          task['started_at'][:23],
-                                          task['finished_at'][:23])
-        # candlepin tasks
-        if 'task' in data:
-            task = data['task']
-            # time format is '2024-10-02T12:18:04+0000' so strip the trailing
-            # timezone
-            process_external_task(step_id, 'candle',
-                                  task['created'].split('+')[0],
-                                  task['startTime'].split('+')[0],
-                                  task['endTime'].split('+')[0])
+        for uuid in (cols[0], cols[7]):
+            if uuid in not_found:
+                not_found.remove(uuid)
+                tasks[cols[7]] = TaskBlame(cols[0], cols[7])
+        if len(not_found) == 0:
+            break
+    for uuid in uuids:
+        if uuid in not_found:
+            print(f"Could not find a foreman or dynflow task with id {uuid} "
+                  f"in file {foreman_tasks_fname}")
+if len(tasks) == 0 and not args.aggregate:
+    exit()
 
-# for each action_intervals[step_id], distribute the execution time among
-# partial intervals and store the final value in final intervals.
-# Then sort action_intervals per time, to traverse it linearly in time
-# to feed blame_periods
-for step_id in action_intervals.keys():
-    # insert one dummy record to prevent "is there a record .." tests
-    action_intervals[step_id].append((now, 0, 'pulpexec'))
-    action_intervals[step_id].sort(key=lambda x: x[0])
-for step_id in steps_times.keys():
-    for started_at, ended_at, realtime, exectime in steps_times[step_id]:
-        # if whole interval was spent by sidekiq execution, skip finding any
-        # external action, there won't be
-        if realtime == exectime:
-            blame_periods.add((started_at, ended_at-started_at, 'sideexec', 1))
-            continue
-        exec2real = exectime/realtime
-        # while there is an action within this sidekiq interval..
-        while ended_at > action_intervals[step_id][0][0]:
-            # blame sidekiq for period prior the external action
-            if started_at < action_intervals[step_id][0][0]:
-                duration = action_intervals[step_id][0][0]-started_at
-                blame_periods.add((started_at, duration, 'sidewait',
-                                   1-exec2real))
-                blame_periods.add((started_at, duration, 'sideexec',
-                                   exec2real))
-            # now blame pulp/candlepin and sideexec - nowadays, we treat both
-            # of them fully concurrently, not interfering each other "blame"
-            # or weight. This approach alone could mean simplier code but the
-            # current code is prepared for a variant "blame them with proper"
-            # weights" (since sideexec might affect pulp/candlepin..?)
-            blame_periods.add((action_intervals[step_id][0][0],
-                               action_intervals[step_id][0][1],
-                               action_intervals[step_id][0][2], 1))
-            blame_periods.add((action_intervals[step_id][0][0],
-                               action_intervals[step_id][0][1],
-                               'sideexec', exec2real))
-            # move in time beyond the action
-            started_at = action_intervals[step_id][0][0] + \
-                action_intervals[step_id][0][1]
-            action_intervals[step_id].pop(0)
-        # if there is a trailing time spent by sidekiq, blame for it
-        if started_at < ended_at:
-            duration = ended_at-started_at
-            blame_periods.add((started_at, duration, 'sidewait', 1-exec2real))
-            blame_periods.add((started_at, duration, 'sideexec', exec2real))
+steps_cache = open_steps_cache(dynflow_steps_fname, args.jobs) \
+    if args.cache else None
 
-if len(timestamps) == 0:
-    print("No dynflow step found, nothing to blame.")
+# aggregate: blame the tasks in batches of --batch-size plans, dropping each
+# batch once summarized per label. Only the steps and pulp/candlepin tasks of
+# one batch are kept in memory, for the price of reading dynflow_steps (or
+# its cache) and dynflow_actions once per batch
+if args.aggregate:
+    label_blames = {}
+    dynflow_uuids = list(task_labels.keys())
+    for batch_start in range(0, len(dynflow_uuids), args.batch_size):
+        tasks = {dynflow_uuid: TaskBlame(task_labels[dynflow_uuid][0],
+                                         dynflow_uuid)
+                 for dynflow_uuid in dynflow_uuids[
+                     batch_start:batch_start+args.batch_size]}
+        add_steps_and_actions(tasks, steps_cache)
+        run_stats.phase("blame")
+        for dynflow_uuid, task in tasks.items():
+            if len(task.timestamps) == 0:
+                continue
+            label = task_labels[dynflow_uuid][1]
+            if label not in label_blames.keys():
+                label_blames[label] = LabelBlame()
+            label_blames[label].add(task.blame()[1])
+    if len(label_blames) == 0:
+        print("No dynflow step found, nothing to blame.")
+        exit()
+    # labels with the biggest total blame first
+    for label, label_blame in sorted(label_blames.items(),
+                                     key=lambda x: -sum(x[1].totals.values())):
+        print_label_blame(label, label_blame)
     exit()
 
-# transform blame_periods into cumul_blame_intervals
-# first initialise cumul_blame_intervals
-next_ts = max(timestamps)
-for ts in sorted(timestamps, reverse=True):
-    cumul_blame_intervals[ts] = [next_ts-ts, deepcopy(zero_blame_times), 0]
-    next_ts = ts
-cumul_blame_intervals = dict(sorted(cumul_blame_intervals.items()))
-# now, add each of blame_periods into corresponding cumul_blame_intervals
-for ts, duration, who, weight in blame_periods:
-    while duration > 0:
-        interval = cumul_blame_intervals[ts]
-        interval[1][who] += weight
-        interval[2] += 1
-        duration -= interval[0]
-        ts += interval[0]
+add_steps_and_actions(tasks, steps_cache)
+run_stats.phase("blame")
 
-# summarize cumul_blame_intervals over time (absolute_blame_intervals) and
-# also concurrency (relative_blame_intervals)
-whos = absolute_blame_intervals.keys()
-for duration, blame_times, concurrency in cumul_blame_intervals.values():
-    if concurrency == 0:
-        continue
-    for who in whos:
-        absolute_blame_intervals[who] += duration*blame_times[who]
-        relative_blame_intervals[who] += duration*blame_times[who]/concurrency
+metrics = (("absolute times", "absolute"),
+           ("abs.blame times", "absolute-blame"),
+           ("relative blame times", "relative-blame"))
+# one task: print its header and a row for each metric
+if len(tasks) == 1 and args.top is None:
+    task = list(tasks.values())[0]
+    if len(task.timestamps) == 0:
+        print("No dynflow step found, nothing to blame.")
+        exit()
+    absolute_blame_intervals, relative_blame_intervals = task.blame()
+    print_header(task.foreman_uuid)
+    for (metric, (description, argvalue)) in zip(
+            (task.absolute_times, absolute_blame_intervals,
+             relative_blame_intervals), metrics):
+        if args.metric != 'all' and args.metric != argvalue:
+            continue
+        print_metric(description, metric)
+    if args.critical_path:
+        print()
+        print_critical_path(task, args.path_steps)
+    exit()
 
-# print header
-blame_keys = zero_blame_times.keys()
-keys_str = f"{'TOTAL':>12} {'pct.':>6}"
-for key in blame_keys:
-    keys_str = f"{keys_str}{key:>12} {'pct.':>6}"
-print(f"{foreman_uuid:>36} :{keys_str}")
-# for each metric, print its row
-# ['absolute', 'absolute-blame', 'relative-blame', 'all']
-for (metric, description, argvalue) in (
-        (absolute_times, "absolute times", "absolute"),
-        (absolute_blame_intervals, "abs.blame times", "absolute-blame"),
-        (relative_blame_intervals, "relative blame times", "relative-blame")):
+# more tasks: for each metric, print a table with one row per task (in order
+# of the slowest tasks for --top)
+results = []
+for task in tasks.values():
+    if len(task.timestamps) == 0:
+        results.append((task, None))
+    else:
+        results.append((task, (task.absolute_times,) + task.blame()))
+for i, (description, argvalue) in enumerate(metrics):
     if args.metric != 'all' and args.metric != argvalue:
         continue
-    sumtime = sum(metric.values())
-    vals = f"{sumtime:>12,.2f} {100:>5,.1f}%"
-    # prevent division by zero - percentage would be zero instead of 0/0
-    if sumtime == 0:
-        sumtime = 1
-    for key in blame_keys:
-        vals = f"{vals}{metric[key]:>12,.2f} {metric[key]/sumtime*100:>5,.1f}%"
-    print(f"{description:>36} :{vals}")
+    print_header(description)
+    for task, task_metrics in results:
+        if task_metrics is None:
+            print(f"{task.foreman_uuid:>36} : No dynflow step found, nothing "
+                  f"to blame.")
+        else:
+            print_metric(task.foreman_uuid, task_metrics[i])
+    print()
+
+if args.critical_path:
+    for task, task_metrics in results:
+        if task_metrics is not None:
+            print_critical_path(task, args.path_steps)
@@ -3,9 +3,22 @@
 # Is dynflow/sidekiq performing external tasks polling frequently enough?
 
 import argparse
-import re
+import signal
+import sys
 from datetime import *
-from os.path import isfile, isdir, join
+from os.path import isdir, isfile, join
+from polling_log import TS_FORMAT, CommandFollower, DelayHistogram, \
+    LogFollower, PollingChecker, read_polling_multiplier, rotated_logfiles, \
+    sosreport_logfiles
+import run_stats
+from time import monotonic, sleep
+
+# command following the system journal for --follow --journal
+JOURNAL_COMMAND = ['journalctl', '--follow', '--lines=0', '--no-pager']
+
+# upper bounds of buckets of polling delays histogram, besides the maximum
+# delay
+HISTOGRAM_BOUNDS = [5, 10, 30, 60, 120, 300, 600, 1800]
 
 parser = argparse.ArgumentParser(description="Dynflow polling checker against "
                                              "system logs")
@@ -25,70 +38,278 @@ parser.add_argument("--add-rounding-error", "-a",
                          "errors in stating timestamps in whole seconds. This "
                          "value should be at most a few seconds, in order to "
                          "catch border cases of imperformant dynflow.")
+parser.add_argument("--evict-after",
+                    type=int,
+                    default=86400,
+                    help="Forget a pulp task not polled for this number of "
+                         "seconds, to keep memory usage bounded. Bigger "
+                         "polling delays are not reported.")
 
-args = parser.parse_args()
+parser.add_argument("--correlate-load",
+                    action="store_true",
+                    help="Show concurrent dynflow steps, sidekiq load and the "
+                         "top labels of running steps at the time each "
+                         "delayed polling was due. Requires dynflow_steps "
+                         "from the sosreport or --dynflow-steps")
+parser.add_argument("--dynflow-steps",
+                    type=str,
+                    help="With --correlate-load, dynflow_steps file to use "
+                         "instead of the one from the sosreport")
+parser.add_argument("--labels-limit",
+                    type=int,
+                    default=3,
+                    help="With --correlate-load, number of top labels to "
+                         "show")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="With --correlate-load, number of processes parsing "
+                         "dynflow_steps in parallel")
+parser.add_argument("--cache",
+                    action="store_true",
+                    help="With --correlate-load, use parsed dynflow_steps "
+                         "cached in dynflow_steps.cache, see "
+                         "heat_stats_sidekiq_workers.py")
 
-# parse foreman_settings_table line like:
-#  18 | foreman_tasks_polling_multiplier      | --- 5 ..
-REGEXP_POLLING_MULTIPLIER = re.compile(
-        r".* foreman_tasks_polling_multiplier.*--- (\d+)")
+parser.add_argument("--owners",
+                    action="store_true",
+                    help="Show the foreman task (with its label), dynflow "
+                         "plan and action that ran the pulp task of each "
+                         "delayed polling, and summarize the delayed "
+                         "pollings per task label. Uses index of pulp tasks "
+                         "stored in dynflow_actions.pulp_index, created or "
+                         "refreshed if needed. Requires dynflow_actions and "
+                         "foreman_tasks_tasks from the sosreport or "
+                         "--foreman-dir")
+parser.add_argument("--foreman-dir",
+                    type=str,
+                    help="With --owners, directory with dynflow_actions and "
+                         "foreman_tasks_tasks to use instead of the one from "
+                         "the sosreport")
 
-# extract timestamp and task id from log entries like:
-# 1.2.3.4 - - [08/Oct/2024:10:04:49 +0200] "GET /pulp/api/v3/tasks/01926b28-cf33-7a80-afdc-3d0413d900f6/ HTTP/1.1" 200 559 "-" "OpenAPI-Generator/3.39.2/ruby"
-REGEXP_GET_PULPTASK = re.compile(
-        r".*\[(.*)\] \"GET /pulp/api/v3/tasks/(.*)/ .*")
+parser.add_argument("--follow", "-f",
+                    action="store_true",
+                    help="Keep following the logfiles (given logfile, or "
+                         "logfiles of the sosreport directory like / on a "
+                         "live system) for new lines, like 'tail -F', and "
+                         "report delayed polling as it comes")
+parser.add_argument("--journal",
+                    action="store_true",
+                    help="With --follow, follow also output of "
+                         "'journalctl --follow'")
+parser.add_argument("--interval",
+                    type=float,
+                    default=1.0,
+                    help="With --follow, check for new lines every this "
+                         "number of seconds")
+parser.add_argument("--summary-interval",
+                    type=int,
+                    default=600,
+                    help="With --follow, print histogram of polling delays "
+                         "every this number of seconds (0 to print it only "
+                         "on SIGUSR1 signal or at the end)")
+parser.add_argument("--summary-window",
+                    type=int,
+                    default=3600,
+                    help="With --follow, the histogram covers polling delays "
+                         "within this number of last seconds")
+parser.add_argument("--max-tasks",
+                    type=int,
+                    default=100000,
+                    help="With --follow, track at most this number of pulp "
+                         "tasks, forget the least recently polled ones first")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="At the end, print statistics of the run to "
+                         "stderr: wall and CPU time per phase, rows read and "
+                         "skipped per reason, and peak memory. As text "
+                         "(default) or JSON")
+parser.add_argument("--profile",
+                    type=str,
+                    help="Write cProfile dump of the run (including --jobs "
+                         "worker processes) to this file, see it e.g. by "
+                         "'python -m pstats FILE'")
 
-# timestamp format in input data
-TS_FORMAT = '%d/%b/%Y:%H:%M:%S'
+args = parser.parse_args()
+run_stats.start(args.stats, args.profile)
 
 multiplier = 1
 if isdir(args.sosreport_dir):
-    input_files = []
-    for logfile in ['var/log/httpd/foreman-ssl_access_ssl.log',
-                    'var/log/messages',
-                    'sos_commands/logs/journalctl_--no-pager',
-                    ]:
-        fullpath = join(args.sosreport_dir, logfile)
-        if isfile(fullpath):
-            input_files.append(fullpath)
+    input_files = sosreport_logfiles(args.sosreport_dir)
     # read foreman_tasks_polling_multiplier
-    settings_file = join(args.sosreport_dir,
-                         'sos_commands/foreman/foreman_settings_table')
-    if isfile(settings_file):
-        for line in open(settings_file, 'r').readlines():
-            match = REGEXP_POLLING_MULTIPLIER.match(line)
-            if match:
-                multiplier = int(match.group(1))
-                print(f"Found foreman_tasks_polling_multiplier={multiplier}")
-                if args.multiplier:
-                    print(f".. cmdline option --multiplier overrides it to "
-                          f"{args.multiplier}!")
-                print()
-                break
+    settings_multiplier = read_polling_multiplier(args.sosreport_dir)
+    if settings_multiplier is not None:
+        multiplier = settings_multiplier
+        print(f"Found foreman_tasks_polling_multiplier={multiplier}")
+        if args.multiplier:
+            print(f".. cmdline option --multiplier overrides it to "
+                  f"{args.multiplier}!")
+        print()
 else:
     input_files = [args.sosreport_dir]  # the argument sosreport_dir is a file
 
 maxdelay = 16 * (args.multiplier or multiplier) + args.add_rounding_error
 
+if args.follow and (args.correlate_load or args.owners):
+    parser.error("--follow can not be combined with --correlate-load or "
+                 "--owners")
+
+timeline = None
+if args.correlate_load:
+    # imported only when needed, as it requires python3-dateutil
+    from sidekiq_load import LoadTimeline, load_steps
+    steps_fname = args.dynflow_steps
+    if steps_fname is None and isdir(args.sosreport_dir):
+        steps_fname = join(args.sosreport_dir,
+                           'sos_commands/foreman/dynflow_steps')
+    if steps_fname is None or not isfile(steps_fname):
+        parser.error("--correlate-load requires dynflow_steps, use "
+                     "--dynflow-steps")
+    print(f"Loading sidekiq load timeline from {steps_fname}..")
+    run_stats.phase("load dynflow_steps")
+    timeline = LoadTimeline(load_steps(steps_fname, 0, float('inf'),
+                                       args.jobs, args.cache))
+    print()
+
+pulp_index = None
+# per foreman task label: [delayed pollings, set of pulp tasks, set of
+# foreman tasks, maximum delay]
+label_delays = {}
+if args.owners:
+    # imported only when needed, as it requires python3-dateutil
+    from pulp_task_index import open_pulp_task_index
+    foreman_dir = args.foreman_dir
+    if foreman_dir is None and isdir(args.sosreport_dir):
+        foreman_dir = join(args.sosreport_dir, 'sos_commands/foreman')
+    if foreman_dir is None or \
+            not isfile(join(foreman_dir, 'dynflow_actions')) or \
+            not isfile(join(foreman_dir, 'foreman_tasks_tasks')):
+        parser.error("--owners requires dynflow_actions and "
+                     "foreman_tasks_tasks, use --foreman-dir")
+    print(f"Loading index of pulp tasks from {foreman_dir}..")
+    run_stats.phase("load pulp task index")
+    pulp_index = open_pulp_task_index(join(foreman_dir, 'dynflow_actions'),
+                                      join(foreman_dir,
+                                           'foreman_tasks_tasks'))
+    print()
+
+
+def report_delay(task_id, prev, now, diff):
+    print(f"Task '{task_id}' polled at '{prev.strftime(TS_FORMAT)}' and then "
+          f"at '{now.strftime(TS_FORMAT)}', delay {diff}s is bigger than "
+          f"maximum {maxdelay}s.")
+    if timeline is not None:
+        due = (prev + timedelta(seconds=maxdelay)).timestamp()
+        steps, load = timeline.load_at(due)
+        top = ", ".join(f"{label} ({count} steps, load {rate:.2f})"
+                        for label, count, rate in
+                        timeline.top_labels_at(due, args.labels_limit))
+        print(f"  when due: {steps} concurrent steps, sidekiq load "
+              f"{load:.2f}; top labels: {top or 'none'}")
+    if pulp_index is not None:
+        owner = pulp_index.owner(task_id)
+        if owner is None:
+            label = foreman_uuid = None
+            print("  owner: unknown, the pulp task is not in dynflow_actions")
+        else:
+            plan, action_id, foreman_uuid, label = owner
+            task = f"foreman task {foreman_uuid} ({label})" \
+                if foreman_uuid is not None else "unknown foreman task"
+            print(f"  owner: {task}, dynflow plan {plan}, action "
+                  f"{action_id}")
+        delays = label_delays.setdefault(label or '(unknown)',
+                                         [0, set(), set(), 0])
+        delays[0] += 1
+        delays[1].add(task_id)
+        if foreman_uuid is not None:
+            delays[2].add(foreman_uuid)
+        delays[3] = max(delays[3], diff)
+
+
+def print_histogram(histogram):
+    s = f"Polling delays within last {histogram.window}s"
+    print(s)
+    print("-"*len(s))
+    lower = 0
+    for bound, count in histogram.counts():
+        bucket = f"{lower}-{bound}s" if bound is not None else f">{lower}s"
+        print(f"{bucket:<12}{count:>10}")
+        lower = bound
+    print()
+
+
+if args.follow:
+    # report delays as soon as they are found, even to a pipe
+    sys.stdout.reconfigure(line_buffering=True)
+    followers = [LogFollower(_file) for _file in input_files]
+    if args.journal:
+        followers.append(CommandFollower(JOURNAL_COMMAND))
+    if len(followers) == 0:
+        parser.error("no logfile to follow, use --journal")
+    histogram = DelayHistogram(sorted(set(HISTOGRAM_BOUNDS + [maxdelay])),
+                               args.summary_window)
+    # each followed log is an independent stream of pollings
+    checkers = [PollingChecker(maxdelay, args.evict_after, args.max_tasks,
+                               histogram) for follower in followers]
+    for follower in followers:
+        print(f"Following {follower.logfile}..")
+    print()
+    dump_summary = False
+
+    def request_summary(signum, frame):
+        global dump_summary
+        dump_summary = True
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGUSR1, request_summary)
+    signal.signal(signal.SIGTERM, stop)
+    run_stats.phase("follow logs")
+    next_summary = monotonic() + args.summary_interval
+    try:
+        while True:
+            for follower, checker in zip(followers, checkers):
+                for delay in checker.check_lines(follower.read_lines()):
+                    report_delay(*delay)
+            if args.summary_interval > 0 and monotonic() >= next_summary:
+                next_summary += args.summary_interval
+                dump_summary = True
+            if dump_summary:
+                dump_summary = False
+                print_histogram(histogram)
+            sleep(args.interval)
+    except KeyboardInterrupt:
+        print()
+        print_histogram(histogram)
+    finally:
+        for follower in followers:
+            follower.close()
+    exit()
+
+run_stats.phase("check logs")
 for _file in input_files:
-    print(f"Processing file {_file}..")
-    # last_seen: when polling status of a pulp task was last seen?
-    # key: task UUID, value: datetime
-    last_seen = dict()
-    for line in open(_file, encoding="utf-8", errors="replace").readlines():
-        match = REGEXP_GET_PULPTASK.match(line)
-        if match:
-            timestamp = match.group(1)[:20]
-            task_id = match.group(2)
-            now = datetime.strptime(timestamp, TS_FORMAT)
-            prev = last_seen.get(task_id, now)
-            diff = (now-prev).seconds
-            if diff > maxdelay:
-                print(f"Task '{task_id}' polled at "
-                      f"'{prev.strftime(TS_FORMAT)}' and then at "
-                      f"'{now.strftime(TS_FORMAT)}', delay {diff}s is bigger "
-                      f"than maximum {maxdelay}s.")
-            last_seen[task_id] = now
+    checker = PollingChecker(maxdelay, args.evict_after)
+    # process rotated logfiles as one continuous stream, to catch delays
+    # across logrotate
+    for logfile in rotated_logfiles(_file):
+        print(f"Processing file {logfile}..")
+        for delay in checker.check_logfile(logfile):
+            report_delay(*delay)
+    print()
+
+if pulp_index is not None and len(label_delays) > 0:
+    s = "Delayed pollings per foreman task label:"
+    print(s)
+    print("-"*len(s))
+    print(f"{'pollings':>10}{'pulp tasks':>12}{'foreman tasks':>15}"
+          f"{'max.delay':>11}  label")
+    for label, (pollings, pulp_tasks, foreman_tasks, max_delay) in sorted(
+            label_delays.items(), key=lambda x: x[1][0], reverse=True):
+        print(f"{pollings:>10}{len(pulp_tasks):>12}{len(foreman_tasks):>15}"
+              f"{max_delay:>10}s  {label}")
     print()
 
 # vim:ts=4 et sw=4
@@ -0,0 +1,230 @@
+# Shared parsing of timestamps and compact records of dynflow steps and
+# external (pulp and candlepin) tasks.
+
+from array import array
+from datetime import *
+from dateutil.tz import tzutc
+from functools import lru_cache
+from run_stats import counters
+
+utctz = tzutc()
+
+EPOCH = date(1970, 1, 1)
+
+# name and array typecode of StepColumns columns
+#   start, finish: epoch seconds; finish is NaN for steps not finished
+#   realtime: NaN if not known
+#   exectime: execution time
+#   label: index to the label table
+#   plan: index to the dynflow plan UUID table
+#   action: action_id
+STEP_COLUMNS = (('start', 'd'),
+                ('finish', 'd'),
+                ('realtime', 'd'),
+                ('exectime', 'd'),
+                ('label', 'I'),
+                ('plan', 'I'),
+                ('action', 'q'))
+
+# the first column name of the dynflow_steps CSV header
+STEPS_HEADER_FIRST = 'execution_plan_uuid'
+
+
+@lru_cache(maxsize=4096)
+def _date_to_seconds(ts_date):
+    return (date(int(ts_date[0:4]), int(ts_date[5:7]),
+                 int(ts_date[8:10])) - EPOCH).days * 86400
+
+
+def convert_datetime_to_seconds(ts):
+    """
+    Convert UTC timestamp like '2024-09-04 07:45:00[.123456]' (or with 'T'
+    separator) to seconds since Epoch. The common formats are parsed by
+    hand, as datetime.strptime is by far the slowest part of reading the
+    inputs.
+    """
+    if len(ts) >= 19 and ts[4] == '-' and ts[7] == '-' and ts[10] in ' T' \
+            and ts[13] == ':' and ts[16] == ':':
+        try:
+            seconds = _date_to_seconds(ts[0:10]) + int(ts[11:13])*3600 + \
+                int(ts[14:16])*60 + int(ts[17:19])
+            if len(ts) == 19:
+                return float(seconds)
+            if ts[19] == '.' and 20 < len(ts) <= 26 and ts[20:].isdigit():
+                # the same rounding like datetime.timestamp()
+                return (seconds*1000000 + int(ts[20:].ljust(6, '0'))) / \
+                    1000000
+        except ValueError:
+            pass
+    ts = ts.replace('T', ' ')
+    for fmt in ["%Y-%m-%d %H:%M:%S.%f",
+                "%Y-%m-%d %H:%M:%S",
+                "%Y-%m-%d"]:
+        try:
+            return datetime.strptime(ts, fmt) \
+                           .replace(tzinfo=utctz).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"unknown timestamp format '{ts}'")
+
+
+def convert_pulp_datetime_to_seconds(ts):
+    # time format is '2024-09-04T07:45:00.123456Z', use milliseconds only
+    return convert_datetime_to_seconds(ts[:23])
+
+
+def convert_candlepin_datetime_to_seconds(ts):
+    # time format is '2024-10-02T12:18:04+0000' so strip the trailing
+    # timezone
+    return convert_datetime_to_seconds(ts.split('+')[0])
+
+
+def convert_cmdline_time_to_seconds(ts):
+    """
+    Convert time from command line: either a timestamp or seconds since
+    Epoch.
+    """
+    try:
+        return convert_datetime_to_seconds(ts)
+    except ValueError:
+        # no string format, so seconds since Epoch
+        return float(ts)
+
+
+def convert_duration_to_seconds(duration):
+    """
+    Convert duration from command line like '90', '90s', '5m', '2h' or '1d'
+    to seconds.
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if len(duration) > 0 and duration[-1] in units.keys():
+        return float(duration[:-1]) * units[duration[-1]]
+    return float(duration)
+
+
+class Step:
+    """
+    A dynflow step. finish is NaN for steps not finished, realtime is NaN if
+    not known.
+    """
+    __slots__ = ('plan', 'action_id', 'start', 'finish', 'realtime',
+                 'exectime', 'label')
+
+    def __init__(self, plan, action_id, start, finish, realtime, exectime,
+                 label):
+        self.plan = plan
+        self.action_id = action_id
+        self.start = start
+        self.finish = finish
+        self.realtime = realtime
+        self.exectime = exectime
+        self.label = label
+
+
+def parse_step(cols):
+    """
+    Return Step from columns of a dynflow_steps line, or None if the line is
+    the CSV header or incomplete or there is no usable start or execution
+    time.
+    """
+    # the CSV header, if present, is not a step
+    if cols[0] == STEPS_HEADER_FIRST:
+        counters['dynflow_steps: skipped header'] += 1
+        return None
+    # ignore incomplete lines
+    if len(cols) < 16:
+        counters['dynflow_steps: skipped incomplete line'] += 1
+        return None
+    try:
+        start = convert_datetime_to_seconds(cols[4])
+        finish = convert_datetime_to_seconds(cols[5]) \
+            if len(cols[5]) > 0 else float('nan')
+        exectime = float(cols[7])
+    except ValueError:
+        counters['dynflow_steps: skipped bad timestamp or time'] += 1
+        return None
+    try:
+        realtime = float(cols[6])
+    except ValueError:
+        realtime = float('nan')
+    return Step(cols[0], cols[2], start, finish, realtime, exectime,
+                cols[11])
+
+
+class ExternalTask:
+    """
+    A pulp ('pulp' who) or candlepin ('candle' who) task run by a dynflow
+    action, with its created/started/finished times in seconds since Epoch.
+    """
+    __slots__ = ('plan', 'action_id', 'who', 'created', 'started',
+                 'finished')
+
+    def __init__(self, plan, action_id, who, created, started, finished):
+        self.plan = plan
+        self.action_id = action_id
+        self.who = who
+        self.created = created
+        self.started = started
+        self.finished = finished
+
+
+class StepColumns:
+    """
+    Dynflow steps stored column-wise (see STEP_COLUMNS) in arrays, with
+    labels and dynflow plan UUIDs interned in `labels` and `plans` tables.
+    Columns can also be memoryviews or numpy arrays of the same types, for
+    read-only use.
+    """
+
+    def __init__(self, columns=None, labels=None, plans=None):
+        if columns is None:
+            columns = {name: array(typecode)
+                       for name, typecode in STEP_COLUMNS}
+        self.columns = columns
+        for name, typecode in STEP_COLUMNS:
+            setattr(self, name, columns[name])
+        self.labels = labels if labels is not None else []
+        self.plans = plans if plans is not None else []
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+        self._plan_ids = {plan: i for i, plan in enumerate(self.plans)}
+
+    def __len__(self):
+        return len(self.start)
+
+    def label_id(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            label_id = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return label_id
+
+    def plan_id(self, plan):
+        plan_id = self._plan_ids.get(plan)
+        if plan_id is None:
+            plan_id = self._plan_ids[plan] = len(self.plans)
+            self.plans.append(plan)
+        return plan_id
+
+    def append(self, step):
+        self.start.append(step.start)
+        self.finish.append(step.finish)
+        self.realtime.append(step.realtime)
+        self.exectime.append(step.exectime)
+        self.label.append(self.label_id(step.label))
+        self.plan.append(self.plan_id(step.plan))
+        try:
+            self.action.append(int(step.action_id))
+        except ValueError:
+            self.action.append(-1)
+
+    def extend(self, other):
+        """
+        Append all steps of other StepColumns, remapping their labels and
+        plans to our tables.
+        """
+        label_ids = [self.label_id(label) for label in other.labels]
+        plan_ids = [self.plan_id(plan) for plan in other.plans]
+        for name in ('start', 'finish', 'realtime', 'exectime', 'action'):
+            self.columns[name].extend(other.columns[name])
+        self.label.extend(label_ids[i] for i in other.label)
+        self.plan.extend(plan_ids[i] for i in other.plan)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# What dynflow steps were running at given time?
+
+import argparse
+from datetime import *
+from dateutil.tz import tzutc
+from dynflow_records import convert_cmdline_time_to_seconds, \
+    convert_datetime_to_seconds
+from steps_index import open_steps_index
+
+utctz = tzutc()
+now = datetime.now().replace(tzinfo=utctz).timestamp()
+
+
+parser = argparse.ArgumentParser(description="Dynflow steps running at given "
+                                             "time")
+parser.add_argument("dynflow_steps",
+                    help="Input CSV file with dynflow_steps")
+parser.add_argument("time",
+                    help="The time (seconds since Epoch or "
+                         "'%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing the input file in "
+                         "parallel when building its index")
+
+args = parser.parse_args()
+at_ts = convert_cmdline_time_to_seconds(args.time)
+
+steps = []
+steps_index = open_steps_index(args.dynflow_steps, args.jobs)
+for line in steps_index.lines_at(args.dynflow_steps, at_ts):
+    cols = line.split(',')
+    start = convert_datetime_to_seconds(cols[4])
+    finish = convert_datetime_to_seconds(cols[5]) if len(cols[5]) > 0 \
+        else now
+    steps.append((start, finish, cols[7], cols[0], cols[2], cols[11]))
+
+s = f"Dynflow steps running at {datetime.fromtimestamp(at_ts, timezone.utc)}:"
+print(s)
+print("-"*len(s))
+print(f"{'started at':<28}{'duration':>10}{'exec.time':>10}  "
+      f"{'execution plan':<38}{'action':<8}label")
+for start, finish, exectime, plan, action, label in sorted(steps):
+    start_out = datetime.fromtimestamp(start, timezone.utc)
+    try:
+        exectime = f"{float(exectime):,.2f}"
+    except ValueError:
+        pass
+    print(f"{start_out.strftime('%Y-%m-%d %H:%M:%S.%f'):<28}"
+          f"{finish-start:>10,.2f}{exectime:>10}  {plan:<38}{action:<8}"
+          f"{label}")
+print()
+print(f"{len(steps)} steps running.")
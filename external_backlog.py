@@ -0,0 +1,158 @@
+# Backlog of pulp and candlepin tasks over time, from their created/started/
+# finished times in dynflow_actions: how many tasks were waiting to start
+# (queued) and how many were being executed (running) at any time.
+
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from actions_reader import iter_external_tasks
+from quantile_sketch import QuantileSketch
+from run_stats import counters
+from sidekiq_load import now
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# who of external tasks, as in ExternalTask
+EXTERNAL_SYSTEMS = ('pulp', 'candle')
+
+
+class ExternalTimes:
+    """
+    Created, started and finished times of external tasks of one system,
+    stored column-wise, and distribution of their waits till the start.
+    """
+
+    def __init__(self):
+        self.created = array('d')
+        self.started = array('d')
+        self.finished = array('d')
+        self.waits = QuantileSketch()
+        self.unfinished = 0
+
+    def __len__(self):
+        return len(self.created)
+
+
+def load_external_times(fname, from_ts, to_ts):
+    """
+    Return dict of ExternalTimes per who of all pulp and candlepin tasks from
+    dynflow_actions running (or waiting) at least partially within from_ts and
+    to_ts. Times of tasks not started or not finished yet are considered to
+    be now; a task finished but never started (e.g. canceled) waited till its
+    finish.
+    """
+    times = {who: ExternalTimes() for who in EXTERNAL_SYSTEMS}
+    outside = 0
+    for task in iter_external_tasks(fname, unfinished=True):
+        finished = task.finished if task.finished == task.finished else now
+        started = task.started if task.started == task.started else finished
+        # skip tasks completely outside specified interval
+        if task.created > to_ts or finished < from_ts:
+            outside += 1
+            continue
+        external = times[task.who]
+        external.created.append(task.created)
+        external.started.append(started)
+        external.finished.append(finished)
+        if task.started != task.started or task.finished != task.finished:
+            external.unfinished += 1
+        else:
+            external.waits.add(started-task.created)
+    counters['dynflow_actions: skipped task outside window'] += outside
+    return times
+
+
+def compute_backlog_intervals(times, from_ts, to_ts):
+    """
+    For ExternalTimes per who, return lists of (start, end) of intervals
+    between all their distinct created/started/finished times (truncated to
+    from_ts and to_ts) and dict of lists of (queued, running) tasks per who
+    in the intervals.
+
+    Like compute_heat_intervals, each task adds +1 to the first interval it
+    covers and -1 to the first interval it does not cover anymore - queued
+    from its creation till its start and running from its start till its
+    finish - and cumulative sums of these deltas over the sorted timestamps
+    give the values of each interval.
+    """
+    if np is not None:
+        columns = {who: [np.clip(np.frombuffer(column, dtype=float),
+                                 from_ts, to_ts)
+                         for column in (external.created, external.started,
+                                        external.finished)]
+                   for who, external in times.items()}
+        timestamps_sorted = np.unique(np.concatenate(
+            [column for who_columns in columns.values()
+             for column in who_columns]))
+        count = len(timestamps_sorted)
+        values = {}
+        for who, (created, started, finished) in columns.items():
+            created, started, finished = (
+                np.searchsorted(timestamps_sorted, column)
+                for column in (created, started, finished))
+            # a task can not start before its creation nor finish before
+            # its start, even if the data says so
+            started = np.maximum(started, created)
+            finished = np.maximum(finished, started)
+            queued = np.cumsum(np.bincount(created, minlength=count) -
+                               np.bincount(started, minlength=count))
+            running = np.cumsum(np.bincount(started, minlength=count) -
+                                np.bincount(finished, minlength=count))
+            values[who] = (queued.tolist(), running.tolist())
+        ends = np.append(timestamps_sorted[1:], to_ts)
+        return timestamps_sorted.tolist(), ends.tolist(), values
+
+    def clip(ts):
+        return min(max(ts, from_ts), to_ts)
+
+    timestamps_sorted = sorted(set(
+        clip(ts) for external in times.values()
+        for column in (external.created, external.started, external.finished)
+        for ts in column))
+    count = len(timestamps_sorted)
+    values = {}
+    for who, external in times.items():
+        queued = [0]*count
+        running = [0]*count
+        for created, started, finished in zip(external.created,
+                                              external.started,
+                                              external.finished):
+            # like above, started >= created and finished >= started
+            created = bisect_left(timestamps_sorted, clip(created))
+            started = bisect_left(timestamps_sorted, clip(started), created)
+            finished = bisect_left(timestamps_sorted, clip(finished),
+                                   started)
+            queued[created] += 1
+            queued[started] -= 1
+            running[started] += 1
+            running[finished] -= 1
+        values[who] = (list(accumulate(queued)), list(accumulate(running)))
+    ends = timestamps_sorted[1:] + [to_ts]
+    return timestamps_sorted, ends, values
+
+
+def backlog_periods(starts, ends, queued, running):
+    """
+    Return list of (start, end, max queued, max running) of periods when
+    some tasks were queued, i.e. of consecutive intervals with queued > 0.
+    """
+    periods = []
+    period = None
+    for start, end, queued_tasks, running_tasks in zip(starts, ends, queued,
+                                                       running):
+        if queued_tasks <= 0:
+            if period is not None:
+                periods.append(tuple(period))
+                period = None
+            continue
+        if period is None:
+            period = [start, end, queued_tasks, running_tasks]
+            continue
+        period[1] = end
+        period[2] = max(period[2], queued_tasks)
+        period[3] = max(period[3], running_tasks)
+    if period is not None:
+        periods.append(tuple(period))
+    return periods
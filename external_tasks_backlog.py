@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# Were pulp or candlepin tasks waiting for a free worker? Timeline of queued
+# and running external tasks from dynflow_actions.
+
+import argparse
+from datetime import *
+from dynflow_records import convert_cmdline_time_to_seconds, \
+    convert_duration_to_seconds
+from external_backlog import EXTERNAL_SYSTEMS, backlog_periods, \
+    compute_backlog_intervals, load_external_times
+import run_stats
+from sidekiq_load import downsample_peaks, now, resample_heat_intervals
+
+# names of the external systems in the output
+SYSTEM_NAMES = {'pulp': 'pulp', 'candle': 'candlepin'}
+
+
+parser = argparse.ArgumentParser(description="Backlog of pulp and candlepin "
+                                             "tasks over time: queued and "
+                                             "running tasks, and periods with "
+                                             "tasks waiting to start")
+parser.add_argument("dynflow_actions",
+                    help="Input CSV file with dynflow_actions")
+parser.add_argument("--from", "--since",
+                    dest='from_ts',
+                    type=str,
+                    default="0",
+                    help="Consider tasks from this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--to", "--till",
+                    type=str,
+                    default=str(now),
+                    help="Consider tasks to this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--items-limit",
+                    type=int,
+                    default=5,
+                    help="Limit of the longest periods with tasks waiting "
+                         "shown per pulp and candlepin")
+parser.add_argument("--resolution",
+                    type=str,
+                    help="Instead of intervals between all distinct task "
+                         "created/started/finished times, output "
+                         "time-weighted averages and maxima of queued and "
+                         "running tasks in time buckets of this width "
+                         "(seconds, or with s/m/h/d suffix like '60s' or "
+                         "'5m')")
+parser.add_argument("--output",
+                    type=str,
+                    help="Save the graph to this file instead of showing it, "
+                         "format per the file extension (e.g. png or svg). "
+                         "Works without a display")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="At the end, print statistics of the run to "
+                         "stderr: wall and CPU time per phase, rows read and "
+                         "skipped per reason, and peak memory. As text "
+                         "(default) or JSON")
+parser.add_argument("--profile",
+                    type=str,
+                    help="Write cProfile dump of the run to this file, see "
+                         "it e.g. by 'python -m pstats FILE'")
+parser.add_argument("--show-graph",
+                    type=bool,
+                    default=True,
+                    help="Show graph of queued and running pulp and "
+                         "candlepin tasks. Requires matplotlib library")
+
+args = parser.parse_args()
+run_stats.start(args.stats, args.profile)
+from_ts = convert_cmdline_time_to_seconds(args.from_ts)
+to_ts = convert_cmdline_time_to_seconds(args.to)
+resolution = convert_duration_to_seconds(args.resolution) \
+    if args.resolution else None
+if resolution is not None and resolution <= 0:
+    parser.error("--resolution must be positive")
+
+print(f"Processing '{args.dynflow_actions}'..")
+run_stats.phase("parse dynflow_actions")
+times = load_external_times(args.dynflow_actions, from_ts, to_ts)
+if sum(len(external) for external in times.values()) == 0:
+    print("No pulp or candlepin task in given time range. Try modifying "
+          "--from and/or --to.")
+    exit()
+
+run_stats.phase("summarize")
+print()
+starts, ends, values = compute_backlog_intervals(times, from_ts, to_ts)
+
+s = "Pulp and candlepin tasks:"
+print(s)
+print("-"*len(s))
+print(f"{'':<10}{'tasks':>10}{'unfinished':>12}{'p50 wait':>12}"
+      f"{'p95 wait':>12}{'p99 wait':>12}{'max.queued':>12}{'max.running':>13}")
+for who in EXTERNAL_SYSTEMS:
+    external = times[who]
+    queued, running = values[who]
+    waits = [external.waits.quantile(q) for q in (0.5, 0.95, 0.99)]
+    waits = "".join(f"{wait:>12,.2f}" if wait is not None else f"{'-':>12}"
+                    for wait in waits)
+    print(f"{SYSTEM_NAMES[who]:<10}{len(external):>10}"
+          f"{external.unfinished:>12}{waits}{max(queued):>12}"
+          f"{max(running):>13}")
+print()
+
+for who in EXTERNAL_SYSTEMS:
+    queued, running = values[who]
+    periods = backlog_periods(starts, ends, queued, running)
+    if len(periods) == 0:
+        continue
+    s = f"Top {args.items_limit} longest periods with {SYSTEM_NAMES[who]} " \
+        f"tasks waiting to start:"
+    print(s)
+    print("-"*len(s))
+    print(f"{'start':<34}{'duration':>12}{'max.queued':>12}"
+          f"{'max.running':>13}")
+    for start, end, max_queued, max_running in sorted(
+            periods, key=lambda x: x[1]-x[0], reverse=True)[
+                0:args.items_limit]:
+        ts_out = datetime.fromtimestamp(start, timezone.utc)
+        print(f"{ts_out.isoformat('T', 'microseconds'):<34}"
+              f"{end-start:>12,.2f}{max_queued:>12}{max_running:>13}")
+    print()
+
+run_stats.phase("write outputs")
+if resolution is None:
+    s = "Intervals with distinct pulp and candlepin backlog"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_actions}.external_backlog.csv"
+    with open(fname, "w") as _file:
+        _file.write("start;duration;" +
+                    ";".join(f"{SYSTEM_NAMES[who]}.{column}"
+                             for who in EXTERNAL_SYSTEMS
+                             for column in ("queued", "running")) + "\n")
+        columns = [column for who in EXTERNAL_SYSTEMS
+                   for column in values[who]]
+        for i, (ts, end) in enumerate(zip(starts, ends)):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
+                        f"{end-ts};" +
+                        ";".join(str(column[i]) for column in columns) +
+                        "\n")
+    print(f".. in {fname}")
+    graph_starts = starts
+    graph_values = values
+else:
+    resampled = {}
+    for who in EXTERNAL_SYSTEMS:
+        queued, running = values[who]
+        bucket_starts, avg_queued, max_queued, avg_running, max_running = \
+            resample_heat_intervals(starts, ends, queued, running,
+                                    resolution)
+        resampled[who] = (avg_queued, max_queued, avg_running, max_running)
+    s = f"Pulp and candlepin backlog in {resolution:g}s buckets"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_actions}.external_backlog.csv"
+    with open(fname, "w") as _file:
+        _file.write("start;duration;" +
+                    ";".join(f"{SYSTEM_NAMES[who]}.{column}"
+                             for who in EXTERNAL_SYSTEMS
+                             for column in ("avg.queued", "max.queued",
+                                            "avg.running", "max.running")) +
+                    "\n")
+        columns = [column for who in EXTERNAL_SYSTEMS
+                   for column in resampled[who]]
+        for i, ts in enumerate(bucket_starts):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
+                        f"{resolution};" +
+                        ";".join(f"{column[i]:g}" for column in columns) +
+                        "\n")
+    print(f".. in {fname}")
+    graph_starts = bucket_starts
+    graph_values = {who: (resampled[who][0], resampled[who][2])
+                    for who in EXTERNAL_SYSTEMS}
+
+if args.show_graph:
+    print()
+    run_stats.phase("graph")
+    try:
+        if args.output:
+            # render without any display
+            import matplotlib
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib import rcParams
+        from matplotlib.dates import DateFormatter
+    except ImportError:
+        print("Missing matplotlib library, try installing python3-matplotlib "
+              "package.")
+        exit()
+    print("Generating graph of pulp and candlepin backlog..")
+    fig, ax = plt.subplots()
+    # no need to plot more than the min and max point per pixel column
+    columns = int(fig.get_figwidth() * fig.dpi)
+    ax.xaxis.set_major_formatter(DateFormatter("%Y-%m-%dT%H:%M:%S"))
+    fig.autofmt_xdate()
+    prefix = "" if resolution is None else "avg."
+    for who in EXTERNAL_SYSTEMS:
+        if len(times[who]) == 0:
+            continue
+        for name, series, linestyle in zip(("queued", "running"),
+                                           graph_values[who],
+                                           ("solid", "dashed")):
+            timestamps, tasks = downsample_peaks(graph_starts, series,
+                                                 columns)
+            timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                          for ts in timestamps]
+            plt.plot(timestamps, tasks, linestyle=linestyle,
+                     antialiased=True, drawstyle='steps-post',
+                     label=f"{prefix}{name} {SYSTEM_NAMES[who]} tasks")
+    timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                  for ts in (graph_starts[0], graph_starts[-1])]
+    ax.set(xlim=(timestamps[0], timestamps[-1]))
+    plt.grid(visible=True, linestyle='dotted')
+    plt.legend()
+    plt.suptitle("Pulp and candlepin backlog over time", weight='bold')
+    plt.title(f"from {timestamps[0]} to {timestamps[-1]}",
+              size=rcParams['font.size']-2)
+    if args.output:
+        plt.savefig(args.output)
+        print(f".. in {args.output}")
+    else:
+        plt.show()
@@ -0,0 +1,92 @@
+# Split big input files into byte ranges aligned to line boundaries and
+# process them in parallel.
+
+import multiprocessing
+import os
+import run_stats
+
+
+def split_to_chunks(fname, jobs):
+    """
+    Return list of (start, end) byte offsets of at most `jobs` chunks of the
+    file, each chunk starting at a line beginning and ending just after a
+    newline (or at the end of the file).
+    """
+    size = os.path.getsize(fname)
+    if jobs <= 1 or size == 0:
+        return [(0, size)]
+    boundaries = [0]
+    with open(fname, 'rb') as _file:
+        for i in range(1, jobs):
+            offset = size * i // jobs
+            if offset <= boundaries[-1]:
+                continue
+            # move to the beginning of the next line
+            _file.seek(offset-1)
+            _file.readline()
+            offset = _file.tell()
+            if offset >= size:
+                break
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_chunk_lines(fname, start, end):
+    """
+    Yield decoded lines of the file within the chunk of byte offsets
+    [start, end).
+    """
+    for offset, line in read_chunk_lines_at(fname, start, end):
+        yield line
+
+
+def read_chunk_lines_at(fname, start, end):
+    """
+    Yield (byte offset, decoded line) of lines of the file within the chunk
+    of byte offsets [start, end).
+    """
+    with open(fname, 'rb') as _file:
+        _file.seek(start)
+        pos = start
+        while pos < end:
+            line = _file.readline()
+            if not line:
+                break
+            yield pos, line.decode('utf-8', errors='replace')
+            pos += len(line)
+
+
+def read_lines_at(fname, offsets):
+    """
+    Yield decoded lines of the file starting at given byte offsets.
+    """
+    with open(fname, 'rb') as _file:
+        for offset in offsets:
+            _file.seek(offset)
+            yield _file.readline().decode('utf-8', errors='replace')
+
+
+def map_chunks(func, fname, jobs, *args):
+    """
+    Call func(fname, start, end, *args) for each chunk of the file, in a pool
+    of `jobs` processes if jobs > 1. Return list of the results, in the order
+    of chunks in the file.
+
+    func has to be a module level function; its result should be a partial
+    summary of the chunk (like filtered intervals or counters) rather than
+    all parsed rows, to keep transferring results back cheap.
+    """
+    chunks = split_to_chunks(fname, jobs)
+    if len(chunks) == 1:
+        return [func(fname, chunks[0][0], chunks[0][1], *args)]
+    # fork start method lets func be defined in the calling script itself
+    with multiprocessing.get_context('fork').Pool(len(chunks)) as pool:
+        results = pool.starmap(run_stats.run_in_worker,
+                               [(func, fname, start, end) + args
+                                for start, end in chunks])
+    # statistics of the workers
+    for result, counters, profile_fname in results:
+        run_stats.merge_worker(counters, profile_fname)
+    return [result for result, counters, profile_fname in results]
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+#
+# Analyze many sosreports (unpacked or tar archives) at once: sidekiq load,
+# polling of pulp tasks and the slowest tasks of each host, and rank the
+# hosts per the peak sidekiq load and polling delays.
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from datetime import *
+from dynflow_records import convert_cmdline_time_to_seconds
+from polling_log import POLLING_LOGFILES, REGEXP_ROTATED_SUFFIX, \
+    SETTINGS_FILE, TS_FORMAT, PollingChecker, read_polling_multiplier, \
+    rotated_logfiles, sosreport_logfiles
+from sidekiq_load import compute_heat_intervals, load_steps, now, \
+    steps_within
+
+# files of a sosreport needed for the analysis, besides POLLING_LOGFILES
+FOREMAN_DIR = 'sos_commands/foreman'
+SOSREPORT_FILES = [f'{FOREMAN_DIR}/dynflow_steps',
+                   f'{FOREMAN_DIR}/dynflow_actions',
+                   f'{FOREMAN_DIR}/foreman_tasks_tasks',
+                   SETTINGS_FILE,
+                   'hostname',
+                   ]
+
+ARCHIVE_SUFFIXES = ('.tar.xz', '.tar.gz', '.tgz', '.tar.bz2', '.tar')
+
+BLAME_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'blame_foreman-task_execution.py')
+
+
+def find_sosreports(root):
+    """
+    Return sorted list of sosreport directories (with sos_commands
+    subdirectory) and sosreport tar archives under root.
+    """
+    sosreports = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if 'sos_commands' in dirnames:
+            sosreports.append(dirpath)
+            # do not look for sosreports inside a sosreport
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            if filename.endswith(ARCHIVE_SUFFIXES):
+                sosreports.append(os.path.join(dirpath, filename))
+    return sorted(sosreports)
+
+
+def sosreport_name(path):
+    name = os.path.basename(path.rstrip('/'))
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def report_names(paths):
+    """
+    Return unique names of the per host reports of sosreports at paths: the
+    sosreport name, with -2, -3, .. suffix if more sosreports (in different
+    directories) have the same name.
+    """
+    names = []
+    used = set()
+    for path in paths:
+        name = base = sosreport_name(path)
+        suffix = 1
+        while name in used:
+            suffix += 1
+            name = f"{base}-{suffix}"
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def _needed_member(relname):
+    if relname in SOSREPORT_FILES or relname in POLLING_LOGFILES:
+        return True
+    # rotated logfiles
+    for logfile in POLLING_LOGFILES:
+        if relname.startswith(logfile) and \
+                REGEXP_ROTATED_SUFFIX.match(relname[len(logfile):]):
+            return True
+    return False
+
+
+def extract_sosreport(archive, destdir):
+    """
+    Extract just the files needed for the analysis from sosreport archive to
+    destdir, in one streaming pass over the (compressed) archive. Return the
+    sosreport directory within destdir.
+    """
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            # strip the top directory like sosreport-host-2024-09-04-abcdef
+            parts = member.name.split('/', 1)
+            if len(parts) < 2 or not _needed_member(parts[1]):
+                continue
+            # the target path is built from a known relative name only
+            target = os.path.join(destdir, parts[1])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with tar.extractfile(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+    return destdir
+
+
+def heat_summary(sosreport_dir, from_ts, to_ts, items_limit):
+    """
+    Return dict with peak sidekiq load and concurrent steps and with labels
+    of the most busy dynflow steps of the sosreport.
+    """
+    fname = os.path.join(sosreport_dir, FOREMAN_DIR, 'dynflow_steps')
+    if not os.path.isfile(fname):
+        return None
+    steps = load_steps(fname, from_ts, to_ts)
+    starts, finishes, exectimes, step_labels, labels = \
+        steps_within(steps, from_ts, to_ts)
+    if len(starts) == 0:
+        return None
+    heat_starts, heat_ends, heat_steps, heat_loads = \
+        compute_heat_intervals(starts, finishes, exectimes)
+    peak = max(range(len(heat_loads)), key=lambda i: heat_loads[i])
+    top_labels = sorted(labels.items(), key=lambda x: x[1]['exectime'],
+                        reverse=True)[0:items_limit]
+    return {'steps': len(starts),
+            'peak_load': heat_loads[peak],
+            'peak_load_at': heat_starts[peak],
+            'peak_steps': max(heat_steps),
+            'top_labels': top_labels}
+
+
+def polling_summary(sosreport_dir, rounding_error, evict_after):
+    """
+    Return dict with polling delays of pulp tasks found in logs of the
+    sosreport.
+    """
+    multiplier = read_polling_multiplier(sosreport_dir) or 1
+    maxdelay = 16 * multiplier + rounding_error
+    delays = []
+    for _file in sosreport_logfiles(sosreport_dir):
+        checker = PollingChecker(maxdelay, evict_after)
+        for logfile in rotated_logfiles(_file):
+            delays.extend(checker.check_logfile(logfile))
+    return {'multiplier': multiplier,
+            'maxdelay': maxdelay,
+            'delays': delays}
+
+
+def blame_summary(sosreport_dir, top, from_arg, to_arg):
+    """
+    Return output of blame script for the `top` slowest tasks of the
+    sosreport, or None if the sosreport has no tasks data.
+    """
+    fdir = os.path.join(sosreport_dir, FOREMAN_DIR)
+    for fname in ('foreman_tasks_tasks', 'dynflow_steps', 'dynflow_actions'):
+        if not os.path.isfile(os.path.join(fdir, fname)):
+            return None
+    result = subprocess.run([sys.executable, BLAME_SCRIPT, fdir,
+                             '--top', str(top), '--from', from_arg,
+                             '--to', to_arg],
+                            capture_output=True, text=True)
+    return result.stdout + result.stderr
+
+
+def analyze_sosreport_dir(sosreport_dir, args):
+    hostname_file = os.path.join(sosreport_dir, 'hostname')
+    hostname = None
+    if os.path.isfile(hostname_file):
+        hostname = open(hostname_file, 'r').read().strip() or None
+    from_ts = convert_cmdline_time_to_seconds(args.from_ts)
+    to_ts = convert_cmdline_time_to_seconds(args.to)
+    return {'hostname': hostname,
+            'heat': heat_summary(sosreport_dir, from_ts, to_ts,
+                                 args.items_limit),
+            'polling': polling_summary(sosreport_dir,
+                                       args.add_rounding_error,
+                                       args.evict_after),
+            'blame': blame_summary(sosreport_dir, args.top, args.from_ts,
+                                   args.to) if args.top > 0 else None}
+
+
+def analyze_sosreport(path, name, args):
+    """
+    Analyze one sosreport directory or archive with given report name. Return
+    dict with the results, or with 'error' if the sosreport can not be
+    analyzed.
+    """
+    result = {'path': path, 'name': name}
+    try:
+        if os.path.isdir(path):
+            result.update(analyze_sosreport_dir(path, args))
+        else:
+            with tempfile.TemporaryDirectory(prefix='fleet_stats_') as tmp:
+                result.update(analyze_sosreport_dir(
+                    extract_sosreport(path, tmp), args))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    if result.get('hostname') is None:
+        result['hostname'] = result['name']
+    return result
+
+
+def _analyze_sosreport(job):
+    return analyze_sosreport(*job)
+
+
+def _format_ts(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(' ', 'seconds')
+
+
+def write_report(fname, result):
+    with open(fname, "w") as _file:
+        _file.write(f"Host {result['hostname']} from {result['path']}\n\n")
+        if 'error' in result:
+            _file.write(f"Analysis failed: {result['error']}\n")
+            return
+        heat = result['heat']
+        s = "Sidekiq load"
+        _file.write(f"{s}\n{'-'*len(s)}\n")
+        if heat is None:
+            _file.write("No dynflow steps found.\n\n")
+        else:
+            _file.write(f"steps: {heat['steps']}\n"
+                        f"peak load: {heat['peak_load']:.2f} at "
+                        f"{_format_ts(heat['peak_load_at'])}\n"
+                        f"peak concurrent steps: {heat['peak_steps']}\n\n")
+            _file.write(f"{'steps':<8}{'exec.time':<14}label\n")
+            for label, values in heat['top_labels']:
+                _file.write(f"{values['count']:<8}"
+                            f"{values['exectime']:<14,.2f}{label}\n")
+            _file.write("\n")
+        polling = result['polling']
+        s = "Polling of pulp tasks"
+        _file.write(f"{s}\n{'-'*len(s)}\n")
+        _file.write(f"foreman_tasks_polling_multiplier="
+                    f"{polling['multiplier']}, maximum delay "
+                    f"{polling['maxdelay']}s, {len(polling['delays'])} "
+                    f"delays found\n")
+        for task_id, prev, poll, diff in polling['delays']:
+            _file.write(f"Task '{task_id}' polled at "
+                        f"'{prev.strftime(TS_FORMAT)}' and then at "
+                        f"'{poll.strftime(TS_FORMAT)}', delay {diff}s\n")
+        _file.write("\n")
+        if result['blame'] is not None:
+            s = "Slowest tasks"
+            _file.write(f"{s}\n{'-'*len(s)}\n")
+            _file.write(result['blame'])
+
+
+parser = argparse.ArgumentParser(description="Sidekiq load, polling of pulp "
+                                             "tasks and slowest tasks of "
+                                             "many sosreports")
+parser.add_argument("root",
+                    help="Directory with unpacked sosreports and/or sosreport "
+                         "tar archives (searched recursively)")
+parser.add_argument("--output-dir", "-o",
+                    type=str,
+                    default="fleet_stats",
+                    help="Directory for the per host reports and the summary")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=os.cpu_count(),
+                    help="Number of sosreports analyzed in parallel")
+parser.add_argument("--top",
+                    type=int,
+                    default=5,
+                    help="Blame this number of the slowest tasks of each "
+                         "host, 0 to skip the blame")
+parser.add_argument("--items-limit",
+                    type=int,
+                    default=5,
+                    help="Limit of ordered dynflow steps statistics per host")
+parser.add_argument("--from", "--since",
+                    dest='from_ts',
+                    type=str,
+                    default="0",
+                    help="Consider tasks from this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--to", "--till",
+                    type=str,
+                    default=str(now),
+                    help="Consider tasks to this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--add-rounding-error", "-a",
+                    type=int,
+                    default=2,
+                    help="Allowed polling delay above the maximum, see "
+                         "check_dynflow_polling.py")
+parser.add_argument("--evict-after",
+                    type=int,
+                    default=86400,
+                    help="Forget a pulp task not polled for this number of "
+                         "seconds, see check_dynflow_polling.py")
+
+args = parser.parse_args()
+
+sosreports = find_sosreports(args.root)
+if len(sosreports) == 0:
+    print(f"No sosreport found in {args.root}")
+    exit()
+os.makedirs(args.output_dir, exist_ok=True)
+
+print(f"Analyzing {len(sosreports)} sosreports..")
+results = []
+jobs = [(path, name, args)
+        for path, name in zip(sosreports, report_names(sosreports))]
+# fork start method lets the workers use the parsed arguments as they are
+with multiprocessing.get_context('fork').Pool(max(1, args.jobs)) as pool:
+    for result in pool.imap_unordered(_analyze_sosreport, jobs):
+        fname = os.path.join(args.output_dir, f"{result['name']}.txt")
+        write_report(fname, result)
+        status = result.get('error', f".. in {fname}")
+        print(f"{result['hostname']}: {status}")
+        results.append(result)
+print()
+
+
+def _rank_key(result):
+    heat = result.get('heat')
+    polling = result.get('polling')
+    return (-(heat['peak_load'] if heat else 0.0),
+            -(len(polling['delays']) if polling else 0))
+
+
+s = "Hosts per peak sidekiq load and polling delays"
+print(s)
+print("-"*len(s))
+fname = os.path.join(args.output_dir, "fleet_summary.csv")
+print(f"{'rank':<6}{'peak.load':>10}{'peak.steps':>12}{'poll.delays':>13}"
+      f"{'max.delay':>11}  host")
+with open(fname, "w") as _file:
+    _file.write("rank;host;peak.load;peak.load.at;peak.steps;poll.delays;"
+                "max.delay;sosreport;report;error\n")
+    for rank, result in enumerate(sorted(results, key=_rank_key), start=1):
+        heat = result.get('heat')
+        polling = result.get('polling')
+        peak_load = heat['peak_load'] if heat else 0.0
+        peak_load_at = _format_ts(heat['peak_load_at']) if heat else ''
+        peak_steps = heat['peak_steps'] if heat else 0
+        delays = len(polling['delays']) if polling else 0
+        max_delay = max((diff for task_id, prev, poll, diff in
+                         polling['delays']), default=0) if polling else 0
+        print(f"{rank:<6}{peak_load:>10,.2f}{peak_steps:>12}{delays:>13}"
+              f"{max_delay:>11}  {result['hostname']}")
+        _file.write(f"{rank};{result['hostname']};{peak_load};"
+                    f"{peak_load_at};{peak_steps};{delays};{max_delay};"
+                    f"{result['path']};{result['name']}.txt;"
+                    f"{result.get('error', '')}\n")
+print(f".. in {fname}")
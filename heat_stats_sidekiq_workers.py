@@ -2,28 +2,12 @@
 
 import argparse
 from datetime import *
-from dateutil.tz import tzutc
-
-intervals = []
-timestamps = set()
-utctz = tzutc()
-now = datetime.now().replace(tzinfo=utctz).timestamp()
-
-
-def _convert_date_time_to_seconds(ts):
-    ret = None
-    for fmt in ["%Y-%m-%d %H:%M:%S.%f",
-                "%Y-%m-%d %H:%M:%S",
-                "%Y-%m-%d"]:
-        try:
-            ret = datetime.strptime(ts, fmt) \
-                          .replace(tzinfo=utctz).timestamp()
-        except ValueError:
-            pass
-        if ret:
-            return ret
-    # no string format, so seconds since Epoch
-    return float(ts)
+from dynflow_records import convert_cmdline_time_to_seconds, \
+    convert_duration_to_seconds
+import os
+import run_stats
+from sidekiq_load import compute_heat_intervals, compute_label_loads, \
+    downsample_peaks, load_steps, now, resample_heat_intervals, steps_within
 
 
 parser = argparse.ArgumentParser(description="Sidekiq workers heat stats and "
@@ -45,6 +29,60 @@ parser.add_argument("--items-limit",
                     type=int,
                     default=5,
                     help="Limit of ordered dynflow steps statistics")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing the input file in "
+                         "parallel")
+cache_group = parser.add_mutually_exclusive_group()
+cache_group.add_argument("--cache",
+                         action="store_true",
+                         help="Use parsed data cached in dynflow_steps.cache "
+                              "next to the input file, create or refresh the "
+                              "cache if needed. Speeds up repeated runs over "
+                              "the same file")
+cache_group.add_argument("--index",
+                         action="store_true",
+                         help="Use index of steps per time stored in "
+                              "dynflow_steps.index next to the input file, "
+                              "create or refresh the index if needed. Then "
+                              "read just steps within --from and --to")
+parser.add_argument("--bucket",
+                    type=str,
+                    help="Compute sidekiq load per dynflow step label in "
+                         "time buckets of this width (seconds, or with "
+                         "s/m/h/d suffix like '60s' or '5m')")
+parser.add_argument("--bucket-labels",
+                    type=int,
+                    default=10,
+                    help="With --bucket, number of labels with the biggest "
+                         "execution time to show separately, the others are "
+                         "summed as 'other'")
+parser.add_argument("--resolution",
+                    type=str,
+                    help="Instead of intervals between all distinct step "
+                         "start/finish times, output time-weighted averages "
+                         "and maxima of the load in time buckets of this "
+                         "width (seconds, or with s/m/h/d suffix like '60s' "
+                         "or '5m')")
+parser.add_argument("--output",
+                    type=str,
+                    help="Save the graph(s) to this file instead of showing "
+                         "them, format per the file extension (e.g. png or "
+                         "svg). Works without a display")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="At the end, print statistics of the run to "
+                         "stderr: wall and CPU time per phase, rows read and "
+                         "skipped per reason, and peak memory. As text "
+                         "(default) or JSON")
+parser.add_argument("--profile",
+                    type=str,
+                    help="Write cProfile dump of the run (including --jobs "
+                         "worker processes) to this file, see it e.g. by "
+                         "'python -m pstats FILE'")
 parser.add_argument("--show-graph",
                     type=bool,
                     default=True,
@@ -52,91 +90,52 @@ parser.add_argument("--show-graph",
                          "Requires matplotlib library")
 
 args = parser.parse_args()
-from_ts = _convert_date_time_to_seconds(args.from_ts)
-to_ts = _convert_date_time_to_seconds(args.to)
+run_stats.start(args.stats, args.profile)
+from_ts = convert_cmdline_time_to_seconds(args.from_ts)
+to_ts = convert_cmdline_time_to_seconds(args.to)
+bucket = convert_duration_to_seconds(args.bucket) if args.bucket else None
+if bucket is not None and bucket <= 0:
+    parser.error("--bucket must be positive")
+resolution = convert_duration_to_seconds(args.resolution) \
+    if args.resolution else None
+if resolution is not None and resolution <= 0:
+    parser.error("--resolution must be positive")
 
-if from_ts == 0 and to_ts == now:
+if from_ts == 0 and to_ts == now and not args.cache:
     print("Warning: with no --from and --to, the processing time may be long.")
 
 print(f"Processing '{args.dynflow_steps}'..")
-for line in open(args.dynflow_steps, 'r'):
-    cols = line.split(',')
-    # ignore incomplete lines
-    if len(cols) < 16:
-        continue
-    start = cols[4]
-    finish = cols[5]
-    exectime = cols[7]
-    label = cols[11]
-    if len(start)*len(exectime) == 0:
-        continue
-    try:
-        start = _convert_date_time_to_seconds(start)
-    except ValueError:
-        continue
-    if len(finish) == 0:
-        finish = now
-    else:
-        try:
-            finish = _convert_date_time_to_seconds(finish)
-        except ValueError:
-            continue
-    try:
-        exectime = float(exectime)
-    except Exception:
-        continue
-    # skip tasks completely outside specified interval
-    if start > to_ts or finish < from_ts:
-        continue
-    # truncate steps starting before --from and adjust exectime accordingly
-    if start < from_ts:
-        exectime *= (finish-from_ts) / (finish-start)
-        start = from_ts
-    # truncate steps ending after --to and adjust exectime accordingly
-    if finish > to_ts:
-        exectime *= (to_ts-start) / (finish-start)
-        finish = to_ts
-    intervals.append((start, finish, exectime, label))
-    timestamps.add(start)
-    timestamps.add(finish)
-
+run_stats.phase("parse dynflow_steps")
+steps = load_steps(args.dynflow_steps, from_ts, to_ts, args.jobs, args.cache,
+                   args.index)
+run_stats.phase("summarize")
+# labels: dict with key of dynflow step label and values:
+#   'count': count of the label in input data
+#   'exectime': sum of execution times of steps with this label
+starts, finishes, exectimes, step_labels, labels = \
+    steps_within(steps, from_ts, to_ts)
 
-if len(timestamps) == 0:
-    print(f"No data in given time range. Try modifying --from and/or --to.")
+if len(starts) == 0:
+    print("No data in given time range. Try modifying --from and/or --to.")
     exit()
 
 # TODO: add progress bar e.g. from
 # https://github.com/pavlinamv/rails-load-stats-py/blob/main/progress_bar.py
 print("Summarizing input data..")
 print()
-# sorted list of timestamps for easy "get me next timestamp/interval" search
-timestamps_sorted = list(sorted(timestamps))
 # output data structure to keep info like
 # start_interval - end_interval: #dynflow_steps, avg_exec_load
-# where start_interval is key to the dict
-heat_intervals = dict()
-# labels: dict with key of dynflow step label and values:
-#   'count': count of the label in input data
-#   'exectime': sum of execution times of steps with this label
-labels = dict()
-ts_prev = 0
-for ts in timestamps_sorted:
-    heat_intervals[ts] = {'end': now, 'steps': 0, 'load': 0.0}
-    if ts_prev > 0:
-        heat_intervals[ts_prev]['end'] = ts
-    ts_prev = ts
-
-for start, finish, exectime, label in intervals:
-    if label not in labels.keys():
-        labels[label] = {'count': 0, 'exectime': 0.0}
-    labels[label]['count'] += 1
-    labels[label]['exectime'] += exectime
-    load = exectime / (finish-start)
-    ts = start
-    while finish > heat_intervals[ts]['end']:
-        heat_intervals[ts]['steps'] += 1
-        heat_intervals[ts]['load'] += load
-        ts = heat_intervals[ts]['end']  # skip to the next interval
+heat_starts, heat_ends, heat_steps, heat_loads = \
+    compute_heat_intervals(starts, finishes, exectimes)
+if bucket is not None:
+    # columns of the top labels per execution time, then 'other' column
+    top_labels = sorted(labels.keys(), key=lambda x: labels[x]['exectime'],
+                        reverse=True)[0:args.bucket_labels]
+    column_of = [len(top_labels)] * len(steps.labels)
+    for column, label in enumerate(top_labels):
+        column_of[steps.labels.index(label)] = column
+    bucket_starts, label_loads = compute_label_loads(
+        starts, finishes, exectimes, step_labels, column_of, bucket)
 
 labels_list = [(label[1]['count'], label[1]['exectime'], label[0])
                for label in labels.items()]
@@ -159,23 +158,68 @@ for steps, exectime, label in labels_list[0:args.items_limit]:
     print(f"{steps:<8}{exectime:<10,.2f}{label}")
 print()
 
-s = "Intervals with distinct sidekiq load"
-print(s)
-print("-"*len(s))
-fname = f"{args.dynflow_steps}.sidekiq_load.csv"
-with open(fname, "w") as _file:
-    _file.write("start;duration;concur.steps;avg.exec.load\n")
-    for ts in heat_intervals.keys():
-        ts_out = datetime.fromtimestamp(ts, timezone.utc)
-        _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
-                    f"{heat_intervals[ts]['end']-ts};"
-                    f"{heat_intervals[ts]['steps']};"
-                    f"{heat_intervals[ts]['load']}\n")
-print(f".. in {fname}")
+run_stats.phase("write outputs")
+if resolution is None:
+    s = "Intervals with distinct sidekiq load"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_steps}.sidekiq_load.csv"
+    with open(fname, "w") as _file:
+        _file.write("start;duration;concur.steps;avg.exec.load\n")
+        for ts, end, steps, load in zip(heat_starts, heat_ends, heat_steps,
+                                        heat_loads):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
+                        f"{end-ts};"
+                        f"{steps};"
+                        f"{load}\n")
+    print(f".. in {fname}")
+else:
+    heat_starts, avg_steps, max_steps, avg_loads, max_loads = \
+        resample_heat_intervals(heat_starts, heat_ends, heat_steps,
+                                heat_loads, resolution)
+    heat_steps = avg_steps
+    heat_loads = avg_loads
+    s = f"Sidekiq load in {resolution:g}s buckets"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_steps}.sidekiq_load.csv"
+    with open(fname, "w") as _file:
+        _file.write("start;duration;avg.concur.steps;max.concur.steps;"
+                    "avg.exec.load;max.exec.load\n")
+        for ts, avg_step, max_step, avg_load, max_load in zip(
+                heat_starts, avg_steps, max_steps, avg_loads, max_loads):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
+                        f"{resolution};"
+                        f"{avg_step};"
+                        f"{max_step:g};"
+                        f"{avg_load};"
+                        f"{max_load}\n")
+    print(f".. in {fname}")
+
+if bucket is not None:
+    print()
+    s = f"Sidekiq load per label in {bucket:g}s buckets"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_steps}.label_load.csv"
+    with open(fname, "w") as _file:
+        _file.write(";".join(["start"] + top_labels + ["other"]) + "\n")
+        for ts, loads in zip(bucket_starts, label_loads):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};" +
+                        ";".join(str(load) for load in loads) + "\n")
+    print(f".. in {fname}")
 
 if args.show_graph:
     print()
+    run_stats.phase("graph")
     try:
+        if args.output:
+            # render without any display
+            import matplotlib
+            matplotlib.use('Agg')
         import matplotlib.pyplot as plt
         from matplotlib import rcParams
         from matplotlib.dates import DateFormatter
@@ -184,22 +228,56 @@ if args.show_graph:
               "package.")
         exit()
     print("Generating heat graph of dynflow/sidekiq usage..")
-    timestamps = [datetime.fromtimestamp(ts, timezone.utc)
-                  for ts in heat_intervals.keys()]
-    steps = [val['steps'] for val in heat_intervals.values()]
-    loads = [val['load'] for val in heat_intervals.values()]
     fig, ax = plt.subplots()
+    # no need to plot more than the min and max point per pixel column
+    columns = int(fig.get_figwidth() * fig.dpi)
+    timestamps, steps = downsample_peaks(heat_starts, heat_steps, columns)
+    timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                  for ts in timestamps]
     ax.xaxis.set_major_formatter(DateFormatter("%Y-%m-%dT%H:%M:%S"))
     # TODO: on x-axis, print value at minimum/start?
     ax.set(xlim=(timestamps[0], timestamps[-1]))
     fig.autofmt_xdate()
     plt.plot(timestamps, steps, marker='.', antialiased=True, mouseover=False,
-             label="concur. dynflow steps")
+             label="concur. dynflow steps" if resolution is None else
+                   "avg.concur. dynflow steps")
+    timestamps, loads = downsample_peaks(heat_starts, heat_loads, columns)
+    timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                  for ts in timestamps]
     plt.plot(timestamps, loads, marker='.', antialiased=True, mouseover=True,
              label="sidekiq avg.load")
+    if resolution is not None:
+        timestamps, loads = downsample_peaks(heat_starts, max_loads, columns)
+        timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                      for ts in timestamps]
+        plt.plot(timestamps, loads, linestyle='dashed', antialiased=True,
+                 label="sidekiq max.load")
     plt.grid(visible=True, linestyle='dotted')
     plt.legend()
-    plt.suptitle(f"Sidekiq load over time", weight='bold')
+    plt.suptitle("Sidekiq load over time", weight='bold')
     plt.title(f"from {timestamps[0]} to {timestamps[-1]}",
               size=rcParams['font.size']-2)
-    plt.show()
+    if bucket is not None:
+        timestamps = [datetime.fromtimestamp(ts, timezone.utc)
+                      for ts in bucket_starts]
+        fig, ax = plt.subplots()
+        ax.xaxis.set_major_formatter(DateFormatter("%Y-%m-%dT%H:%M:%S"))
+        ax.set(xlim=(timestamps[0], timestamps[-1]))
+        fig.autofmt_xdate()
+        ax.stackplot(timestamps, list(zip(*label_loads)),
+                     labels=top_labels + ["other"], step='post')
+        plt.grid(visible=True, linestyle='dotted')
+        plt.legend(loc='upper left', fontsize='small')
+        plt.suptitle("Sidekiq load per label", weight='bold')
+        plt.title(f"in {bucket:g}s buckets from {timestamps[0]} to "
+                  f"{timestamps[-1]}", size=rcParams['font.size']-2)
+    if args.output:
+        root, ext = os.path.splitext(args.output)
+        plt.figure(1).savefig(args.output)
+        print(f".. in {args.output}")
+        if bucket is not None:
+            fname = f"{root}.label_load{ext}"
+            plt.figure(2).savefig(fname)
+            print(f".. in {fname}")
+    else:
+        plt.show()
@@ -0,0 +1,331 @@
+# Reading of logs with polling of pulp tasks by dynflow/sidekiq.
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+import subprocess
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from datetime import *
+from functools import lru_cache
+from glob import escape, glob
+from os.path import isfile, join
+from run_stats import counters
+
+# extract timestamp and task id from log entries like:
+# 1.2.3.4 - - [08/Oct/2024:10:04:49 +0200] "GET /pulp/api/v3/tasks/01926b28-cf33-7a80-afdc-3d0413d900f6/ HTTP/1.1" 200 559 "-" "OpenAPI-Generator/3.39.2/ruby"
+REGEXP_GET_PULPTASK = re.compile(
+        r"\[([^\]]*)\] \"GET /pulp/api/v3/tasks/(.*)/ ")
+
+# substring of each line REGEXP_GET_PULPTASK can match; much cheaper test to
+# skip the vast majority of other log lines
+GET_PULPTASK = '"GET /pulp/api/v3/tasks/'
+
+# timestamp format in input data
+TS_FORMAT = '%d/%b/%Y:%H:%M:%S'
+
+# logfiles of a sosreport with polling of pulp tasks
+POLLING_LOGFILES = ['var/log/httpd/foreman-ssl_access_ssl.log',
+                    'var/log/messages',
+                    'sos_commands/logs/journalctl_--no-pager',
+                    ]
+
+# file of a sosreport with foreman settings
+SETTINGS_FILE = 'sos_commands/foreman/foreman_settings_table'
+
+# parse foreman_settings_table line like:
+#  18 | foreman_tasks_polling_multiplier      | --- 5 ..
+REGEXP_POLLING_MULTIPLIER = re.compile(
+        r".* foreman_tasks_polling_multiplier.*--- (\d+)")
+
+MONTHS = {month: i for i, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+     'Nov', 'Dec'], start=1)}
+
+# suffixes of rotated logfiles like .1, .2.gz or -20241008.xz
+REGEXP_ROTATED_SUFFIX = re.compile(
+        r"^(?:\.(\d+)|-(\d{8,10}))(?:\.(?:gz|xz|bz2))?$")
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(ts):
+    """
+    Parse timestamp in TS_FORMAT like '08/Oct/2024:10:04:49', optionally
+    followed by UTC offset like ' +0200', to a timezone aware datetime (UTC if
+    there is no offset). Many log lines share the same second, so the results
+    are cached.
+    """
+    tz = timezone.utc
+    if len(ts) >= 26 and ts[21] in '+-' and ts[22:26].isdigit():
+        offset = timedelta(hours=int(ts[22:24]), minutes=int(ts[24:26]))
+        tz = timezone(offset if ts[21] == '+' else -offset)
+    try:
+        return datetime(int(ts[7:11]), MONTHS[ts[3:6]], int(ts[0:2]),
+                        int(ts[12:14]), int(ts[15:17]), int(ts[18:20]),
+                        tzinfo=tz)
+    except (KeyError, ValueError):
+        return datetime.strptime(ts[:20], TS_FORMAT).replace(tzinfo=tz)
+
+
+def parse_pulptask_poll(line):
+    """
+    Return (timestamp, task_id) of a log line with polling of a pulp task, or
+    None for other lines.
+    """
+    if GET_PULPTASK not in line:
+        return None
+    match = REGEXP_GET_PULPTASK.search(line)
+    if not match:
+        return None
+    return parse_timestamp(match.group(1)), match.group(2)
+
+
+def rotated_logfiles(logfile):
+    """
+    Return list of the logfile and its rotated siblings (possibly compressed)
+    that exist, ordered from the oldest one to the logfile itself.
+    """
+    rotated = []
+    for path in glob(f"{escape(logfile)}*"):
+        match = REGEXP_ROTATED_SUFFIX.match(path[len(logfile):])
+        if not match:
+            continue
+        if match.group(1):
+            # logfile.1 is newer than logfile.2
+            rotated.append(((1, -int(match.group(1))), path))
+        else:
+            # logfile-20241008 is older than logfile-20241015
+            rotated.append(((0, int(match.group(2))), path))
+    logfiles = [path for key, path in sorted(rotated)]
+    if isfile(logfile):
+        logfiles.append(logfile)
+    return logfiles
+
+
+def open_logfile(logfile):
+    """
+    Open (possibly compressed) logfile for streaming reading as text.
+    """
+    for suffix, module in (('.gz', gzip), ('.xz', lzma), ('.bz2', bz2)):
+        if logfile.endswith(suffix):
+            return module.open(logfile, 'rt', encoding="utf-8",
+                               errors="replace")
+    return open(logfile, encoding="utf-8", errors="replace")
+
+
+def sosreport_logfiles(sosreport_dir):
+    """
+    Return list of POLLING_LOGFILES present (possibly just rotated) in the
+    sosreport directory.
+    """
+    logfiles = []
+    for logfile in POLLING_LOGFILES:
+        fullpath = join(sosreport_dir, logfile)
+        if len(rotated_logfiles(fullpath)) > 0:
+            logfiles.append(fullpath)
+    return logfiles
+
+
+def read_polling_multiplier(sosreport_dir):
+    """
+    Return foreman_tasks_polling_multiplier from foreman settings stored in
+    the sosreport directory, or None if not found.
+    """
+    settings_file = join(sosreport_dir, SETTINGS_FILE)
+    if isfile(settings_file):
+        for line in open(settings_file, 'r'):
+            match = REGEXP_POLLING_MULTIPLIER.match(line)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+class DelayHistogram:
+    """
+    Histogram of polling delays within a rolling time window. Counts are kept
+    per time slots of `slot` seconds (of the log time), slots older than
+    `window` seconds than the latest one are dropped, so the memory is
+    bounded.
+    """
+
+    def __init__(self, bounds, window=3600, slot=60):
+        # upper bounds of the buckets, the last bucket is unbounded
+        self.bounds = sorted(bounds)
+        self.window = window
+        self.slot = slot
+        # (slot start, counts per bucket) ordered from the oldest slot
+        self.slots = deque()
+
+    def add(self, ts, delay):
+        """
+        Add delay (in seconds) of polling at ts (seconds since Epoch).
+        """
+        slot_start = ts - ts % self.slot
+        if len(self.slots) == 0 or self.slots[-1][0] < slot_start:
+            self.slots.append((slot_start,
+                               [0] * (len(self.bounds)+1)))
+            while self.slots[0][0] <= slot_start - self.window:
+                self.slots.popleft()
+        for start, counts in reversed(self.slots):
+            if start == slot_start:
+                counts[bisect_left(self.bounds, delay)] += 1
+                return
+            if start < slot_start:
+                # too old or in a gap, can not be counted
+                return
+
+    def counts(self):
+        """
+        Return list of (upper bound or None, count) of all buckets summed
+        over the window.
+        """
+        counts = [0] * (len(self.bounds)+1)
+        for start, slot_counts in self.slots:
+            counts = [a+b for a, b in zip(counts, slot_counts)]
+        return list(zip(self.bounds + [None], counts))
+
+
+class PollingChecker:
+    """
+    Checker of delays between pollings of the same pulp task. Logfiles or
+    lines fed one by one (like rotated logfiles from the oldest one) are
+    treated as one continuous stream, to catch delays across logrotate.
+    """
+
+    def __init__(self, maxdelay, evict_after, max_tasks=None,
+                 histogram=None):
+        self.maxdelay = maxdelay
+        self.evict_after = timedelta(seconds=evict_after)
+        # at most this number of tasks is tracked, the least recently seen
+        # ones are forgotten first
+        self.max_tasks = max_tasks
+        # DelayHistogram of all the delays, if set
+        self.histogram = histogram
+        # last_seen: when polling status of a pulp task was last seen?
+        # key: task UUID, value: datetime; ordered from the least recently
+        # seen task, to evict tasks not seen for evict_after
+        self.last_seen = OrderedDict()
+
+    def check_lines(self, lines):
+        """
+        Yield (task_id, previous poll, poll, delay in seconds) of pollings of
+        a pulp task in the lines delayed more than maxdelay.
+        """
+        last_seen = self.last_seen
+        read = polls = 0
+        for line in lines:
+            read += 1
+            poll = parse_pulptask_poll(line)
+            if poll is None:
+                continue
+            polls += 1
+            now, task_id = poll
+            prev = last_seen.pop(task_id, None)
+            if prev is not None:
+                diff = int((now-prev).total_seconds())
+                if self.histogram is not None:
+                    self.histogram.add(now.timestamp(), diff)
+                if diff > self.maxdelay:
+                    yield task_id, prev, now, diff
+            last_seen[task_id] = now
+            while now - next(iter(last_seen.values())) > self.evict_after:
+                last_seen.popitem(last=False)
+            if self.max_tasks is not None:
+                while len(last_seen) > self.max_tasks:
+                    last_seen.popitem(last=False)
+        counters['polling logs: lines read'] += read
+        counters['polling logs: polls of pulp tasks'] += polls
+
+    def check_logfile(self, logfile):
+        """
+        Same as check_lines, for all lines of the logfile.
+        """
+        with open_logfile(logfile) as _log:
+            yield from self.check_lines(_log)
+
+
+class LogFollower:
+    """
+    Follower of lines appended to a growing logfile, like `tail -F`. When the
+    logfile is rotated (replaced by a new file) or truncated, the rest of the
+    old file is read and then the new one from its beginning.
+    """
+
+    def __init__(self, logfile, from_start=False):
+        self.logfile = logfile
+        self._file = None
+        # incomplete last line read so far
+        self.partial = b''
+        self._open(from_start)
+
+    def _open(self, from_start):
+        try:
+            self._file = open(self.logfile, 'rb')
+        except OSError:
+            self._file = None
+            return
+        if not from_start:
+            self._file.seek(0, os.SEEK_END)
+
+    def _read(self):
+        lines = (self.partial + self._file.read()).split(b'\n')
+        self.partial = lines.pop()
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def read_lines(self):
+        """
+        Return list of complete lines appended since the last call.
+        """
+        if self._file is None:
+            # the logfile did not exist yet
+            self._open(True)
+            return self._read() if self._file is not None else []
+        lines = self._read()
+        try:
+            stat = os.stat(self.logfile)
+        except OSError:
+            # rotated and the new file not created yet
+            return lines
+        if stat.st_ino != os.fstat(self._file.fileno()).st_ino or \
+                stat.st_size < self._file.tell():
+            lines.extend(self._read())
+            self._file.close()
+            self.partial = b''
+            self._open(True)
+            lines.extend(self._read())
+        return lines
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class CommandFollower:
+    """
+    Follower of lines of output of a running command, like
+    `journalctl --follow`, with the same interface as LogFollower.
+    """
+
+    def __init__(self, command):
+        self.logfile = ' '.join(command)
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        os.set_blocking(self.process.stdout.fileno(), False)
+        self.partial = b''
+
+    def read_lines(self):
+        """
+        Return list of complete lines output since the last call.
+        """
+        data = self.process.stdout.read()
+        if not data:
+            return []
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
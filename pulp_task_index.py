@@ -0,0 +1,149 @@
+# Index of pulp tasks per their UUID: which dynflow action (and so which
+# foreman task) ran the pulp task.
+#
+# The index is built in one streaming pass over dynflow_actions (hrefs of
+# pulp tasks in the action outputs) and one over foreman_tasks_tasks, and it
+# is stored next to dynflow_actions (dynflow_actions.pulp_index) in the same
+# binary columnar format like the steps cache. Rows are sorted per pulp task
+# UUID, stored as two 64bit halves, so a lookup is a binary search in the
+# memory-mapped file instead of loading a whole hash table. Dynflow plans
+# and their foreman task UUIDs and labels are tables in the header.
+
+from actions_reader import iter_pulp_task_uuids
+from array import array
+from bisect import bisect_left
+import os
+from run_stats import counters
+from steps_cache import load_columns, write_columns
+
+MAGIC = b'PULPIDX1'
+
+# name and array typecode of the columns
+#   uuid_high, uuid_low: the pulp task UUID as two 64bit integers
+#   plan: index to the dynflow plans table
+#   action: dynflow action id
+COLUMNS = (('uuid_high', 'Q'),
+           ('uuid_low', 'Q'),
+           ('plan', 'I'),
+           ('action', 'Q'))
+
+
+def _uuid_halves(uuid):
+    """
+    Return the UUID string as (high, low) 64bit integers, or None if it is
+    not a UUID.
+    """
+    if len(uuid) != 36:
+        return None
+    try:
+        value = int(uuid.replace('-', ''), 16)
+    except ValueError:
+        return None
+    return value >> 64, value & 0xffffffffffffffff
+
+
+class PulpTaskIndex:
+    """
+    Columns of the index (see COLUMNS) sorted per pulp task UUID, the dynflow
+    plans table and [foreman task UUID, label] per plan (or None if the plan
+    is not in foreman_tasks_tasks).
+    """
+
+    def __init__(self, columns, plans, tasks):
+        self.rows = len(columns['uuid_high'])
+        self.columns = columns
+        for name, typecode in COLUMNS:
+            setattr(self, name, columns[name])
+        self.plans = plans
+        self.tasks = tasks
+
+    def owner(self, uuid):
+        """
+        Return (dynflow plan, action id, foreman task UUID, label) of the
+        pulp task with given UUID, or None if the task is not in the index.
+        Foreman task UUID and label are None if the foreman task is unknown.
+        """
+        halves = _uuid_halves(uuid)
+        if halves is None:
+            return None
+        high, low = halves
+        i = bisect_left(self.uuid_high, high)
+        while i < self.rows and self.uuid_high[i] == high:
+            if self.uuid_low[i] == low:
+                plan = self.plan[i]
+                foreman_uuid, label = self.tasks[plan] or (None, None)
+                return (self.plans[plan], str(self.action[i]), foreman_uuid,
+                        label)
+            i += 1
+        return None
+
+
+def index_fname(actions_fname):
+    return f"{actions_fname}.pulp_index"
+
+
+def _build(actions_fname, tasks_fname):
+    # pulp task UUID halves: (plan id, action id) of the first action
+    # referencing the task
+    owners = {}
+    plan_ids = {}
+    skipped = 0
+    for dynflow_uuid, action_id, uuid in iter_pulp_task_uuids(actions_fname):
+        halves = _uuid_halves(uuid)
+        if halves is None or not action_id.isdigit():
+            skipped += 1
+            continue
+        if halves in owners:
+            continue
+        plan_id = plan_ids.setdefault(dynflow_uuid, len(plan_ids))
+        owners[halves] = (plan_id, int(action_id))
+    counters['pulp task index: skipped bad UUID or action id'] += skipped
+    tasks = [None] * len(plan_ids)
+    read = 0
+    with open(tasks_fname, 'r') as _file:
+        for line in _file:
+            read += 1
+            cols = line.split(',')
+            # ignore incomplete lines
+            if len(cols) < 14:
+                continue
+            plan_id = plan_ids.get(cols[7])
+            if plan_id is not None:
+                tasks[plan_id] = [cols[0], cols[2]]
+    counters['foreman_tasks_tasks: rows read'] += read
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    for (high, low), (plan_id, action_id) in sorted(owners.items()):
+        columns['uuid_high'].append(high)
+        columns['uuid_low'].append(low)
+        columns['plan'].append(plan_id)
+        columns['action'].append(action_id)
+    return PulpTaskIndex(columns, list(plan_ids.keys()), tasks)
+
+
+def open_pulp_task_index(actions_fname, tasks_fname):
+    """
+    Return PulpTaskIndex of the dynflow_actions and foreman_tasks_tasks
+    files: memory-mapped from its index file if it is valid for the current
+    sizes and mtimes of both files, otherwise build the index and (try to)
+    store it for next runs.
+    """
+    stat = os.stat(actions_fname)
+    tasks_stat = os.stat(tasks_fname)
+    loaded = load_columns(index_fname(actions_fname), MAGIC, stat, COLUMNS)
+    if loaded is not None:
+        header, columns = loaded
+        if header['tasks_size'] == tasks_stat.st_size and \
+                header['tasks_mtime'] == tasks_stat.st_mtime_ns:
+            return PulpTaskIndex(columns, header['plans'], header['tasks'])
+    print(f"Building index {index_fname(actions_fname)}..")
+    index = _build(actions_fname, tasks_fname)
+    try:
+        write_columns(index_fname(actions_fname), MAGIC, stat,
+                      {'plans': index.plans, 'tasks': index.tasks,
+                       'tasks_size': tasks_stat.st_size,
+                       'tasks_mtime': tasks_stat.st_mtime_ns},
+                      COLUMNS, index.columns)
+    except OSError as err:
+        print(f"Warning: could not store index "
+              f"{index_fname(actions_fname)}: {err}")
+    return index
@@ -0,0 +1,64 @@
+# Streaming estimation of quantiles (like p50/p95/p99) in a fixed memory.
+#
+# Values are counted in logarithmic buckets (the DDSketch approach): a value
+# x > 0 falls to bucket ceil(log(x, gamma)), so any quantile is estimated
+# within the given relative accuracy, regardless of the number of values.
+# Zero and negative values are counted in one extra bucket as zeros, which is
+# sufficient for durations.
+
+from math import ceil, log
+
+
+class QuantileSketch:
+    """
+    Streaming sketch of a distribution of non-negative values. Keeps at most
+    max_buckets buckets; if more are needed, the lowest ones are merged (so
+    only the lowest quantiles lose their accuracy) and values below the
+    merged bucket are counted to it from then on. The buckets are merged at
+    most once per bucket key ever seen, not per value added.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.gamma = (1+relative_accuracy) / (1-relative_accuracy)
+        self.log_gamma = log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        # the lowest bucket key, once the lowest buckets got merged
+        self.floor = None
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = ceil(log(value) / self.log_gamma)
+        if self.floor is not None and key < self.floor:
+            key = self.floor
+        if key in self.buckets:
+            self.buckets[key] += 1
+            return
+        self.buckets[key] = 1
+        if len(self.buckets) > self.max_buckets:
+            keys = sorted(self.buckets.keys())
+            self.buckets[keys[1]] += self.buckets.pop(keys[0])
+            self.floor = keys[1]
+
+    def quantile(self, q):
+        """
+        Return estimated q-quantile (0 <= q <= 1) of the added values, or
+        None if there is no value.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count-1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.buckets.keys()):
+            seen += self.buckets[key]
+            if seen > rank:
+                # the middle of the bucket (gamma^(key-1), gamma^key]
+                return 2 * self.gamma**key / (self.gamma+1)
+        return 2 * self.gamma**max(self.buckets.keys()) / (self.gamma+1)
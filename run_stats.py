@@ -0,0 +1,186 @@
+# Instrumentation of script runs for --stats and --profile: wall and CPU time
+# per phase of the run, counters of rows read and skipped (per input file and
+# reason), peak memory, and cProfile dump of the phases.
+#
+# Parsers count into the module level `counters` always, as it is cheap: rows
+# read are summed once per chunk and skipped rows are rare. Counters and
+# profiles of map_chunks worker processes are merged into the main process.
+# A script calls start() after parsing its arguments and then phase() before
+# each phase of the run; the statistics are reported at the exit, whatever
+# exit() it takes.
+
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# counters like 'dynflow_steps: rows read' or
+# 'dynflow_steps: skipped outside window'
+counters = Counter()
+
+# RunStats of the instrumented run, if any
+active = None
+
+
+def _cpu_time():
+    # including worker processes, once they are reaped
+    times = os.times()
+    return times.user + times.system + times.children_user + \
+        times.children_system
+
+
+class RunStats:
+    """
+    Statistics of a run split to consecutive phases, reported in `fmt` ('text'
+    or 'json', or None not to report them), with cProfile dump of the phases
+    written to `profile` file if set.
+    """
+
+    def __init__(self, fmt=None, profile=None):
+        self.fmt = fmt
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile else None
+        # profile dumps of worker processes to merge
+        self.worker_profiles = []
+        # number of worker processes merged
+        self.workers = 0
+        # wall and CPU time per phase name, in order of the phases
+        self.phases = {}
+        self.current = None
+        self.start_wall = time.perf_counter()
+        self.start_cpu = _cpu_time()
+
+    def phase(self, name):
+        """
+        End the current phase (if any) and start a new one. Time of repeated
+        phases of the same name is summed.
+        """
+        wall = time.perf_counter()
+        cpu = _cpu_time()
+        if self.current is not None:
+            current, wall_start, cpu_start = self.current
+            total_wall, total_cpu = self.phases.get(current, (0.0, 0.0))
+            self.phases[current] = (total_wall + wall - wall_start,
+                                    total_cpu + cpu - cpu_start)
+        elif self.profiler is not None:
+            self.profiler.enable()
+        self.current = (name, wall, cpu) if name is not None else None
+
+    def finish(self):
+        self.phase(None)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self._dump_profile()
+        if self.fmt is not None:
+            self.report(self.fmt)
+
+    def _dump_profile(self):
+        self.profiler.create_stats()
+        stats = pstats.Stats(self.profiler) if self.profiler.stats \
+            else None
+        for fname in self.worker_profiles:
+            if stats is None:
+                stats = pstats.Stats(fname)
+            else:
+                stats.add(fname)
+            os.unlink(fname)
+        if stats is not None:
+            stats.dump_stats(self.profile)
+
+    def summary(self):
+        """
+        Return dict with the statistics.
+        """
+        # in kB on Linux; children only if any worker process ran, other
+        # children (like of imported libraries) are not of interest
+        rss = {'main': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if self.workers > 0:
+            rss['workers'] = \
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return {'phases': [{'name': name, 'wall': wall, 'cpu': cpu}
+                           for name, (wall, cpu) in self.phases.items()],
+                'total': {'wall': time.perf_counter() - self.start_wall,
+                          'cpu': _cpu_time() - self.start_cpu},
+                'counters': dict(sorted(counters.items())),
+                'peak_rss_kb': rss}
+
+    def report(self, fmt, _file=sys.stderr):
+        summary = self.summary()
+        if fmt == 'json':
+            _file.write(json.dumps(summary, indent=2) + "\n")
+            return
+        s = "Run statistics"
+        print(s, file=_file)
+        print("-"*len(s), file=_file)
+        print(f"{'phase':<28}{'wall':>10}{'cpu':>10}", file=_file)
+        for phase in summary['phases'] + [dict(summary['total'],
+                                               name='total')]:
+            print(f"{phase['name']:<28}{phase['wall']:>9.2f}s"
+                  f"{phase['cpu']:>9.2f}s", file=_file)
+        print(file=_file)
+        if len(summary['counters']) > 0:
+            for name, value in summary['counters'].items():
+                print(f"{name:<50}{value:>14,}", file=_file)
+            print(file=_file)
+        rss = summary['peak_rss_kb']
+        if 'workers' in rss:
+            print(f"peak memory: {rss['main']/1024:.1f} MB main process, "
+                  f"{rss['workers']/1024:.1f} MB worker processes",
+                  file=_file)
+        else:
+            print(f"peak memory: {rss['main']/1024:.1f} MB main process",
+                  file=_file)
+
+
+def start(fmt=None, profile=None):
+    """
+    Start instrumenting the run if statistics (in fmt 'text' or 'json') or
+    profile dump is requested, and report them at the exit.
+    """
+    global active
+    if fmt is None and profile is None:
+        return
+    active = RunStats(fmt, profile)
+    atexit.register(active.finish)
+
+
+def phase(name):
+    """
+    Start a new phase of the instrumented run, see RunStats.phase.
+    """
+    if active is not None:
+        active.phase(name)
+
+
+def run_in_worker(func, *args):
+    """
+    Call func(*args) in a worker process. Return (result, counters of the
+    call, profile dump file or None) to be merged by merge_worker.
+    """
+    counters.clear()
+    if active is None or active.profiler is None:
+        return func(*args), dict(counters), None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    result = func(*args)
+    profiler.disable()
+    fd, fname = tempfile.mkstemp(prefix=os.path.basename(active.profile) +
+                                 '.', dir=os.path.dirname(active.profile) or
+                                 '.')
+    os.close(fd)
+    profiler.dump_stats(fname)
+    return result, dict(counters), fname
+
+
+def merge_worker(worker_counters, profile_fname):
+    counters.update(worker_counters)
+    if active is not None:
+        active.workers += 1
+    if profile_fname is not None:
+        active.worker_profiles.append(profile_fname)
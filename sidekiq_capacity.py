@@ -0,0 +1,136 @@
+# What-if simulation of sidekiq capacity: replay of the execution time demand
+# recorded in dynflow_steps through a pool of N sidekiq workers, to see the
+# queueing delay the steps would have seen with that many workers.
+#
+# Each step is a job arriving at its recorded start and occupying one worker
+# for its execution time. Workers take the jobs in the order of arrival
+# (FIFO), so the simulation keeps just a heap of the times the workers get
+# free: a job starts when it arrives or when the earliest free worker gets
+# free, whichever is later. That is O(n log N) for n steps.
+
+from array import array
+import heapq
+from run_stats import counters
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def percentile(values_sorted, q):
+    """
+    Return q-quantile (0 <= q <= 1) of sorted values, linearly interpolated
+    between the closest ranks (like numpy.percentile does).
+    """
+    rank = q * (len(values_sorted)-1)
+    low = int(rank)
+    if low+1 >= len(values_sorted):
+        return values_sorted[-1]
+    return values_sorted[low] + (values_sorted[low+1]-values_sorted[low]) * \
+        (rank-low)
+
+
+def simulate_workers(starts, exectimes, workers):
+    """
+    Replay steps with given start and execution times through `workers`
+    sidekiq workers. Return (waits, busy_until) where waits is an array of
+    queueing delay of each step (in the order of the input) and busy_until is
+    the time the last worker gets free.
+    """
+    if np is not None:
+        order = np.argsort(starts, kind='stable').tolist()
+        starts = np.asarray(starts, dtype=float).tolist()
+        exectimes = np.asarray(exectimes, dtype=float).tolist()
+    else:
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+    waits = array('d', bytes(8*len(starts)))
+    free = [float('-inf')] * workers
+    heapreplace = heapq.heapreplace
+    for i in order:
+        arrival = starts[i]
+        free_at = free[0]
+        if free_at > arrival:
+            waits[i] = free_at-arrival
+            heapreplace(free, free_at+exectimes[i])
+        else:
+            heapreplace(free, arrival+exectimes[i])
+    counters['capacity: steps simulated'] += len(order)
+    return waits, max(free)
+
+
+class CapacityResult:
+    """
+    Result of simulation of steps with given start and execution times and
+    label ids (into `labels` list) through `workers` workers: queueing delay
+    of each step and its summary, overall and per step label.
+    """
+
+    def __init__(self, workers, starts, exectimes, step_labels, labels):
+        self.workers = workers
+        self.waits, busy_until = simulate_workers(starts, exectimes, workers)
+        self.steps = len(self.waits)
+        if self.steps == 0:
+            self.span = 0.0
+            self.exectime = 0.0
+        else:
+            self.span = busy_until - min(starts)
+            self.exectime = float(sum(exectimes))
+        self.summary = self._summarize(self.waits, self.exectime)
+        self.label_summaries = self._label_summaries(exectimes, step_labels,
+                                                     labels)
+
+    def utilization(self, exectime):
+        """
+        Return the share of the workers' capacity over the simulated span
+        used by the given execution time.
+        """
+        if self.span <= 0:
+            return 0.0
+        return exectime / (self.workers * self.span)
+
+    def _summarize(self, waits, exectime):
+        """
+        Return dict with count, execution time, utilization and queueing
+        delays of steps with given waits, or None if there is no step.
+        """
+        waits_sorted = sorted(waits)
+        count = len(waits_sorted)
+        if count == 0:
+            return None
+        return {'steps': count,
+                'exectime': exectime,
+                'utilization': self.utilization(exectime),
+                'delayed': sum(1 for wait in waits_sorted if wait > 0),
+                'total_wait': sum(waits_sorted),
+                'mean_wait': sum(waits_sorted) / count,
+                'p95_wait': percentile(waits_sorted, 0.95),
+                'max_wait': waits_sorted[-1]}
+
+    def _label_summaries(self, exectimes, step_labels, labels):
+        """
+        Return dict of summaries per label name (see _summarize).
+        """
+        waits_of = {}
+        exectime_of = {}
+        if np is not None:
+            step_labels = np.asarray(step_labels)
+            waits = np.frombuffer(self.waits, dtype=float)
+            order = np.argsort(step_labels, kind='stable')
+            label_ids, firsts = np.unique(step_labels[order],
+                                          return_index=True)
+            sums = np.bincount(step_labels, weights=exectimes,
+                               minlength=len(labels))
+            for label_id, rows in zip(label_ids.tolist(),
+                                      np.split(order, firsts[1:])):
+                waits_of[label_id] = waits[rows].tolist()
+                exectime_of[label_id] = float(sums[label_id])
+        else:
+            for wait, exectime, label_id in zip(self.waits, exectimes,
+                                                step_labels):
+                waits_of.setdefault(label_id, []).append(wait)
+                exectime_of[label_id] = exectime_of.get(label_id, 0.0) + \
+                    exectime
+        return {labels[label_id]: self._summarize(waits,
+                                                  exectime_of[label_id])
+                for label_id, waits in waits_of.items()}
+
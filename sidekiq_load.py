@@ -0,0 +1,670 @@
+# Computation of sidekiq load over time from dynflow_steps: parsing of steps
+# within a time window, intervals of distinct load, their resampling to
+# fixed-width time buckets, and lookups of the load at given times and
+# within given time windows.
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import *
+from dateutil.tz import tzutc
+from dynflow_records import StepColumns, parse_step
+from file_chunks import map_chunks, read_chunk_lines
+from itertools import accumulate
+from run_stats import counters
+from steps_cache import open_steps_cache
+from steps_index import LONG_STEP, open_steps_index
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+utctz = tzutc()
+now = datetime.now().replace(tzinfo=utctz).timestamp()
+
+
+def parse_steps_chunk(fname, chunk_start, chunk_end, from_ts, to_ts):
+    """
+    Parse dynflow_steps lines within the given chunk of the file, see
+    parse_steps_lines.
+    """
+    return parse_steps_lines(read_chunk_lines(fname, chunk_start, chunk_end),
+                             from_ts, to_ts)
+
+
+def parse_steps_lines(lines, from_ts, to_ts):
+    """
+    Parse dynflow_steps lines. Return StepColumns of steps running (at least
+    partially) within from_ts and to_ts.
+    """
+    steps = StepColumns()
+    read = outside = 0
+    for line in lines:
+        read += 1
+        step = parse_step(line.split(','))
+        if step is None:
+            continue
+        finish = step.finish if step.finish == step.finish else now
+        # skip tasks completely outside specified interval
+        if step.start > to_ts or finish < from_ts:
+            outside += 1
+            continue
+        steps.append(step)
+    counters['dynflow_steps: rows read'] += read
+    counters['dynflow_steps: skipped outside window'] += outside
+    return steps
+
+
+def load_steps(fname, from_ts, to_ts, jobs=1, cache=False, index=False):
+    """
+    Return StepColumns of dynflow_steps file with (at least) the steps
+    running within from_ts and to_ts: from the steps cache, via the steps
+    index, or by parsing the file in `jobs` parallel chunks.
+    """
+    if cache:
+        return open_steps_cache(fname, jobs)
+    if index:
+        steps_index = open_steps_index(fname, jobs)
+        return parse_steps_lines(steps_index.lines(fname, from_ts, to_ts),
+                                 from_ts, to_ts)
+    steps = StepColumns()
+    for chunk_steps in map_chunks(parse_steps_chunk, fname, jobs, from_ts,
+                                  to_ts):
+        steps.extend(chunk_steps)
+    return steps
+
+
+def steps_within(steps, from_ts, to_ts):
+    """
+    Return arrays of start, finish, execution time and label id of
+    StepColumns steps within from_ts and to_ts (truncated to them) and a dict
+    of count and execution time per label, in order of the labels' first
+    occurrence.
+    """
+    if np is not None:
+        starts = np.array(steps.start)
+        finishes = np.array(steps.finish)
+        finishes[np.isnan(finishes)] = now
+        # skip tasks completely outside specified interval
+        inside = (starts <= to_ts) & (finishes >= from_ts)
+        starts = starts[inside]
+        finishes = finishes[inside]
+        exectimes = np.asarray(steps.exectime)[inside]
+        step_labels = np.asarray(steps.label)[inside]
+        # truncate steps starting before --from and adjust exectime
+        # accordingly
+        before = starts < from_ts
+        exectimes[before] *= (finishes[before]-from_ts) / \
+            (finishes[before]-starts[before])
+        starts[before] = from_ts
+        # truncate steps ending after --to and adjust exectime accordingly
+        after = finishes > to_ts
+        exectimes[after] *= (to_ts-starts[after]) / \
+            (finishes[after]-starts[after])
+        finishes[after] = to_ts
+        counts = np.bincount(step_labels, minlength=len(steps.labels))
+        sums = np.bincount(step_labels, weights=exectimes,
+                           minlength=len(steps.labels))
+        # keep labels in order of their first occurrence
+        present, first_seen = np.unique(step_labels, return_index=True)
+        labels = dict()
+        for i in present[np.argsort(first_seen)].tolist():
+            labels[steps.labels[i]] = {'count': int(counts[i]),
+                                       'exectime': float(sums[i])}
+        return starts, finishes, exectimes, step_labels, labels
+
+    starts = array('d')
+    finishes = array('d')
+    exectimes = array('d')
+    step_labels = array('I')
+    labels = dict()
+    for start, finish, exectime, label in zip(steps.start, steps.finish,
+                                              steps.exectime, steps.label):
+        if finish != finish:  # NaN, i.e. not finished
+            finish = now
+        # skip tasks completely outside specified interval
+        if start > to_ts or finish < from_ts:
+            continue
+        # truncate steps starting before --from and adjust exectime
+        # accordingly
+        if start < from_ts:
+            exectime *= (finish-from_ts) / (finish-start)
+            start = from_ts
+        # truncate steps ending after --to and adjust exectime accordingly
+        if finish > to_ts:
+            exectime *= (to_ts-start) / (finish-start)
+            finish = to_ts
+        starts.append(start)
+        finishes.append(finish)
+        exectimes.append(exectime)
+        step_labels.append(label)
+        label = steps.labels[label]
+        if label not in labels.keys():
+            labels[label] = {'count': 0, 'exectime': 0.0}
+        labels[label]['count'] += 1
+        labels[label]['exectime'] += exectime
+    return starts, finishes, exectimes, step_labels, labels
+
+
+def compute_heat_intervals(starts, finishes, exectimes, till_finish=False):
+    """
+    For steps with given start, finish and execution times, return lists of
+    (start, end, concurrent steps, average exec load) of intervals between
+    all distinct start/finish timestamps.
+
+    Each step adds +1 step and +load to the first interval it covers and the
+    same negative values to the first interval it does not cover anymore, so
+    cumulative sums of these deltas over the sorted timestamps give the
+    concurrency and load of each interval. By default, a step covers
+    intervals from its start up to the one ending by the step's finish,
+    excluding that last one, like the original heat stats did. With
+    till_finish, the last one is included, so the load summed over the
+    intervals equals the total exectime. E.g. steps [0, 10] with exectime 5
+    and [4, 6] with exectime 2 give intervals starting at 0, 4, 6 and 10 with
+    1, 1, 0 and 0 steps and load 0.5, 0.5, 0 and 0 by default, and with 1, 2,
+    1 and 0 steps and load 0.5, 1.5, 0.5 and 0 with till_finish.
+    """
+    # index of the first interval a step does not cover anymore is the one
+    # starting by its finish, or one less by default
+    shift = 0 if till_finish else 1
+    if np is not None:
+        starts = np.asarray(starts, dtype=float)
+        finishes = np.asarray(finishes, dtype=float)
+        exectimes = np.asarray(exectimes, dtype=float)
+        timestamps_sorted = np.unique(np.concatenate((starts, finishes)))
+        first = np.searchsorted(timestamps_sorted, starts)
+        last = np.searchsorted(timestamps_sorted, finishes) - shift
+        covering = last > first
+        first = first[covering]
+        last = last[covering]
+        loads = exectimes[covering] / (finishes[covering]-starts[covering])
+        count = len(timestamps_sorted)
+        steps = np.cumsum(np.bincount(first, minlength=count) -
+                          np.bincount(last, minlength=count))
+        loads = np.cumsum(np.bincount(first, weights=loads, minlength=count) -
+                          np.bincount(last, weights=loads, minlength=count))
+        # no step running means no load, regardless of rounding errors
+        loads[steps == 0] = 0.0
+        ends = np.append(timestamps_sorted[1:], now)
+        return (timestamps_sorted.tolist(), ends.tolist(), steps.tolist(),
+                loads.tolist())
+
+    timestamps_sorted = sorted(set(starts) | set(finishes))
+    count = len(timestamps_sorted)
+    steps = [0]*count
+    loads = [0.0]*count
+    for start, finish, exectime in zip(starts, finishes, exectimes):
+        first = bisect_left(timestamps_sorted, start)
+        last = bisect_left(timestamps_sorted, finish, first) - shift
+        if last <= first:
+            continue
+        load = exectime / (finish-start)
+        steps[first] += 1
+        steps[last] -= 1
+        loads[first] += load
+        loads[last] -= load
+    steps = list(accumulate(steps))
+    # no step running means no load, regardless of rounding errors
+    loads = [load if step > 0 else 0.0
+             for load, step in zip(accumulate(loads), steps)]
+    ends = timestamps_sorted[1:] + [now]
+    return timestamps_sorted, ends, steps, loads
+
+
+def compute_label_loads(starts, finishes, exectimes, step_labels,
+                        label_columns, bucket):
+    """
+    For steps with given start, finish and execution times and label id,
+    return start of fixed-width time buckets (aligned to multiples of bucket
+    seconds) and a matrix of average exec load per bucket (rows) and column,
+    where label_columns maps label ids to the columns.
+
+    A step spread over more buckets adds its load rate times the overlap to
+    its first and last bucket, and the full load rate to the buckets between
+    them - via +rate/-rate deltas summed cumulatively over the buckets. So
+    the memory is O(buckets * columns) regardless of the number of labels.
+    """
+    if np is not None:
+        starts = np.asarray(starts, dtype=float)
+        finishes = np.asarray(finishes, dtype=float)
+        exectimes = np.asarray(exectimes, dtype=float)
+        columns = max(label_columns)+1
+        step_columns = np.asarray(label_columns,
+                                  dtype=np.int64)[np.asarray(step_labels)]
+        origin = np.floor(starts.min()/bucket) * bucket
+        count = max(1, int(np.ceil((finishes.max()-origin)/bucket)))
+        first = ((starts-origin)//bucket).astype(np.int64)
+        last = np.minimum((finishes-origin)//bucket, count-1).astype(np.int64)
+        size = count*columns
+        # steps within a single bucket add just their execution time
+        single = first == last
+        loads = np.bincount(first[single]*columns + step_columns[single],
+                            weights=exectimes[single], minlength=size)
+        spread = ~single
+        first = first[spread]
+        last = last[spread]
+        spread_columns = step_columns[spread]
+        rates = exectimes[spread] / (finishes[spread]-starts[spread])
+        loads += np.bincount(first*columns + spread_columns,
+                             weights=rates*(origin+(first+1)*bucket -
+                                            starts[spread]),
+                             minlength=size)
+        loads += np.bincount(last*columns + spread_columns,
+                             weights=rates*(finishes[spread] -
+                                            (origin+last*bucket)),
+                             minlength=size)
+        deltas = np.bincount((first+1)*columns + spread_columns,
+                             weights=rates*bucket, minlength=size) - \
+            np.bincount(last*columns + spread_columns, weights=rates*bucket,
+                        minlength=size)
+        loads = loads.reshape(count, columns) + \
+            np.cumsum(deltas.reshape(count, columns), axis=0)
+        bucket_starts = origin + np.arange(count)*bucket
+        return bucket_starts.tolist(), (loads/bucket).tolist()
+
+    columns = max(label_columns)+1
+    step_columns = [label_columns[label] for label in step_labels]
+    origin = (min(starts)//bucket) * bucket
+    count = max(1, int(-((origin-max(finishes))//bucket)))
+    loads = [[0.0]*columns for i in range(count)]
+    deltas = [[0.0]*columns for i in range(count+1)]
+    for start, finish, exectime, column in zip(starts, finishes, exectimes,
+                                               step_columns):
+        first = int((start-origin)//bucket)
+        last = min(int((finish-origin)//bucket), count-1)
+        if first == last:
+            loads[first][column] += exectime
+            continue
+        rate = exectime / (finish-start)
+        loads[first][column] += rate*(origin+(first+1)*bucket-start)
+        loads[last][column] += rate*(finish-(origin+last*bucket))
+        deltas[first+1][column] += rate*bucket
+        deltas[last][column] -= rate*bucket
+    running = [0.0]*columns
+    for i in range(count):
+        running = [r+d for r, d in zip(running, deltas[i])]
+        loads[i] = [(load+r)/bucket for load, r in zip(loads[i], running)]
+    bucket_starts = [origin+i*bucket for i in range(count)]
+    return bucket_starts, loads
+
+
+def resample_heat_intervals(heat_starts, heat_ends, heat_steps, heat_loads,
+                            resolution):
+    """
+    Resample heat intervals (up to the last interval start) to fixed-width
+    time buckets aligned to multiples of resolution seconds. Return lists of
+    bucket starts, time-weighted average and maximum of concurrent steps and
+    of exec load per bucket.
+
+    Averages are differences of the cumulative integral of the (piecewise
+    constant) values at bucket edges. Maximum of a bucket is the maximum of
+    the interval running at the bucket start and of intervals starting
+    within the bucket.
+    """
+    if np is not None:
+        heat_starts = np.asarray(heat_starts, dtype=float)
+        heat_ends = np.asarray(heat_ends, dtype=float)
+        heat_steps = np.asarray(heat_steps, dtype=float)
+        heat_loads = np.asarray(heat_loads, dtype=float)
+        origin = np.floor(heat_starts[0]/resolution) * resolution
+        count = max(1, int(np.ceil((heat_starts[-1]-origin)/resolution)))
+        edges = origin + np.arange(count+1)*resolution
+        # intervals are contiguous, so the integral is piecewise linear in
+        # their starts
+        durations = np.append(heat_ends[:-1]-heat_starts[:-1], 0.0)
+        result = [edges[:-1].tolist()]
+        running = np.searchsorted(heat_starts, edges[:-1], side='right') - 1
+        first = np.searchsorted(edges, heat_starts, side='right') - 1
+        for values in (heat_steps, heat_loads):
+            integral = np.concatenate(([0.0], np.cumsum(values*durations)))
+            integral = np.interp(edges, np.append(heat_starts,
+                                                  heat_starts[-1]+1),
+                                 integral)
+            result.append((np.diff(integral)/resolution).tolist())
+            maxima = np.where(running >= 0, values[np.maximum(running, 0)],
+                              0.0)
+            np.maximum.at(maxima, np.minimum(first, count-1), values)
+            result.append(maxima.tolist())
+        bucket_starts, avg_steps, max_steps, avg_loads, max_loads = result
+        return bucket_starts, avg_steps, max_steps, avg_loads, max_loads
+
+    origin = (heat_starts[0]//resolution) * resolution
+    count = max(1, int(-((origin-heat_starts[-1])//resolution)))
+    bucket_starts = [origin+i*resolution for i in range(count)]
+    avg_steps = [0.0]*count
+    max_steps = [0]*count
+    avg_loads = [0.0]*count
+    max_loads = [0.0]*count
+    for i in range(len(heat_starts)):
+        start = heat_starts[i]
+        # the last interval ends at the last timestamp
+        end = heat_ends[i] if i < len(heat_starts)-1 else start
+        bucket = min(int((start-origin)//resolution), count-1)
+        max_steps[bucket] = max(max_steps[bucket], heat_steps[i])
+        max_loads[bucket] = max(max_loads[bucket], heat_loads[i])
+        while True:
+            bucket_end = origin + (bucket+1)*resolution
+            overlap = min(end, bucket_end) - max(start, bucket_starts[bucket])
+            avg_steps[bucket] += heat_steps[i]*overlap/resolution
+            avg_loads[bucket] += heat_loads[i]*overlap/resolution
+            if end <= bucket_end or bucket == count-1:
+                break
+            # the interval runs at the next bucket start
+            bucket += 1
+            max_steps[bucket] = max(max_steps[bucket], heat_steps[i])
+            max_loads[bucket] = max(max_loads[bucket], heat_loads[i])
+    return bucket_starts, avg_steps, max_steps, avg_loads, max_loads
+
+
+def downsample_peaks(xs, ys, columns):
+    """
+    Downsample (xs, ys) points to at most two points per each of `columns`
+    equally wide x ranges (pixel columns of a graph): the minimum and the
+    maximum, in their original order. So peaks stay visible in the graph.
+    """
+    if len(xs) <= 2*columns:
+        return xs, ys
+    if np is not None:
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        width = (xs[-1]-xs[0]) / columns or 1.0
+        column = np.minimum(((xs-xs[0])//width).astype(np.int64), columns-1)
+        # sort points by column and then by y; the minimum and maximum of a
+        # column are then the first and the last point of its run
+        order = np.lexsort((ys, column))
+        bounds = np.flatnonzero(np.diff(column[order])) + 1
+        keep = np.unique(np.concatenate((
+            order[np.concatenate(([0], bounds))],
+            order[np.concatenate((bounds-1, [len(order)-1]))])))
+        return xs[keep].tolist(), ys[keep].tolist()
+
+    width = (xs[-1]-xs[0]) / columns or 1.0
+    keep = {}
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        column = min(int((x-xs[0])//width), columns-1)
+        if column not in keep:
+            keep[column] = [i, i]
+        elif y < ys[keep[column][0]]:
+            keep[column][0] = i
+        elif y > ys[keep[column][1]]:
+            keep[column][1] = i
+    keep = sorted(set(i for pair in keep.values() for i in pair))
+    return [xs[i] for i in keep], [ys[i] for i in keep]
+
+
+class LoadTimeline:
+    """
+    Sidekiq load over time with lookups by binary search: concurrent steps
+    and exec load at given time from heat intervals (counting steps till
+    their finish, see compute_heat_intervals), and labels of steps running at
+    that time from steps sorted per start time.
+
+    Like in StepsIndex, regular steps are sorted per start time with maximum
+    finish of all steps started so far, so the steps running at some time are
+    found by two binary searches and a short scan. Long steps (running over
+    LONG_STEP seconds) are few, so they are scanned completely.
+    """
+
+    def __init__(self, steps, from_ts=0, to_ts=now):
+        starts, finishes, exectimes, step_labels, labels = \
+            steps_within(steps, from_ts, to_ts)
+        self.labels = steps.labels
+        self.heat_starts, heat_ends, self.heat_steps, self.heat_loads = \
+            compute_heat_intervals(starts, finishes, exectimes,
+                                   till_finish=True) \
+            if len(starts) > 0 else ([], [], [], [])
+        regular = sorted((i for i in range(len(starts))
+                          if finishes[i]-starts[i] <= LONG_STEP),
+                         key=starts.__getitem__)
+        regular_set = set(regular)
+        long = [i for i in range(len(starts)) if i not in regular_set]
+        self.regular_rows = len(regular)
+        self.start = array('d')
+        self.finish = array('d')
+        self.rate = array('d')
+        self.label = array('I')
+        self.max_finish = array('d')
+        max_finish = float('-inf')
+        for i in regular + long:
+            start = float(starts[i])
+            finish = float(finishes[i])
+            self.start.append(start)
+            self.finish.append(finish)
+            self.rate.append(float(exectimes[i]) / (finish-start)
+                             if finish > start else 0.0)
+            self.label.append(int(step_labels[i]))
+            if i in regular_set:
+                max_finish = max(max_finish, finish)
+                self.max_finish.append(max_finish)
+        # top labels per heat interval, computed on demand
+        self._top_labels = {}
+
+    def load_at(self, ts):
+        """
+        Return (concurrent steps, exec load) at given time.
+        """
+        i = bisect_right(self.heat_starts, ts) - 1
+        if i < 0:
+            return 0, 0.0
+        return self.heat_steps[i], self.heat_loads[i]
+
+    def running_at(self, ts):
+        """
+        Yield row numbers of steps running at given time.
+        """
+        first = bisect_right(self.max_finish, ts)
+        last = bisect_right(self.start, ts, 0, self.regular_rows)
+        for row in range(first, last):
+            if self.finish[row] > ts:
+                yield row
+        for row in range(self.regular_rows, len(self.start)):
+            if self.start[row] <= ts < self.finish[row]:
+                yield row
+
+    def top_labels_at(self, ts, limit):
+        """
+        Return list of up to `limit` (label, steps, exec load) of labels of
+        steps running at given time, ordered by their exec load. All times
+        within one heat interval share the same result.
+        """
+        i = bisect_right(self.heat_starts, ts) - 1
+        if (i, limit) not in self._top_labels:
+            labels = {}
+            for row in self.running_at(self.heat_starts[i] if i >= 0
+                                       else ts):
+                count, load = labels.get(self.label[row], (0, 0.0))
+                labels[self.label[row]] = (count+1, load+self.rate[row])
+            self._top_labels[(i, limit)] = [
+                (self.labels[label], count, load) for label, (count, load) in
+                sorted(labels.items(), key=lambda x: x[1][1],
+                       reverse=True)[0:limit]]
+        return self._top_labels[(i, limit)]
+
+
+class _RangeMax:
+    """
+    Segment tree over values: index of the first maximum of values[lo:hi] in
+    O(log n) steps.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        # node i has children 2*i and 2*i+1, leaves from `size` on; padding
+        # leaves are never fully within a queried range
+        tree = array('q', [0]) * self.size + \
+            array('q', range(len(values))) + \
+            array('q', [max(len(values)-1, 0)]) * (self.size-len(values))
+        for i in range(self.size-1, 0, -1):
+            left = tree[2*i]
+            right = tree[2*i+1]
+            tree[i] = left if values[left] >= values[right] else right
+        self.tree = tree
+
+    def argmax(self, lo, hi):
+        """
+        Return index of the first maximum of values[lo:hi], hi > lo.
+        """
+        values = self.values
+        tree = self.tree
+        # best of the nodes from the left and from the right
+        left = right = -1
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                i = tree[lo]
+                if left < 0 or values[i] > values[left]:
+                    left = i
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                i = tree[hi]
+                if right < 0 or values[i] >= values[right]:
+                    right = i
+            lo //= 2
+            hi //= 2
+        if right < 0 or left >= 0 and values[left] >= values[right]:
+            return left
+        return right
+
+
+class _StepsWindows:
+    """
+    Count and execution time of a group of steps within time windows, with
+    steps truncated to the window like in steps_within. Counts come from
+    sorted starts and finishes, execution time from the integral of exec load
+    over heat intervals, plus prefix sums of exectimes of zero-length steps
+    (they have no load).
+    """
+
+    def __init__(self, starts, finishes, exectimes):
+        self.starts = sorted(starts)
+        self.finishes = sorted(finishes)
+        self.heat_starts, heat_ends, self.heat_steps, self.heat_loads = \
+            compute_heat_intervals(starts, finishes, exectimes,
+                                   till_finish=True) \
+            if len(starts) > 0 else ([], [], [], [])
+        # integral of exec load till the start of each heat interval
+        self.heat_integral = [0.0] + list(accumulate(
+            load*(end-start) for start, end, load in
+            zip(self.heat_starts[:-1], heat_ends[:-1], self.heat_loads)))
+        zero_length = sorted((start, exectime) for start, finish, exectime in
+                             zip(starts, finishes, exectimes)
+                             if finish <= start)
+        self.zero_starts = [start for start, exectime in zero_length]
+        self.zero_exectimes = [0.0] + list(accumulate(
+            exectime for start, exectime in zero_length))
+
+    def count(self, from_ts, to_ts):
+        """
+        Return number of steps running at least partially within the window.
+        """
+        return bisect_right(self.starts, to_ts) - \
+            bisect_left(self.finishes, from_ts)
+
+    def _integral(self, ts):
+        i = bisect_right(self.heat_starts, ts) - 1
+        if i < 0:
+            return 0.0
+        return self.heat_integral[i] + \
+            self.heat_loads[i] * (ts-self.heat_starts[i])
+
+    def exectime(self, from_ts, to_ts):
+        """
+        Return execution time of steps within the window.
+        """
+        return self._integral(to_ts) - self._integral(from_ts) + \
+            self.zero_exectimes[bisect_right(self.zero_starts, to_ts)] - \
+            self.zero_exectimes[bisect_left(self.zero_starts, from_ts)]
+
+
+class LoadWindows:
+    """
+    Steps, execution time, peak load and per label summary of StepColumns
+    steps within arbitrary time windows, with the same results like
+    steps_within and compute_heat_intervals (with till_finish) over the window,
+    but indexed once so each window is answered by binary searches.
+
+    Heat intervals of all the steps (counted till their finish, so their
+    load integrates to the exectimes) carry the concurrency and load of any
+    window, just cut at its ends; their maxima within a window come from
+    segment trees. Steps sorted per start with maximum finish of all steps
+    started so far (like in LoadTimeline) give the first truncated start
+    within a window.
+    """
+
+    def __init__(self, steps):
+        starts, finishes, exectimes, step_labels, labels = \
+            steps_within(steps, 0, float('inf'))
+        starts, finishes, exectimes = ([float(value) for value in column]
+                                       for column in (starts, finishes,
+                                                      exectimes))
+        step_labels = [int(label) for label in step_labels]
+        self.labels = steps.labels
+        self.all = _StepsWindows(starts, finishes, exectimes)
+        self.max_steps = _RangeMax(self.all.heat_steps)
+        self.max_loads = _RangeMax(self.all.heat_loads)
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        self.start = [starts[i] for i in order]
+        self.max_finish = list(accumulate((finishes[i] for i in order), max))
+        rows = {}
+        for row, label in enumerate(step_labels):
+            rows.setdefault(label, []).append(row)
+        # in order of the label ids
+        self.label_windows = {
+            label: _StepsWindows([starts[row] for row in label_rows],
+                                 [finishes[row] for row in label_rows],
+                                 [exectimes[row] for row in label_rows])
+            for label, label_rows in sorted(rows.items())}
+
+    def steps(self, from_ts, to_ts):
+        return self.all.count(from_ts, to_ts)
+
+    def exectime(self, from_ts, to_ts):
+        return self.all.exectime(from_ts, to_ts)
+
+    def _first_start(self, from_ts, to_ts):
+        """
+        Return the first start of steps within the window truncated to it, or
+        None if there is no step.
+        """
+        i = bisect_left(self.start, from_ts)
+        if i > 0 and self.max_finish[i-1] >= from_ts:
+            return from_ts
+        if i < len(self.start) and self.start[i] <= to_ts:
+            return self.start[i]
+        return None
+
+    def peak(self, from_ts, to_ts):
+        """
+        Return (maximum concurrent steps, maximum exec load, time of the
+        first maximum load) within the window, or None if there is no step.
+        """
+        first = self._first_start(from_ts, to_ts)
+        if first is None:
+            return None
+        # all steps truncated to zero length
+        if first >= to_ts:
+            return 0, 0.0, first
+        heat_starts = self.all.heat_starts
+        lo = bisect_right(heat_starts, first) - 1
+        hi = bisect_left(heat_starts, to_ts)
+        i = self.max_loads.argmax(lo, hi)
+        return (self.all.heat_steps[self.max_steps.argmax(lo, hi)],
+                self.all.heat_loads[i], max(heat_starts[i], first))
+
+    def label_summaries(self, from_ts, to_ts):
+        """
+        Return dict of count and execution time per label of steps within
+        the window, in order of the label ids.
+        """
+        labels = dict()
+        for label, windows in self.label_windows.items():
+            count = windows.count(from_ts, to_ts)
+            if count > 0:
+                labels[self.labels[label]] = {
+                    'count': count,
+                    'exectime': windows.exectime(from_ts, to_ts)}
+        return labels
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# How many sidekiq workers would have been enough? Replay the execution time
+# demand of dynflow_steps through pools of various numbers of workers.
+
+import argparse
+from datetime import *
+from dynflow_records import convert_cmdline_time_to_seconds
+from math import ceil
+import run_stats
+from sidekiq_capacity import CapacityResult
+from sidekiq_load import compute_heat_intervals, load_steps, now, \
+    steps_within
+
+
+parser = argparse.ArgumentParser(description="What-if simulation of sidekiq "
+                                             "capacity: queueing delays of "
+                                             "dynflow steps with a given "
+                                             "number of sidekiq workers")
+parser.add_argument("dynflow_steps",
+                    help="Input CSV file with dynflow_steps")
+parser.add_argument("--workers", "-w",
+                    type=int,
+                    action="append",
+                    help="Number of sidekiq workers (threads) to simulate. "
+                         "Can be used multiple times to compare them. "
+                         "Default is 8 values from the average to the peak "
+                         "execution load of the steps")
+parser.add_argument("--from", "--since",
+                    dest='from_ts',
+                    type=str,
+                    default="0",
+                    help="Consider steps from this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--to", "--till",
+                    type=str,
+                    default=str(now),
+                    help="Consider steps to this timestamp (seconds since "
+                         "Epoch or '%%Y-%%m-%%d[ %%H:%%M:%%S]' format)")
+parser.add_argument("--items-limit",
+                    type=int,
+                    default=5,
+                    help="Limit of dynflow step labels per p95 wait shown "
+                         "for each number of workers")
+parser.add_argument("--step-waits",
+                    action="store_true",
+                    help="Also write the queueing delay of each step with "
+                         "each number of workers to "
+                         "dynflow_steps.capacity_waits.csv")
+parser.add_argument("--jobs", "-j",
+                    type=int,
+                    default=1,
+                    help="Number of processes parsing the input file in "
+                         "parallel")
+cache_group = parser.add_mutually_exclusive_group()
+cache_group.add_argument("--cache",
+                         action="store_true",
+                         help="Use parsed data cached in dynflow_steps.cache "
+                              "next to the input file, create or refresh the "
+                              "cache if needed. Speeds up repeated runs over "
+                              "the same file")
+cache_group.add_argument("--index",
+                         action="store_true",
+                         help="Use index of steps per time stored in "
+                              "dynflow_steps.index next to the input file, "
+                              "create or refresh the index if needed. Then "
+                              "read just steps within --from and --to")
+parser.add_argument("--stats",
+                    nargs="?",
+                    const="text",
+                    choices=["text", "json"],
+                    help="At the end, print statistics of the run to "
+                         "stderr: wall and CPU time per phase, rows read and "
+                         "skipped per reason, and peak memory. As text "
+                         "(default) or JSON")
+parser.add_argument("--profile",
+                    type=str,
+                    help="Write cProfile dump of the run (including --jobs "
+                         "worker processes) to this file, see it e.g. by "
+                         "'python -m pstats FILE'")
+
+args = parser.parse_args()
+run_stats.start(args.stats, args.profile)
+from_ts = convert_cmdline_time_to_seconds(args.from_ts)
+to_ts = convert_cmdline_time_to_seconds(args.to)
+if args.workers is not None and min(args.workers) <= 0:
+    parser.error("--workers must be positive")
+
+print(f"Processing '{args.dynflow_steps}'..")
+run_stats.phase("parse dynflow_steps")
+steps = load_steps(args.dynflow_steps, from_ts, to_ts, args.jobs, args.cache,
+                   args.index)
+starts, finishes, exectimes, step_labels, labels = \
+    steps_within(steps, from_ts, to_ts)
+
+if len(starts) == 0:
+    print("No data in given time range. Try modifying --from and/or --to.")
+    exit()
+
+workers_sweep = args.workers
+if workers_sweep is None:
+    # below the average load, the queue grows without limits; at the peak
+    # load, (almost) no step waits
+    run_stats.phase("compute load")
+    heat_starts, heat_ends, heat_steps, heat_loads = \
+        compute_heat_intervals(starts, finishes, exectimes)
+    average = ceil(sum(exectimes) / (max(finishes)-min(starts))) \
+        if max(finishes) > min(starts) else 1
+    peak = max(ceil(max(heat_loads)), average, 1)
+    workers_sweep = sorted(set(max(average + (peak-average)*i//7, 1)
+                               for i in range(8)))
+    print(f"Average execution load {average}, peak {peak}.")
+print()
+
+run_stats.phase("simulate")
+results = []
+for workers in sorted(set(workers_sweep)):
+    results.append(CapacityResult(workers, starts, exectimes, step_labels,
+                                  steps.labels))
+
+s = "Simulated queueing delays of dynflow steps per sidekiq workers:"
+print(s)
+print("-"*len(s))
+print(f"{'workers':>8}{'utiliz.':>9}{'delayed':>9}{'mean wait':>12}"
+      f"{'p95 wait':>12}{'max wait':>12}")
+for result in results:
+    summary = result.summary
+    print(f"{result.workers:>8}{summary['utilization']:>9.1%}"
+          f"{summary['delayed']/summary['steps']:>9.1%}"
+          f"{summary['mean_wait']:>12,.2f}{summary['p95_wait']:>12,.2f}"
+          f"{summary['max_wait']:>12,.2f}")
+print()
+
+for result in results:
+    s = f"Top {args.items_limit} dynflow step labels per p95 wait with " \
+        f"{result.workers} workers:"
+    print(s)
+    print("-"*len(s))
+    print(f"{'steps':<8}{'exec.time':<12}{'utiliz.':>8}{'mean wait':>12}"
+          f"{'p95 wait':>12}  label")
+    for label, summary in sorted(result.label_summaries.items(),
+                                 key=lambda x: (x[1]['p95_wait'],
+                                                x[1]['mean_wait']),
+                                 reverse=True)[0:args.items_limit]:
+        print(f"{summary['steps']:<8}{summary['exectime']:<12,.2f}"
+              f"{summary['utilization']:>8.1%}{summary['mean_wait']:>12,.2f}"
+              f"{summary['p95_wait']:>12,.2f}  {label}")
+    print()
+
+run_stats.phase("write outputs")
+s = "Queueing delays per workers and label"
+print(s)
+print("-"*len(s))
+fname = f"{args.dynflow_steps}.capacity.csv"
+with open(fname, "w") as _file:
+    _file.write("workers;label;steps;exectime;utilization;delayed;"
+                "mean_wait;p95_wait;max_wait\n")
+    for result in results:
+        for label, summary in [('TOTAL', result.summary)] + \
+                sorted(result.label_summaries.items()):
+            _file.write(f"{result.workers};"
+                        f"{label};"
+                        f"{summary['steps']};"
+                        f"{summary['exectime']};"
+                        f"{summary['utilization']};"
+                        f"{summary['delayed']};"
+                        f"{summary['mean_wait']};"
+                        f"{summary['p95_wait']};"
+                        f"{summary['max_wait']}\n")
+print(f".. in {fname}")
+
+if args.step_waits:
+    print()
+    s = "Queueing delays per step"
+    print(s)
+    print("-"*len(s))
+    fname = f"{args.dynflow_steps}.capacity_waits.csv"
+    with open(fname, "w") as _file:
+        _file.write(";".join(["start", "exectime", "label"] +
+                             [f"wait.{result.workers}"
+                              for result in results]) + "\n")
+        for i, (ts, exectime, label) in enumerate(zip(starts, exectimes,
+                                                      step_labels)):
+            ts_out = datetime.fromtimestamp(ts, timezone.utc)
+            _file.write(f"{ts_out.isoformat('T', 'microseconds')};"
+                        f"{exectime};"
+                        f"{steps.labels[label]};" +
+                        ";".join(str(result.waits[i]) for result in results) +
+                        "\n")
+    print(f".. in {fname}")
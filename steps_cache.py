@@ -0,0 +1,152 @@
+# Persistent cache of parsed dynflow_steps.
+#
+# The cache is stored next to the input file (dynflow_steps.cache) in a
+# binary columnar format and is memory-mapped when used again, so repeated
+# runs over the same sosreport don't need to parse the CSV text again.
+#
+# Cache file layout (shared by other binary columnar files like the index of
+# dynflow_steps):
+#   magic bytes
+#   8 bytes: length of JSON header (little endian)
+#   JSON header: source file size and mtime, byte order, number of rows,
+#                columns offsets and other data (like label table and
+#                dynflow plan UUID table for the cache)
+#   columns, each aligned to 8 bytes
+
+from array import array
+from dynflow_records import STEP_COLUMNS, StepColumns, parse_step
+from file_chunks import map_chunks, read_chunk_lines
+import json
+import mmap
+import os
+from run_stats import counters
+import sys
+
+MAGIC = b'DFSTEPS1'
+
+# the columns are those of StepColumns
+COLUMNS = STEP_COLUMNS
+
+
+def cache_fname(fname):
+    return f"{fname}.cache"
+
+
+def _parse_steps_chunk(fname, chunk_start, chunk_end):
+    """
+    Parse all usable dynflow_steps lines within the given chunk of the file
+    to StepColumns.
+    """
+    steps = StepColumns()
+    read = 0
+    for line in read_chunk_lines(fname, chunk_start, chunk_end):
+        read += 1
+        step = parse_step(line.split(','))
+        if step is not None:
+            steps.append(step)
+    counters['dynflow_steps: rows read'] += read
+    return steps
+
+
+def _build(fname, jobs):
+    """
+    Parse whole dynflow_steps file, possibly in parallel chunks, and merge
+    the chunks' columns and label/plan tables.
+    """
+    steps = StepColumns()
+    for chunk_steps in map_chunks(_parse_steps_chunk, fname, jobs):
+        steps.extend(chunk_steps)
+    return steps
+
+
+def write_columns(path, magic, stat, header, columns_spec, columns):
+    """
+    Store the header dict and array columns (per columns_spec of (name,
+    typecode) pairs, all of the same length) in a binary columnar file,
+    together with size and mtime of the source file `stat`.
+    """
+    rows = len(columns[columns_spec[0][0]]) if columns_spec else 0
+    header = dict(header, source_size=stat.st_size,
+                  source_mtime=stat.st_mtime_ns, byteorder=sys.byteorder,
+                  rows=rows, columns={})
+    # compute columns offsets relative to the end of the header, aligned
+    offset = 0
+    for name, typecode in columns_spec:
+        header['columns'][name] = offset
+        size = rows * array(typecode).itemsize
+        offset += (size + 7) // 8 * 8
+    header = json.dumps(header).encode()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as _file:
+        _file.write(magic)
+        _file.write(len(header).to_bytes(8, 'little'))
+        _file.write(header)
+        _file.write(b'\0' * ((8 - _file.tell() % 8) % 8))
+        for name, typecode in columns_spec:
+            data = columns[name].tobytes()
+            _file.write(data)
+            _file.write(b'\0' * ((8 - len(data) % 8) % 8))
+    os.replace(tmp_path, path)
+
+
+def load_columns(path, magic, stat, columns_spec):
+    """
+    Memory-map the binary columnar file, if it exists and it is up to date
+    with the source file `stat`. Return (header, columns) where columns are
+    memoryviews into the file, or None.
+    """
+    try:
+        _file = open(path, 'rb')
+    except OSError:
+        return None
+    with _file:
+        if _file.read(len(magic)) != magic:
+            return None
+        header_len = int.from_bytes(_file.read(8), 'little')
+        try:
+            header = json.loads(_file.read(header_len))
+        except ValueError:
+            return None
+        if header['source_size'] != stat.st_size or \
+                header['source_mtime'] != stat.st_mtime_ns or \
+                header['byteorder'] != sys.byteorder:
+            return None
+        data_start = len(magic) + 8 + header_len
+        data_start += (8 - data_start % 8) % 8
+        try:
+            mm = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return None
+    rows = header['rows']
+    columns = {}
+    for name, typecode in columns_spec:
+        start = data_start + header['columns'][name]
+        end = start + rows * array(typecode).itemsize
+        if end > len(mm):
+            return None
+        columns[name] = memoryview(mm)[start:end].cast(typecode)
+    return header, columns
+
+
+def open_steps_cache(fname, jobs=1):
+    """
+    Return StepColumns of the dynflow_steps file: memory-mapped from its
+    cache file if it is valid for the current file size and mtime, otherwise
+    parse the file and (try to) store the cache for next runs.
+    """
+    stat = os.stat(fname)
+    loaded = load_columns(cache_fname(fname), MAGIC, stat, COLUMNS)
+    if loaded is not None:
+        header, columns = loaded
+        counters['dynflow_steps: rows loaded from cache'] += header['rows']
+        return StepColumns(columns, header['labels'], header['plans'])
+    print(f"Building cache {cache_fname(fname)}..")
+    cache = _build(fname, jobs)
+    try:
+        write_columns(cache_fname(fname), MAGIC, stat,
+                      {'labels': cache.labels, 'plans': cache.plans},
+                      COLUMNS, cache.columns)
+    except OSError as err:
+        print(f"Warning: could not store cache {cache_fname(fname)}: {err}")
+    return cache
@@ -0,0 +1,203 @@
+# Index of dynflow_steps per step start time.
+#
+# The index is stored next to the input file (dynflow_steps.index) in the
+# same binary columnar format like the steps cache. It allows reading just
+# the lines of steps running within some time window, instead of reading
+# and parsing the whole file.
+#
+# Steps are split to regular ones, sorted per start time, and long ones
+# (running over LONG_STEP seconds or not finished at all). For regular steps,
+# max_finish column keeps maximum finish time of all steps started so far, so
+# steps running within a window are found by two binary searches plus a
+# short scan. Long steps are few, so they are scanned completely.
+
+from array import array
+from bisect import bisect_left, bisect_right
+from dynflow_records import STEPS_HEADER_FIRST, convert_datetime_to_seconds
+from file_chunks import map_chunks, read_chunk_lines_at, read_lines_at
+from run_stats import counters
+from steps_cache import load_columns, write_columns
+import os
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'DFSTIDX1'
+
+# name and array typecode of the columns
+#   start, finish: epoch seconds; finish is inf for steps not finished
+#   offset: byte offset of the step's line in dynflow_steps
+#   max_finish: maximum finish of regular steps from the first one till
+#               this one
+COLUMNS = (('start', 'd'),
+           ('finish', 'd'),
+           ('offset', 'Q'),
+           ('max_finish', 'd'))
+
+# steps running longer (in seconds) are treated as long ones
+LONG_STEP = 3600
+
+
+class StepsIndex:
+    """
+    Columns of the index (see COLUMNS), first `regular_rows` rows are regular
+    steps sorted per start time, the remaining ones are long steps.
+    """
+
+    def __init__(self, regular_rows, columns):
+        self.regular_rows = regular_rows
+        self.rows = len(columns['start'])
+        self.columns = columns
+        for name, typecode in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def offsets(self, from_ts, to_ts):
+        """
+        Return sorted byte offsets of lines of steps running (at least
+        partially) between from_ts and to_ts.
+        """
+        # regular steps started till to_ts, skipping the leading ones that
+        # surely finished before from_ts
+        first = bisect_left(self.max_finish, from_ts, 0, self.regular_rows)
+        last = bisect_right(self.start, to_ts, 0, self.regular_rows)
+        if np is not None:
+            finishes = np.asarray(self.finish)
+            starts = np.asarray(self.start)
+            offsets = np.asarray(self.offset)
+            regular = first + np.flatnonzero(finishes[first:last] >= from_ts)
+            long = self.regular_rows + np.flatnonzero(
+                (starts[self.regular_rows:] <= to_ts) &
+                (finishes[self.regular_rows:] >= from_ts))
+            return np.sort(np.concatenate((offsets[regular],
+                                           offsets[long]))).tolist()
+        ret = [self.offset[i] for i in range(first, last)
+               if self.finish[i] >= from_ts]
+        ret.extend(self.offset[i] for i in range(self.regular_rows, self.rows)
+                   if self.start[i] <= to_ts and self.finish[i] >= from_ts)
+        return sorted(ret)
+
+    def lines(self, fname, from_ts, to_ts):
+        """
+        Yield lines of dynflow_steps of steps running (at least partially)
+        between from_ts and to_ts, in the order of the file.
+        """
+        return read_lines_at(fname, self.offsets(from_ts, to_ts))
+
+    def offsets_at(self, ts):
+        """
+        Return sorted byte offsets of lines of steps running at given time,
+        i.e. started till then and finishing after it (like in
+        LoadTimeline.running_at). Unlike in offsets, steps finished exactly
+        at that time are not running anymore.
+        """
+        first = bisect_right(self.max_finish, ts, 0, self.regular_rows)
+        last = bisect_right(self.start, ts, 0, self.regular_rows)
+        if np is not None:
+            finishes = np.asarray(self.finish)
+            starts = np.asarray(self.start)
+            offsets = np.asarray(self.offset)
+            regular = first + np.flatnonzero(finishes[first:last] > ts)
+            long = self.regular_rows + np.flatnonzero(
+                (starts[self.regular_rows:] <= ts) &
+                (finishes[self.regular_rows:] > ts))
+            return np.sort(np.concatenate((offsets[regular],
+                                           offsets[long]))).tolist()
+        ret = [self.offset[i] for i in range(first, last)
+               if self.finish[i] > ts]
+        ret.extend(self.offset[i] for i in range(self.regular_rows, self.rows)
+                   if self.start[i] <= ts < self.finish[i])
+        return sorted(ret)
+
+    def lines_at(self, fname, ts):
+        """
+        Yield lines of dynflow_steps of steps running at given time (see
+        offsets_at), in the order of the file.
+        """
+        return read_lines_at(fname, self.offsets_at(ts))
+
+
+def index_fname(fname):
+    return f"{fname}.index"
+
+
+def _index_chunk(fname, chunk_start, chunk_end):
+    """
+    Return arrays of start, finish and line offset of dynflow_steps lines
+    within the given chunk of the file.
+    """
+    starts = array('d')
+    finishes = array('d')
+    offsets = array('Q')
+    read = 0
+    for offset, line in read_chunk_lines_at(fname, chunk_start, chunk_end):
+        read += 1
+        cols = line.split(',')
+        # the CSV header, if present, is not a step
+        if cols[0] == STEPS_HEADER_FIRST:
+            counters['dynflow_steps index: skipped header'] += 1
+            continue
+        # ignore incomplete lines
+        if len(cols) < 16 or len(cols[4]) == 0:
+            counters['dynflow_steps index: skipped incomplete line'] += 1
+            continue
+        try:
+            start = convert_datetime_to_seconds(cols[4])
+            finish = convert_datetime_to_seconds(cols[5]) \
+                if len(cols[5]) > 0 else float('inf')
+        except ValueError:
+            counters['dynflow_steps index: skipped bad timestamp'] += 1
+            continue
+        starts.append(start)
+        finishes.append(finish)
+        offsets.append(offset)
+    counters['dynflow_steps index: rows read'] += read
+    return starts, finishes, offsets
+
+
+def _build(fname, jobs):
+    starts = array('d')
+    finishes = array('d')
+    offsets = array('Q')
+    for chunk_starts, chunk_finishes, chunk_offsets in \
+            map_chunks(_index_chunk, fname, jobs):
+        starts.extend(chunk_starts)
+        finishes.extend(chunk_finishes)
+        offsets.extend(chunk_offsets)
+    regular = sorted((i for i in range(len(starts))
+                      if finishes[i]-starts[i] <= LONG_STEP),
+                     key=starts.__getitem__)
+    regular_set = set(regular)
+    long = [i for i in range(len(starts)) if i not in regular_set]
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    max_finish = float('-inf')
+    for i in regular + long:
+        columns['start'].append(starts[i])
+        columns['finish'].append(finishes[i])
+        columns['offset'].append(offsets[i])
+        max_finish = max(max_finish, finishes[i])
+        columns['max_finish'].append(max_finish if i in regular_set
+                                     else finishes[i])
+    return StepsIndex(len(regular), columns)
+
+
+def open_steps_index(fname, jobs=1):
+    """
+    Return StepsIndex of the dynflow_steps file: memory-mapped from its index
+    file if it is valid for the current file size and mtime, otherwise build
+    the index and (try to) store it for next runs.
+    """
+    stat = os.stat(fname)
+    loaded = load_columns(index_fname(fname), MAGIC, stat, COLUMNS)
+    if loaded is not None:
+        header, columns = loaded
+        return StepsIndex(header['regular_rows'], columns)
+    print(f"Building index {index_fname(fname)}..")
+    index = _build(fname, jobs)
+    try:
+        write_columns(index_fname(fname), MAGIC, stat,
+                      {'regular_rows': index.regular_rows}, COLUMNS,
+                      index.columns)
+    except OSError as err:
+        print(f"Warning: could not store index {index_fname(fname)}: {err}")
+    return index
@@ -0,0 +1,470 @@
+# Blame of foreman task duration among sidekiq, pulp and candlepin: reading
+# of the tasks and their dynflow steps, sweeping of the blame periods of a
+# task, and summaries of the blame per task label.
+
+from bisect import bisect_left, bisect_right
+from copy import deepcopy
+from datetime import *
+from dateutil.tz import tzutc
+from dynflow_records import STEPS_HEADER_FIRST, Step, \
+    convert_datetime_to_seconds, parse_step
+from file_chunks import read_chunk_lines
+import heapq
+from quantile_sketch import QuantileSketch
+from run_stats import counters
+
+utctz = tzutc()
+now = datetime.now().replace(tzinfo=utctz).timestamp()
+
+# absolute / cumulative times, not respecting concurrency
+zero_blame_times = {
+    'sidewait': 0.0,
+    'sideexec': 0.0,
+    'pulpwait': 0.0,
+    'pulpexec': 0.0,
+    'candlewait': 0.0,
+    'candleexec': 0.0
+}
+
+# who to blame for a time on the critical path covered by more concurrent
+# external intervals: execution takes precedence over waiting
+external_precedence = ['pulpexec', 'candleexec', 'pulpwait', 'candlewait']
+
+
+def parse_steps_chunk(fname, chunk_start, chunk_end, dynflow_uuids):
+    """
+    Parse dynflow_steps lines within the given chunk of the file. Return dict
+    of lists of Step records per each of given dynflow_uuids.
+    """
+    steps = {}
+    read = other = 0
+    for line in read_chunk_lines(fname, chunk_start, chunk_end):
+        read += 1
+        cols = line.split(',')
+        # ignore incomplete lines
+        if len(cols) < 16:
+            counters['dynflow_steps: skipped incomplete line'] += 1
+            continue
+        # ignore steps from other tasks (and the CSV header, counted by
+        # parse_step)
+        if cols[0] not in dynflow_uuids and cols[0] != STEPS_HEADER_FIRST:
+            other += 1
+            continue
+        step = parse_step(cols)
+        if step is None:
+            continue
+        # ignore incomplete data - finish and realtime must be known (not
+        # NaN)
+        if step.finish != step.finish or step.realtime != step.realtime:
+            counters['dynflow_steps: skipped unfinished step'] += 1
+            continue
+        steps.setdefault(step.plan, []).append(step)
+    counters['dynflow_steps: rows read'] += read
+    counters['dynflow_steps: skipped other task'] += other
+    return steps
+
+
+def steps_from_cache(cache, dynflow_uuids):
+    """
+    Same as parse_steps_chunk, but for all steps stored in the steps cache.
+    """
+    steps = {}
+    plan_ids = set(i for i, plan in enumerate(cache.plans)
+                   if plan in dynflow_uuids)
+    other = 0
+    for row, plan_id in enumerate(cache.plan):
+        if plan_id not in plan_ids:
+            other += 1
+            continue
+        realtime = cache.realtime[row]
+        finish = cache.finish[row]
+        # ignore incomplete data (NaN)
+        if realtime != realtime or finish != finish:
+            counters['dynflow_steps: skipped unfinished step'] += 1
+            continue
+        plan = cache.plans[plan_id]
+        steps.setdefault(plan, []).append(
+            Step(plan, str(cache.action[row]), cache.start[row], finish,
+                 realtime, cache.exectime[row],
+                 cache.labels[cache.label[row]]))
+    counters['dynflow_steps: skipped other task'] += other
+    return steps
+
+
+def iter_tasks(fname, labels, states, from_ts, to_ts):
+    """
+    Yield (duration, foreman_uuid, dynflow_uuid, label, state) of tasks from
+    foreman_tasks_tasks matching given labels and states (if set) and running
+    at least partially between from_ts and to_ts. Tasks still running are
+    considered to run till now.
+    """
+    read = 0
+    for line in open(fname, 'r'):
+        read += 1
+        # the CSV header, if present, is not a task
+        if read == 1 and line.startswith('id,'):
+            counters['foreman_tasks_tasks: skipped header'] += 1
+            continue
+        cols = line.split(',')
+        # ignore incomplete lines and tasks without dynflow plan
+        if len(cols) < 14 or len(cols[7]) == 0:
+            counters['foreman_tasks_tasks: skipped incomplete line'] += 1
+            continue
+        label = cols[2]
+        state = cols[5]
+        if labels and label not in labels or states and state not in states:
+            counters['foreman_tasks_tasks: skipped other label or '
+                     'state'] += 1
+            continue
+        try:
+            started_at = convert_datetime_to_seconds(cols[3])
+            ended_at = convert_datetime_to_seconds(cols[4]) \
+                if len(cols[4]) > 0 else now
+        except ValueError:
+            counters['foreman_tasks_tasks: skipped bad timestamp'] += 1
+            continue
+        # skip tasks completely outside specified interval
+        if started_at > to_ts or ended_at < from_ts:
+            counters['foreman_tasks_tasks: skipped outside window'] += 1
+            continue
+        yield (ended_at-started_at, cols[0], cols[7], label, state)
+    counters['foreman_tasks_tasks: rows read'] += read
+
+
+def select_slowest_tasks(fname, limit, labels, states, from_ts, to_ts):
+    """
+    Return list of (duration, foreman_uuid, dynflow_uuid, label, state) of
+    the `limit` longest tasks from foreman_tasks_tasks, see iter_tasks.
+    """
+    return heapq.nlargest(limit,
+                          iter_tasks(fname, labels, states, from_ts, to_ts),
+                          key=lambda x: x[0])
+
+
+class LabelBlame:
+    """
+    Relative blame times summarized over all tasks with the same label:
+    totals per who-to-blame, and per-task distributions of them kept in
+    QuantileSketch, so the memory does not grow with the number of tasks.
+    """
+
+    def __init__(self):
+        self.tasks = 0
+        self.totals = deepcopy(zero_blame_times)
+        self.sketches = {who: QuantileSketch()
+                         for who in ['TOTAL'] + list(zero_blame_times.keys())}
+
+    def add(self, relative_blame_intervals):
+        self.tasks += 1
+        self.sketches['TOTAL'].add(sum(relative_blame_intervals.values()))
+        for who, value in relative_blame_intervals.items():
+            self.totals[who] += value
+            self.sketches[who].add(value)
+
+
+class TaskBlame:
+    """
+    Blame data of one foreman task, fed by rows of dynflow_steps and
+    dynflow_actions belonging to the task's dynflow execution plan.
+    """
+
+    def __init__(self, foreman_uuid, dynflow_uuid):
+        self.foreman_uuid = foreman_uuid
+        self.dynflow_uuid = dynflow_uuid
+        self.absolute_times = deepcopy(zero_blame_times)
+        # track all timestamps in a set
+        self.timestamps = set()
+        # for each dynflow step, keep its Step record with start and finish
+        # timestamps and sidekiq's execution time - index them per action_id
+        # which is a sufficient common id for both action and step (for us)
+        self.steps_times = {}
+        # for each dynflow action, keep list of intervals "we started to wait
+        # on (pulp|candlepin) task at .. for time .."
+        self.action_intervals = {}
+
+    def add_step(self, step):
+        self.timestamps.add(step.start)
+        self.timestamps.add(step.finish)
+        if step.action_id not in self.steps_times.keys():
+            self.steps_times[step.action_id] = []
+            self.action_intervals[step.action_id] = []
+        self.steps_times[step.action_id].append(step)
+        self.absolute_times['sidewait'] += step.realtime-step.exectime
+        self.absolute_times['sideexec'] += step.exectime
+
+    # for an external task, add times from "task created/started/finished" to
+    # internal structures
+    def add_external_task(self, task):
+        # if dynflow_steps are truncated, we might not know the
+        # [real/exec]time then skip further calculation
+        if task.action_id not in self.steps_times.keys():
+            return
+        self.timestamps.add(task.created)
+        self.timestamps.add(task.started)
+        self.timestamps.add(task.finished)
+        self.action_intervals[task.action_id].append(
+            (task.created, task.started-task.created, f'{task.who}wait'))
+        self.action_intervals[task.action_id].append(
+            (task.started, task.finished-task.started, f'{task.who}exec'))
+        self.absolute_times['sidewait'] -= task.finished-task.created
+        self.absolute_times[f'{task.who}wait'] += task.started-task.created
+        self.absolute_times[f'{task.who}exec'] += task.finished-task.started
+
+    def blame_periods(self):
+        """
+        Distribute sidekiq execution time evenly to the "not sidekiq
+        responsibility" intervals from action_intervals and to the remaining
+        "sidekiq responsibility" intervals. Return a set of
+        (start_time, duration, who-to-blame, weight) tuples.
+        """
+        blame_periods = set()
+        # for each action_intervals[step_id], distribute the execution time
+        # among partial intervals and store the final value in final
+        # intervals. Traverse sorted action_intervals linearly in time to
+        # feed blame_periods (keeping self.action_intervals intact)
+        action_intervals = {}
+        for step_id, intervals in self.action_intervals.items():
+            # one dummy record at the end prevents "is there a record .."
+            # tests
+            action_intervals[step_id] = sorted(
+                intervals + [(now, 0, 'pulpexec')], key=lambda x: x[0])
+        for step_id in self.steps_times.keys():
+            intervals = action_intervals[step_id]
+            # the first interval not traversed yet
+            pos = 0
+            for step in self.steps_times[step_id]:
+                started_at = step.start
+                ended_at = step.finish
+                realtime = step.realtime
+                exectime = step.exectime
+                # if whole interval was spent by sidekiq execution, skip
+                # finding any external action, there won't be
+                if realtime == exectime:
+                    blame_periods.add((started_at, ended_at-started_at,
+                                       'sideexec', 1))
+                    continue
+                exec2real = exectime/realtime
+                # while there is an action within this sidekiq interval..
+                while ended_at > intervals[pos][0]:
+                    interval_start, interval_duration, who = intervals[pos]
+                    # blame sidekiq for period prior the external action
+                    if started_at < interval_start:
+                        duration = interval_start-started_at
+                        blame_periods.add((started_at, duration, 'sidewait',
+                                           1-exec2real))
+                        blame_periods.add((started_at, duration, 'sideexec',
+                                           exec2real))
+                    # now blame pulp/candlepin and sideexec - nowadays, we
+                    # treat both of them fully concurrently, not interfering
+                    # each other "blame" or weight. This approach alone could
+                    # mean simplier code but the current code is prepared for
+                    # a variant "blame them with proper" weights" (since
+                    # sideexec might affect pulp/candlepin..?)
+                    blame_periods.add((interval_start, interval_duration,
+                                       who, 1))
+                    blame_periods.add((interval_start, interval_duration,
+                                       'sideexec', exec2real))
+                    # move in time beyond the action
+                    started_at = interval_start + interval_duration
+                    pos += 1
+                # if there is a trailing time spent by sidekiq, blame for it
+                if started_at < ended_at:
+                    duration = ended_at-started_at
+                    blame_periods.add((started_at, duration, 'sidewait',
+                                       1-exec2real))
+                    blame_periods.add((started_at, duration, 'sideexec',
+                                       exec2real))
+        return blame_periods
+
+    def blame(self):
+        """
+        Return (absolute_blame_intervals, relative_blame_intervals) dicts.
+        """
+        return sweep_blame_periods(self.timestamps, self.blame_periods())
+
+    def critical_path(self):
+        """
+        Find the critical path of the task: the chain of steps that determined
+        its finish time, going back from the last finished step to the step
+        that finished last before it started (that one was blocking it), and
+        so on. Return (path, blame) where path is a list of (step, wait
+        before the step, blame of the step) in time order, and blame sums the
+        path: waiting between the steps counts as 'sidewait', time of a step
+        covered by its action's pulp/candlepin intervals is blamed on them,
+        the rest is split to 'sideexec' up to the step's execution time and
+        'sidewait'.
+        """
+        steps = sorted((step for steps in self.steps_times.values()
+                        for step in steps), key=lambda x: x.finish)
+        finishes = [step.finish for step in steps]
+        path = []
+        i = len(steps)-1
+        while i >= 0:
+            step = steps[i]
+            # predecessor is searched in the steps finished before this one,
+            # so the walk is O(n log n) for n steps in total
+            i = bisect_right(finishes, step.start, 0, i)-1
+            wait = step.start-steps[i].finish if i >= 0 else 0.0
+            path.append((step, wait, self._step_blame(step, wait)))
+        path.reverse()
+        blame = deepcopy(zero_blame_times)
+        for step, wait, step_blame in path:
+            for who, value in step_blame.items():
+                blame[who] += value
+        return path, blame
+
+    def _step_blame(self, step, wait):
+        """
+        Blame of a critical path step, see critical_path.
+        """
+        blame = deepcopy(zero_blame_times)
+        blame['sidewait'] = wait
+        # sweep the action's external intervals clipped to the step
+        events = []
+        for interval_start, interval_duration, who in \
+                self.action_intervals[step.action_id]:
+            begin = max(interval_start, step.start)
+            end = min(interval_start+interval_duration, step.finish)
+            if begin < end:
+                events.append((begin, 1, who))
+                events.append((end, -1, who))
+        events.sort(key=lambda x: x[0])
+        active = dict.fromkeys(external_precedence, 0)
+        previous = None
+        covered = 0.0
+        for ts, delta, who in events:
+            if previous is not None and ts > previous:
+                for key in external_precedence:
+                    if active[key] > 0:
+                        blame[key] += ts-previous
+                        covered += ts-previous
+                        break
+            active[who] += delta
+            previous = ts
+        remaining = max(step.finish-step.start-covered, 0.0)
+        blame['sideexec'] += min(step.exectime, remaining)
+        blame['sidewait'] += remaining-min(step.exectime, remaining)
+        return blame
+
+
+def sweep_blame_periods(timestamps, blame_periods):
+    """
+    Summarize blame_periods over individual intervals between neighbouring
+    `timestamps`: per each interval, sum weights of the periods covering it
+    and count them as the interval's concurrency (to split the blame evenly).
+    Return (absolute_blame_intervals, relative_blame_intervals) dicts.
+
+    Instead of walking all intervals of each period, record just "weight
+    starts"/"weight ends" deltas at the period's first and after its last
+    interval, and get the per interval values by one cumulative sweep over
+    the sorted timestamps.
+    """
+    relative_blame_intervals = deepcopy(zero_blame_times)
+    absolute_blame_intervals = deepcopy(zero_blame_times)
+    timestamps_sorted = sorted(timestamps)
+    ts_index = {ts: i for i, ts in enumerate(timestamps_sorted)}
+    # deltas of blame weights (per who) and of concurrency at each timestamp
+    weight_deltas = {who: [0.0]*len(timestamps_sorted)
+                     for who in zero_blame_times.keys()}
+    concurrency_deltas = [0]*len(timestamps_sorted)
+    for ts, duration, who, weight in blame_periods:
+        if duration <= 0:
+            continue
+        first = ts_index[ts]
+        # the period covers all intervals starting before its end
+        last = bisect_left(timestamps_sorted, ts+duration, first+1)
+        weight_deltas[who][first] += weight
+        concurrency_deltas[first] += 1
+        if last < len(timestamps_sorted):
+            weight_deltas[who][last] -= weight
+            concurrency_deltas[last] -= 1
+
+    # sweep the intervals, summarize them over time
+    # (absolute_blame_intervals) and also concurrency
+    # (relative_blame_intervals)
+    weights = deepcopy(zero_blame_times)
+    concurrency = 0
+    for i in range(len(timestamps_sorted)-1):
+        concurrency += concurrency_deltas[i]
+        for who in weights.keys():
+            weights[who] += weight_deltas[who][i]
+        if concurrency == 0:
+            continue
+        duration = timestamps_sorted[i+1]-timestamps_sorted[i]
+        for who in weights.keys():
+            absolute_blame_intervals[who] += duration*weights[who]
+            relative_blame_intervals[who] += \
+                duration*weights[who]/concurrency
+    return absolute_blame_intervals, relative_blame_intervals
+
+
+def print_header(label):
+    keys_str = f"{'TOTAL':>12} {'pct.':>6}"
+    for key in zero_blame_times.keys():
+        keys_str = f"{keys_str}{key:>12} {'pct.':>6}"
+    print(f"{label:>36} :{keys_str}")
+
+
+def print_metric(label, metric):
+    sumtime = sum(metric.values())
+    vals = f"{sumtime:>12,.2f} {100:>5,.1f}%"
+    # prevent division by zero - percentage would be zero instead of 0/0
+    if sumtime == 0:
+        sumtime = 1
+    for key in zero_blame_times.keys():
+        vals = f"{vals}{metric[key]:>12,.2f} {metric[key]/sumtime*100:>5,.1f}%"
+    print(f"{label:>36} :{vals}")
+
+
+def print_label_blame(label, label_blame):
+    s = f"{label} ({label_blame.tasks} tasks):"
+    print(s)
+    print("-"*len(s))
+    print(f"{'':>12}{'total':>16} {'pct.':>6}{'p50':>12}{'p95':>12}"
+          f"{'p99':>12}")
+    sumtime = sum(label_blame.totals.values())
+    totals = dict(TOTAL=sumtime, **label_blame.totals)
+    # prevent division by zero - percentage would be zero instead of 0/0
+    if sumtime == 0:
+        sumtime = 1
+    for who, total in totals.items():
+        sketch = label_blame.sketches[who]
+        vals = f"{total:>16,.2f} {total/sumtime*100:>5,.1f}%"
+        for q in (0.5, 0.95, 0.99):
+            vals = f"{vals}{sketch.quantile(q):>12,.2f}"
+        print(f"{who:>12}{vals}")
+    print()
+
+
+def print_critical_path(task, limit):
+    """
+    Print the critical path of the task: its `limit` longest steps (including
+    the wait before them) in time order and a row with blame of the path.
+    """
+    path, blame = task.critical_path()
+    total = sum(blame.values())
+    s = f"Critical path of {task.foreman_uuid} ({len(path)} steps, " \
+        f"{total:,.2f}s):"
+    print(s)
+    print("-"*len(s))
+    longest = set(id(step) for step, wait, step_blame in
+                  heapq.nlargest(limit, path,
+                                 key=lambda x: sum(x[2].values())))
+    print(f"{'start':<34}{'wait':>8}{'duration':>10}  {'blamed':<12}"
+          f"{'action':>8}  label")
+    for step, wait, step_blame in path:
+        if id(step) not in longest:
+            continue
+        ts = datetime.fromtimestamp(step.start, timezone.utc)
+        # the component blamed the most for the step itself
+        own_blame = dict(step_blame, sidewait=step_blame['sidewait']-wait)
+        who = max(own_blame.keys(), key=lambda x: own_blame[x])
+        print(f"{ts.isoformat('T', 'microseconds'):<34}{wait:>8,.2f}"
+              f"{step.finish-step.start:>10,.2f}  {who:<12}"
+              f"{step.action_id:>8}  {step.label}")
+    if len(path) > limit:
+        print(f"({len(path)-limit} shorter steps not shown)")
+    print()
+    print_header("")
+    print_metric("critical path blame", blame)
+    print()
@@ -0,0 +1,184 @@
+# The sweep over timestamps in sweep_blame_periods must give the same
+# absolute-blame and relative-blame times like the original walk of each
+# blame period over all intervals it covers.
+
+from copy import deepcopy
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from dynflow_records import ExternalTask, Step  # noqa: E402
+from task_blame import TaskBlame, sweep_blame_periods, \
+    zero_blame_times  # noqa: E402
+
+
+def walk_blame_periods(timestamps, blame_periods):
+    """
+    The original cumul_blame_intervals walk, as a reference implementation.
+    """
+    relative_blame_intervals = deepcopy(zero_blame_times)
+    absolute_blame_intervals = deepcopy(zero_blame_times)
+    # cumul_blame_intervals are cumulative blame_periods grouped into
+    # individual intervals from `timestamps`
+    # format: key=start_time, value={duration, zero_blame_times,
+    # concurrency) where concurrency is the number of concurrent steps
+    # (to split the blame evenly)
+    cumul_blame_intervals = {}
+    # transform blame_periods into cumul_blame_intervals
+    # first initialise cumul_blame_intervals
+    next_ts = max(timestamps)
+    for ts in sorted(timestamps, reverse=True):
+        cumul_blame_intervals[ts] = [next_ts-ts, deepcopy(zero_blame_times),
+                                     0]
+        next_ts = ts
+    cumul_blame_intervals = dict(sorted(cumul_blame_intervals.items()))
+    # now, add each of blame_periods into corresponding
+    # cumul_blame_intervals
+    for ts, duration, who, weight in blame_periods:
+        while duration > 0:
+            interval = cumul_blame_intervals[ts]
+            interval[1][who] += weight
+            interval[2] += 1
+            duration -= interval[0]
+            ts += interval[0]
+
+    # summarize cumul_blame_intervals over time (absolute_blame_intervals)
+    # and also concurrency (relative_blame_intervals)
+    whos = absolute_blame_intervals.keys()
+    for duration, blame_times, concurrency in \
+            cumul_blame_intervals.values():
+        if concurrency == 0:
+            continue
+        for who in whos:
+            absolute_blame_intervals[who] += duration*blame_times[who]
+            relative_blame_intervals[who] += \
+                duration*blame_times[who]/concurrency
+    return absolute_blame_intervals, relative_blame_intervals
+
+
+def make_task(steps, external_tasks=()):
+    """
+    Return TaskBlame of steps given as (action_id, start, finish, exectime)
+    and external tasks as (action_id, who, created, started, finished).
+    """
+    task = TaskBlame('foreman-uuid', 'dynflow-uuid')
+    for action_id, start, finish, exectime in steps:
+        task.add_step(Step('dynflow-uuid', action_id, start, finish,
+                           finish-start, exectime, 'Label'))
+    for action_id, who, created, started, finished in external_tasks:
+        task.add_external_task(ExternalTask('dynflow-uuid', action_id, who,
+                                            created, started, finished))
+    return task
+
+
+def random_plan(seed, steps_count):
+    """
+    Return steps and external tasks of a random plan. Times are multiples of
+    1/4s so the walk subtracting interval durations does not accumulate any
+    rounding error.
+    """
+    rnd = random.Random(seed)
+
+    def between(low, high):
+        return rnd.randint(int(low*4), int(high*4))/4
+
+    steps = []
+    external_tasks = []
+    for action in range(steps_count):
+        start = between(0, 100)
+        finish = start + rnd.choice([0.0, between(0.5, 50)])
+        realtime = finish-start
+        if realtime == 0 or rnd.random() < 0.3:
+            steps.append((str(action), start, finish, realtime))
+            continue
+        steps.append((str(action), start, finish,
+                      realtime*rnd.uniform(0.05, 0.5)))
+        # a pulp or candlepin task within the step
+        created = between(start, finish)
+        started = between(created, finish)
+        finished = between(started, finish)
+        external_tasks.append((str(action), rnd.choice(['pulp', 'candle']),
+                               created, started, finished))
+    # steps come in no particular order
+    rnd.shuffle(steps)
+    return steps, external_tasks
+
+
+def random_periods(seed, periods_count):
+    """
+    Return timestamps and blame periods spanning random ranges of the
+    intervals between them, in no particular order.
+    """
+    rnd = random.Random(seed)
+    timestamps = sorted({rnd.randint(0, 400)/4 for i in range(40)})
+    blame_periods = set()
+    for i in range(periods_count):
+        first = rnd.randrange(len(timestamps))
+        last = rnd.randrange(first, len(timestamps))
+        blame_periods.add((timestamps[first],
+                           timestamps[last]-timestamps[first],
+                           rnd.choice(list(zero_blame_times.keys())),
+                           rnd.choice([1, rnd.random()])))
+    rnd.shuffle(timestamps)
+    return timestamps, blame_periods
+
+
+PLANS = {
+    'overlapping': ([('1', 0.0, 10.0, 4.0), ('2', 5.0, 15.0, 10.0),
+                     ('3', 12.0, 20.0, 1.0)],
+                    []),
+    'nested': ([('1', 0.0, 30.0, 5.0), ('2', 10.0, 20.0, 10.0),
+                ('3', 12.0, 18.0, 3.0)],
+               []),
+    'zero-length': ([('1', 0.0, 10.0, 2.0), ('2', 5.0, 5.0, 0.0),
+                     ('3', 10.0, 10.0, 0.0), ('4', 10.0, 12.0, 2.0)],
+                    []),
+    'out-of-order': ([('3', 40.0, 50.0, 5.0), ('1', 0.0, 20.0, 2.0),
+                      ('2', 15.0, 45.0, 30.0), ('1', 25.0, 30.0, 1.0)],
+                     []),
+    'pulp and candlepin waits': (
+        [('1', 0.0, 60.0, 6.0), ('2', 10.0, 40.0, 3.0),
+         ('3', 50.0, 90.0, 40.0), ('4', 55.0, 80.0, 2.0)],
+        [('1', 'pulp', 2.0, 12.0, 50.0), ('1', 'pulp', 51.0, 52.0, 58.0),
+         ('2', 'candle', 12.0, 20.0, 35.0), ('4', 'pulp', 56.0, 70.0, 70.0),
+         ('4', 'candle', 71.0, 71.0, 79.0)]),
+}
+PLANS.update({f'random {seed}': random_plan(seed, 50) for seed in range(5)})
+
+
+@pytest.mark.parametrize('name', PLANS.keys())
+def test_sweep_matches_walk(name):
+    task = make_task(*PLANS[name])
+    blame_periods = task.blame_periods()
+    expected_absolute, expected_relative = \
+        walk_blame_periods(task.timestamps, blame_periods)
+    absolute, relative = sweep_blame_periods(task.timestamps, blame_periods)
+    assert absolute == pytest.approx(expected_absolute, rel=1e-9, abs=1e-9)
+    assert relative == pytest.approx(expected_relative, rel=1e-9, abs=1e-9)
+    # and the same via TaskBlame itself
+    assert task.blame()[1] == pytest.approx(expected_relative, rel=1e-9,
+                                            abs=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sweep_matches_walk_periods(seed):
+    # blame periods not produced by TaskBlame, to compare just the sweep
+    timestamps, blame_periods = random_periods(seed, 100)
+    expected_absolute, expected_relative = \
+        walk_blame_periods(timestamps, blame_periods)
+    absolute, relative = sweep_blame_periods(timestamps, blame_periods)
+    assert absolute == pytest.approx(expected_absolute, rel=1e-9, abs=1e-9)
+    assert relative == pytest.approx(expected_relative, rel=1e-9, abs=1e-9)
+
+
+def test_sweep_blames_external_waits():
+    task = make_task(*PLANS['pulp and candlepin waits'])
+    absolute, relative = sweep_blame_periods(task.timestamps,
+                                             task.blame_periods())
+    assert absolute['pulpwait'] > 0 and absolute['candlewait'] > 0
+    assert relative['pulpexec'] > 0 and relative['candleexec'] > 0
@@ -0,0 +1,81 @@
+# compute_backlog_intervals gives the same queued and running tasks with
+# numpy as without it, also for skewed times of tasks started before their
+# creation or finished before their start.
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import external_backlog  # noqa: E402
+from external_backlog import EXTERNAL_SYSTEMS, ExternalTimes  # noqa: E402
+
+
+def make_times(tasks):
+    """
+    Return ExternalTimes per who of tasks given as (who, created, started,
+    finished).
+    """
+    times = {who: ExternalTimes() for who in EXTERNAL_SYSTEMS}
+    for who, created, started, finished in tasks:
+        times[who].created.append(created)
+        times[who].started.append(started)
+        times[who].finished.append(finished)
+    return times
+
+
+def random_tasks(seed, count, skewed):
+    rnd = random.Random(seed)
+    tasks = []
+    for i in range(count):
+        created = rnd.randint(0, 400)
+        started = created + rnd.randint(0, 50)
+        finished = started + rnd.randint(0, 50)
+        if skewed and rnd.random() < 0.3:
+            # clocks of the systems differ: started before created, or
+            # finished before started
+            if rnd.random() < 0.5:
+                started = created - rnd.randint(1, 20)
+            else:
+                finished = started - rnd.randint(1, 20)
+        tasks.append((rnd.choice(EXTERNAL_SYSTEMS), created, started,
+                      finished))
+    return tasks
+
+
+def both_engines(monkeypatch, times, from_ts, to_ts):
+    result = external_backlog.compute_backlog_intervals(times, from_ts, to_ts)
+    with monkeypatch.context() as patch:
+        patch.setattr(external_backlog, 'np', None)
+        python_result = external_backlog.compute_backlog_intervals(
+            times, from_ts, to_ts)
+    return result, python_result
+
+
+@pytest.mark.skipif(external_backlog.np is None,
+                    reason="numpy not available")
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('skewed', [False, True])
+def test_engines_equal(monkeypatch, seed, skewed):
+    times = make_times(random_tasks(seed, 300, skewed))
+    for from_ts, to_ts in ((0, 1000), (100, 300), (250, 251)):
+        result, python_result = both_engines(monkeypatch, times, from_ts,
+                                             to_ts)
+        assert result == python_result
+
+
+def test_skewed_task(monkeypatch):
+    # started before created: never queued, running since the creation;
+    # finished before started: queued till the start, never running
+    times = make_times([('pulp', 10, 5, 20), ('candle', 10, 15, 12)])
+    for starts, ends, values in both_engines(monkeypatch, times, 0, 100):
+        assert starts == [5, 10, 12, 15, 20]
+        assert values['pulp'] == ([0, 0, 0, 0, 0], [0, 1, 1, 1, 0])
+        assert values['candle'] == ([0, 1, 1, 0, 0], [0, 0, 0, 0, 0])
+        assert all(queued >= 0 and running >= 0
+                   for who in EXTERNAL_SYSTEMS
+                   for queued, running in zip(*values[who]))
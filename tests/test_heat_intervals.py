@@ -0,0 +1,101 @@
+# compute_heat_intervals by default does not count a step in the interval
+# ending by the step's finish, like the original per interval walk of
+# heat_stats_sidekiq_workers.py, so its .sidekiq_load.csv stays the same.
+# With till_finish, a step is counted in all intervals it covers. Both with
+# numpy as well as without it.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sidekiq_load  # noqa: E402
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'numpy':
+        if sidekiq_load.np is None:
+            pytest.skip("numpy not available")
+    else:
+        monkeypatch.setattr(sidekiq_load, 'np', None)
+    return request.param
+
+
+def walk_heat_intervals(starts, finishes, exectimes):
+    """
+    The original per interval walk of heat_stats_sidekiq_workers.py, as a
+    reference implementation.
+    """
+    timestamps_sorted = list(sorted(set(starts) | set(finishes)))
+    heat_intervals = dict()
+    ts_prev = None
+    for ts in timestamps_sorted:
+        heat_intervals[ts] = {'end': sidekiq_load.now, 'steps': 0,
+                              'load': 0.0}
+        if ts_prev is not None:
+            heat_intervals[ts_prev]['end'] = ts
+        ts_prev = ts
+    for start, finish, exectime in zip(starts, finishes, exectimes):
+        if finish <= start:
+            continue
+        load = exectime / (finish-start)
+        ts = start
+        while finish > heat_intervals[ts]['end']:
+            heat_intervals[ts]['steps'] += 1
+            heat_intervals[ts]['load'] += load
+            ts = heat_intervals[ts]['end']
+    return ([value['steps'] for value in heat_intervals.values()],
+            [value['load'] for value in heat_intervals.values()])
+
+
+def test_default_excludes_last_interval(engine):
+    starts, ends, steps, loads = sidekiq_load.compute_heat_intervals(
+        [0, 4], [10, 6], [5, 2])
+    assert starts == [0, 4, 6, 10]
+    assert ends[:3] == [4, 6, 10]
+    assert steps == [1, 1, 0, 0]
+    assert loads == pytest.approx([0.5, 0.5, 0.0, 0.0])
+
+
+def test_till_finish_includes_last_interval(engine):
+    starts, ends, steps, loads = sidekiq_load.compute_heat_intervals(
+        [0, 4], [10, 6], [5, 2], till_finish=True)
+    assert starts == [0, 4, 6, 10]
+    assert steps == [1, 2, 1, 0]
+    assert loads == pytest.approx([0.5, 1.5, 0.5, 0.0])
+
+
+def test_lone_step(engine):
+    assert sidekiq_load.compute_heat_intervals(
+        [100], [110], [4])[2:] == ([0, 0], [0.0, 0.0])
+    steps, loads = sidekiq_load.compute_heat_intervals(
+        [100], [110], [4], till_finish=True)[2:]
+    assert steps == [1, 0]
+    assert loads == pytest.approx([0.4, 0.0])
+
+
+STARTS = [0, 1, 1, 3, 7, 7, 2.5, 9]
+FINISHES = [5, 4, 9, 3, 8, 12, 7, 12]
+EXECTIMES = [2, 3, 1, 0, 1, 5, 0.5, 3]
+
+
+def test_default_matches_walk(engine):
+    heat_starts, heat_ends, steps, loads = \
+        sidekiq_load.compute_heat_intervals(STARTS, FINISHES, EXECTIMES)
+    walk_steps, walk_loads = walk_heat_intervals(STARTS, FINISHES, EXECTIMES)
+    assert steps == walk_steps
+    assert loads == pytest.approx(walk_loads)
+
+
+def test_till_finish_totals_equal_exectimes(engine):
+    heat_starts, heat_ends, steps, loads = \
+        sidekiq_load.compute_heat_intervals(STARTS, FINISHES, EXECTIMES,
+                                            till_finish=True)
+    total = sum(load*(end-start) for start, end, load in
+                zip(heat_starts[:-1], heat_ends[:-1], loads[:-1]))
+    assert total == pytest.approx(sum(EXECTIMES))
+    assert steps[-1] == 0 and loads[-1] == 0.0
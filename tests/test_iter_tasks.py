@@ -0,0 +1,74 @@
+# iter_tasks and the parsers of dynflow_steps skip the CSV headers under
+# their own reason, not as a task or step with a bad timestamp or of other
+# task.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from dynflow_records import parse_step  # noqa: E402
+from run_stats import counters  # noqa: E402
+from task_blame import iter_tasks, parse_steps_chunk  # noqa: E402
+
+STEPS_HEADER = "execution_plan_uuid,id,action_id,state,started_at,ended_at," \
+    "real_time,execution_time,progress_done,progress_weight,class," \
+    "action_class,execution_time,queue,data,children\n"
+STEP_LINE = "plan-1,1,2,success,2024-09-04 00:00:00,2024-09-04 00:00:10,10," \
+    "4,1,1,Dynflow::ExecutionPlan::Steps::RunStep,Actions::Katello::" \
+    "Repository::Sync,,default,,\n"
+
+HEADER = "id,type,label,started_at,ended_at,state,result,external_id," \
+         "parent_task_id,start_at,start_before,action,user_id," \
+         "state_updated_at\n"
+
+
+def task_line(uuid, started_at, ended_at):
+    return f"{uuid},ForemanTasks::Task::DynflowTask,Actions::Katello::" \
+           f"Repository::Sync,{started_at},{ended_at},stopped,success," \
+           f"plan-{uuid},,,,,1,\n"
+
+
+def test_header_skipped(tmp_path):
+    fname = tmp_path / "foreman_tasks_tasks"
+    fname.write_text(HEADER +
+                     task_line("t1", "2024-09-04 00:00:00",
+                               "2024-09-04 00:01:00") +
+                     task_line("t2", "not a time", ""))
+    counters.clear()
+    tasks = list(iter_tasks(fname, [], [], 0, float('inf')))
+    assert [(duration, uuid) for duration, uuid, plan, label, state in
+            tasks] == [(60.0, "t1")]
+    assert counters['foreman_tasks_tasks: skipped header'] == 1
+    assert counters['foreman_tasks_tasks: skipped bad timestamp'] == 1
+    assert counters['foreman_tasks_tasks: rows read'] == 3
+
+
+def test_no_header(tmp_path):
+    fname = tmp_path / "foreman_tasks_tasks"
+    fname.write_text(task_line("t1", "2024-09-04 00:00:00",
+                               "2024-09-04 00:00:30"))
+    counters.clear()
+    assert len(list(iter_tasks(fname, [], [], 0, float('inf')))) == 1
+    assert counters['foreman_tasks_tasks: skipped header'] == 0
+
+
+def test_steps_header_skipped():
+    counters.clear()
+    assert parse_step(STEPS_HEADER.split(',')) is None
+    step = parse_step(STEP_LINE.split(','))
+    assert (step.plan, step.finish-step.start, step.exectime) == \
+        ("plan-1", 10.0, 4.0)
+    assert counters == {'dynflow_steps: skipped header': 1}
+
+
+def test_steps_header_not_other_task(tmp_path):
+    fname = tmp_path / "dynflow_steps"
+    fname.write_text(STEPS_HEADER + STEP_LINE)
+    counters.clear()
+    steps = parse_steps_chunk(fname, 0, os.path.getsize(fname), {"plan-1"})
+    assert len(steps["plan-1"]) == 1
+    assert counters['dynflow_steps: skipped header'] == 1
+    assert counters['dynflow_steps: skipped other task'] == 0
+    assert counters['dynflow_steps: skipped bad timestamp or time'] == 0
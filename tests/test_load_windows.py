@@ -0,0 +1,99 @@
+# LoadWindows answers windows by binary searches over indices built once; it
+# must give the same results like truncating the steps to each window by
+# steps_within and computing their heat intervals, as analysis_session.py
+# did per query.
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from dynflow_records import Step, StepColumns  # noqa: E402
+import sidekiq_load  # noqa: E402
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'numpy':
+        if sidekiq_load.np is None:
+            pytest.skip("numpy not available")
+    else:
+        monkeypatch.setattr(sidekiq_load, 'np', None)
+    return request.param
+
+
+def random_steps(seed, count):
+    rnd = random.Random(seed)
+    steps = StepColumns()
+    for i in range(count):
+        start = 1000 + rnd.randint(0, 4000)/4
+        finish = start + rnd.choice([0.0, 0.5, rnd.randint(1, 400)/4,
+                                     rnd.uniform(0, 200)])
+        if rnd.random() < 0.02:
+            finish = float('nan')
+        realtime = finish-start if finish == finish else 10
+        exectime = rnd.uniform(0, 1) * realtime
+        steps.append(Step('plan', str(i), start, finish, realtime,
+                          exectime, f"Label{rnd.randint(0, 7)}"))
+    return steps
+
+
+def reference(steps, from_ts, to_ts):
+    starts, finishes, exectimes, step_labels, labels = \
+        sidekiq_load.steps_within(steps, from_ts, to_ts)
+    if len(starts) == 0:
+        return 0, None, None, labels
+    heat_starts, heat_ends, heat_steps, heat_loads = \
+        sidekiq_load.compute_heat_intervals(starts, finishes, exectimes,
+                                            till_finish=True)
+    peak = max(range(len(heat_loads)), key=heat_loads.__getitem__)
+    return (len(starts), float(sum(exectimes)),
+            (int(max(heat_steps)), heat_loads[peak], heat_starts[peak]),
+            labels)
+
+
+def windows(seed, count):
+    rnd = random.Random(seed)
+    result = [(0, 5000), (1000, 1000.5), (1500, 1500), (2250, 2251),
+              (3000, 3100), (900, 1000), (2200.25, 2200.75)]
+    for i in range(count):
+        from_ts = 950 + rnd.randint(0, 4400)/4
+        result.append((from_ts, from_ts + rnd.choice([
+            0.25, rnd.randint(1, 400)/4, rnd.uniform(0, 3000)])))
+    return result
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_windows_match_steps_within(engine, seed):
+    steps = random_steps(seed, 400)
+    load_windows = sidekiq_load.LoadWindows(steps)
+    for from_ts, to_ts in windows(seed, 200):
+        count, exectime, peak, labels = reference(steps, from_ts, to_ts)
+        assert load_windows.steps(from_ts, to_ts) == count
+        if count == 0:
+            assert load_windows.peak(from_ts, to_ts) is None
+            assert load_windows.label_summaries(from_ts, to_ts) == {}
+            continue
+        assert load_windows.exectime(from_ts, to_ts) == \
+            pytest.approx(exectime, rel=1e-9, abs=1e-6)
+        max_steps, max_load, max_load_at = load_windows.peak(from_ts, to_ts)
+        assert max_steps == peak[0]
+        assert max_load == pytest.approx(peak[1], rel=1e-9, abs=1e-9)
+        assert max_load_at == pytest.approx(peak[2])
+        summaries = load_windows.label_summaries(from_ts, to_ts)
+        assert summaries.keys() == labels.keys()
+        for label, summary in summaries.items():
+            assert summary['count'] == labels[label]['count']
+            assert summary['exectime'] == pytest.approx(
+                labels[label]['exectime'], rel=1e-9, abs=1e-6)
+
+
+def test_no_steps(engine):
+    load_windows = sidekiq_load.LoadWindows(StepColumns())
+    assert load_windows.steps(0, 100) == 0
+    assert load_windows.peak(0, 100) is None
+    assert load_windows.label_summaries(0, 100) == {}
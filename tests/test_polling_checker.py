@@ -0,0 +1,39 @@
+# Delays of pollings of pulp tasks reported by PollingChecker are the whole
+# time between the pollings.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from polling_log import PollingChecker  # noqa: E402
+
+TASK = "0190a6f4-1c2d-7e3f-8a4b-000000000001"
+
+
+def poll_line(timestamp):
+    return (f'192.168.0.1 - - [{timestamp} +0000] '
+            f'"GET /pulp/api/v3/tasks/{TASK}/ HTTP/1.1" 200 1234\n')
+
+
+def delays(timestamps, maxdelay=18, evict_after=86400):
+    checker = PollingChecker(maxdelay, evict_after)
+    return [diff for task_id, prev, now, diff
+            in checker.check_lines(poll_line(ts) for ts in timestamps)]
+
+
+def test_delay():
+    assert delays(['30/Aug/2023:04:13:53', '30/Aug/2023:04:14:10',
+                   '30/Aug/2023:04:14:49']) == [39]
+
+
+def test_out_of_order_not_reported():
+    # negative delay, not almost a day like timedelta.seconds would give
+    assert delays(['30/Aug/2023:04:14:49', '30/Aug/2023:04:13:53']) == []
+
+
+def test_delay_over_day():
+    # whole days count to the delay
+    assert delays(['29/Aug/2023:04:13:53', '30/Aug/2023:04:13:58'],
+                  evict_after=3*86400) == [86405]
@@ -0,0 +1,72 @@
+# Lookups of pulp tasks in PulpTaskIndex by binary search over their UUIDs
+# stored as two 64bit halves.
+
+from array import array
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from pulp_task_index import COLUMNS, PulpTaskIndex, \
+    _uuid_halves  # noqa: E402
+
+# the first three share the high half
+UUID1 = "0190a6f4-1c2d-7e3f-8a4b-000000000001"
+UUID2 = "0190a6f4-1c2d-7e3f-8a4b-000000000002"
+UUID3 = "0190a6f4-1c2d-7e3f-8a4b-0000000000ff"
+UUID4 = "ffffffff-0000-4000-8000-000000000000"
+
+
+def make_index(owners, plans, tasks):
+    """
+    Return PulpTaskIndex of owners as {pulp task UUID: (plan id, action
+    id)}.
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    for (high, low), (plan_id, action_id) in sorted(
+            (_uuid_halves(uuid), owner) for uuid, owner in owners.items()):
+        columns['uuid_high'].append(high)
+        columns['uuid_low'].append(low)
+        columns['plan'].append(plan_id)
+        columns['action'].append(action_id)
+    return PulpTaskIndex(columns, plans, tasks)
+
+
+def test_uuid_halves():
+    assert _uuid_halves("00000000-0000-0000-0000-000000000001") == (0, 1)
+    assert _uuid_halves("00000001-0000-0000-ffff-ffffffffffff") == \
+        (1 << 32, 0xffffffffffffffff)
+    high1, low1 = _uuid_halves(UUID1)
+    high2, low2 = _uuid_halves(UUID2)
+    assert high1 == high2 and low1 != low2
+    assert _uuid_halves("not-a-uuid") is None
+    assert _uuid_halves("0190a6f4-1c2d-7e3f-8a4b-00000000000g") is None
+
+
+def test_owner():
+    index = make_index({UUID1: (0, 11), UUID2: (1, 22), UUID3: (0, 33),
+                        UUID4: (1, 44)},
+                       ['plan-a', 'plan-b'],
+                       [['foreman-a', 'Actions::Katello::Repository::Sync'],
+                        None])
+    assert index.rows == 4
+    # hits, also among UUIDs sharing the high half
+    assert index.owner(UUID1) == ('plan-a', '11', 'foreman-a',
+                                  'Actions::Katello::Repository::Sync')
+    assert index.owner(UUID3) == ('plan-a', '33', 'foreman-a',
+                                  'Actions::Katello::Repository::Sync')
+    # unknown foreman task of the plan
+    assert index.owner(UUID2) == ('plan-b', '22', None, None)
+    assert index.owner(UUID4) == ('plan-b', '44', None, None)
+    # misses: the same high half but other low half, other high half, not a
+    # UUID at all
+    assert index.owner("0190a6f4-1c2d-7e3f-8a4b-000000000003") is None
+    assert index.owner("0190a6f4-1c2d-7e3f-8a4c-000000000001") is None
+    assert index.owner("00000000-0000-0000-0000-000000000000") is None
+    assert index.owner("not-a-uuid") is None
+
+
+def test_empty_index():
+    index = make_index({}, [], [])
+    assert index.owner(UUID1) is None
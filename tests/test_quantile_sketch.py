@@ -0,0 +1,77 @@
+# Quantiles estimated by QuantileSketch are within its relative accuracy of
+# the exact ones (the value at rank q*(n-1) of the sorted values).
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from quantile_sketch import QuantileSketch  # noqa: E402
+
+QUANTILES = (0, 0.01, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1)
+
+
+def exact_quantile(values_sorted, q):
+    return values_sorted[int(q * (len(values_sorted)-1))]
+
+
+def distributions():
+    rnd = random.Random(42)
+    yield 'uniform', [rnd.uniform(0.001, 1000) for i in range(20000)]
+    yield 'lognormal', [rnd.lognormvariate(0, 3) for i in range(20000)]
+    yield 'with zeros', [rnd.choice([0.0, rnd.expovariate(0.1)])
+                         for i in range(20000)]
+    yield 'constant', [3.5] * 1000
+
+
+@pytest.mark.parametrize('name,values', list(distributions()))
+@pytest.mark.parametrize('accuracy', [0.01, 0.05])
+def test_accuracy(name, values, accuracy):
+    sketch = QuantileSketch(accuracy)
+    for value in values:
+        sketch.add(value)
+    values_sorted = sorted(values)
+    assert sketch.count == len(values)
+    for q in QUANTILES:
+        exact = exact_quantile(values_sorted, q)
+        assert abs(sketch.quantile(q) - exact) <= accuracy * exact + 1e-12
+
+
+def test_empty():
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_max_buckets():
+    # values spread over much more buckets than allowed, the lowest ones
+    # coming last
+    values = [1.1**i for i in range(2000, 0, -1)]
+    sketch = QuantileSketch(0.01, max_buckets=100)
+    for value in values:
+        sketch.add(value)
+    assert len(sketch.buckets) <= 100
+    # values below the merged buckets do not create new buckets
+    assert min(sketch.buckets.keys()) == sketch.floor
+    # high quantiles keep their accuracy
+    values_sorted = sorted(values)
+    for q in (0.99, 1):
+        exact = exact_quantile(values_sorted, q)
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact
+    # all values are counted
+    assert sum(sketch.buckets.values()) == len(values)
+
+
+def test_merges_bounded_by_keys():
+    # once over max_buckets, adding more values of the same buckets does not
+    # merge buckets again
+    sketch = QuantileSketch(0.01, max_buckets=10)
+    merges = 0
+    for i in range(20000):
+        floor = sketch.floor
+        sketch.add(2.0**(-(i % 50)))
+        merges += sketch.floor != floor
+    assert len(sketch.buckets) <= 10
+    assert merges <= 50
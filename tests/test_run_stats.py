@@ -0,0 +1,32 @@
+# Peak memory of worker processes is reported only if some ran.
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import run_stats  # noqa: E402
+
+
+def report(stats):
+    _file = io.StringIO()
+    stats.report('text', _file)
+    return _file.getvalue()
+
+
+def test_no_workers(monkeypatch):
+    stats = run_stats.RunStats('text')
+    monkeypatch.setattr(run_stats, 'active', stats)
+    assert 'workers' not in stats.summary()['peak_rss_kb']
+    assert 'worker processes' not in report(stats)
+
+
+def test_workers_merged(monkeypatch):
+    stats = run_stats.RunStats('text')
+    monkeypatch.setattr(run_stats, 'active', stats)
+    monkeypatch.setattr(run_stats, 'counters', run_stats.Counter())
+    run_stats.merge_worker({}, None)
+    assert 'workers' in stats.summary()['peak_rss_kb']
+    assert 'worker processes' in report(stats)
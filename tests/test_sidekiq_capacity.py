@@ -0,0 +1,79 @@
+# The what-if simulation of sidekiq workers: queueing delays of steps replayed
+# through a pool of workers, and the same summaries with numpy as without it.
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sidekiq_capacity  # noqa: E402
+from sidekiq_capacity import CapacityResult, percentile, \
+    simulate_workers  # noqa: E402
+
+
+def test_simulate_workers():
+    # two steps start at once on the two workers, the third waits till the
+    # first worker gets free at 2, the fourth arriving at 1 till the second
+    # worker gets free at 2
+    waits, busy_until = simulate_workers([0, 0, 0, 1], [2, 2, 2, 1], 2)
+    assert list(waits) == [0, 0, 2, 1]
+    assert busy_until == 4
+
+
+def test_simulate_workers_input_order():
+    # waits are in the order of the input, not of the arrival
+    waits, busy_until = simulate_workers([1, 0, 0], [1, 2, 2], 1)
+    assert list(waits) == [3, 0, 2]
+    assert busy_until == 5
+
+
+def test_enough_workers():
+    waits, busy_until = simulate_workers([0, 0, 0, 1], [2, 2, 2, 1], 4)
+    assert list(waits) == [0, 0, 0, 0]
+    assert busy_until == 2
+
+
+def test_percentile():
+    assert percentile([1, 2, 3, 4, 5], 0.5) == 3
+    assert percentile([1, 2, 3, 4, 5], 0.95) == pytest.approx(4.8)
+    assert percentile([7], 0.95) == 7
+
+
+def test_capacity_result():
+    result = CapacityResult(2, [0, 0, 0, 1], [2, 2, 2, 1], [0, 1, 0, 1],
+                            ['A', 'B'])
+    assert result.span == 4
+    assert result.summary['steps'] == 4
+    assert result.summary['delayed'] == 2
+    assert result.summary['total_wait'] == 3
+    assert result.summary['utilization'] == pytest.approx(7 / 8)
+    assert result.label_summaries['A']['steps'] == 2
+    assert result.label_summaries['A']['exectime'] == 4
+    assert result.label_summaries['A']['max_wait'] == 2
+    assert result.label_summaries['B']['mean_wait'] == 0.5
+
+
+@pytest.mark.skipif(sidekiq_capacity.np is None,
+                    reason="numpy not available")
+@pytest.mark.parametrize('seed', range(3))
+def test_engines_equal(monkeypatch, seed):
+    rnd = random.Random(seed)
+    starts = [rnd.randint(0, 1000)/4 for i in range(500)]
+    exectimes = [rnd.randint(0, 40)/4 for i in range(500)]
+    step_labels = [rnd.randint(0, 5) for i in range(500)]
+    labels = [f"Label{i}" for i in range(7)]
+    result = CapacityResult(4, starts, exectimes, step_labels, labels)
+    with monkeypatch.context() as patch:
+        patch.setattr(sidekiq_capacity, 'np', None)
+        python_result = CapacityResult(4, starts, exectimes, step_labels,
+                                       labels)
+    assert list(result.waits) == list(python_result.waits)
+    assert result.summary == python_result.summary
+    assert result.label_summaries.keys() == \
+        python_result.label_summaries.keys()
+    for label, summary in result.label_summaries.items():
+        assert summary == pytest.approx(python_result.label_summaries[label])
@@ -0,0 +1,76 @@
+# Steps running at a time T per the steps index (dynflow_steps_running_at.py)
+# are those started till T and finishing after T, the same as per
+# LoadTimeline.running_at (check_dynflow_polling.py --correlate-load).
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from dynflow_records import convert_datetime_to_seconds  # noqa: E402
+import sidekiq_load  # noqa: E402
+import steps_index  # noqa: E402
+
+T = "2024-09-04 10:00:00"
+# (action id, started_at, ended_at) of the steps
+STEPS = [(1, "2024-09-04 09:59:00", "2024-09-04 10:00:00"),  # finished at T
+         (2, "2024-09-04 10:00:00", "2024-09-04 10:00:30"),  # started at T
+         (3, "2024-09-04 10:00:00", "2024-09-04 10:00:00"),  # zero length
+         (4, "2024-09-04 09:59:00", "2024-09-04 10:01:00"),  # running
+         (5, "2024-09-04 08:00:00", "2024-09-04 10:00:00"),  # long, at T
+         (6, "2024-09-04 08:00:00", "2024-09-04 11:00:00"),  # long, running
+         (7, "2024-09-04 09:00:00", ""),                     # unfinished
+         (8, "2024-09-04 09:00:00", "2024-09-04 09:30:00"),  # before T
+         (9, "2024-09-04 10:30:00", "2024-09-04 10:31:00"),  # after T
+         ]
+RUNNING = {2, 4, 6, 7}
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'numpy':
+        if steps_index.np is None:
+            pytest.skip("numpy not available")
+    else:
+        monkeypatch.setattr(steps_index, 'np', None)
+        monkeypatch.setattr(sidekiq_load, 'np', None)
+    return request.param
+
+
+@pytest.fixture
+def steps_fname(tmp_path):
+    fname = tmp_path / "dynflow_steps"
+    with open(fname, "w") as _file:
+        _file.write("execution_plan_uuid,id,action_id,state,started_at,"
+                    "ended_at,real_time,execution_time,progress_done,"
+                    "progress_weight,class,action_class,queue,data,"
+                    "children,extra\n")
+        for action, started_at, ended_at in STEPS:
+            _file.write(f"plan-1,{action},{action},success,{started_at},"
+                        f"{ended_at},1,1,1,1,RunStep,Label{action},default"
+                        f",,,\n")
+    return str(fname)
+
+
+def test_running_at_boundary(engine, steps_fname):
+    at_ts = convert_datetime_to_seconds(T)
+    index = steps_index.open_steps_index(steps_fname)
+    running = {int(line.split(',')[2])
+               for line in index.lines_at(steps_fname, at_ts)}
+    assert running == RUNNING
+    # window queries keep including steps touching the window
+    touching = {int(line.split(',')[2])
+                for line in index.lines(steps_fname, at_ts, at_ts)}
+    assert touching == RUNNING | {1, 3, 5}
+
+
+def test_running_at_agrees_with_load_timeline(engine, steps_fname):
+    at_ts = convert_datetime_to_seconds(T)
+    steps = sidekiq_load.load_steps(steps_fname, 0, float('inf'))
+    timeline = sidekiq_load.LoadTimeline(steps)
+    running = {int(steps.labels[timeline.label[row]][len("Label"):])
+               for row in timeline.running_at(at_ts)}
+    assert running == RUNNING